@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# Validator processing several inputs in one run (run_validator batch=yes)
+import json
+import sys
+
+BOUNDS = [(-(10**18), 10**18), (0, 10**9), (-(10**9), 10**9), (-(10**18), 10**18)]
+
+
+def validate(content, test):
+    lines = content.split("\n")
+    if len(lines) != 2 or lines[1] != "":
+        return "Expected exactly one line."
+    try:
+        numbers = list(map(int, lines[0].split(" ")))
+    except ValueError as err:
+        return str(err)
+    if len(numbers) != 2:
+        return f"The number of values was {len(numbers)} and should have been 2."
+    minimum, maximum = BOUNDS[test]
+    if any(not minimum <= x <= maximum for x in numbers):
+        return "A value is out of bounds."
+    return None
+
+
+for line in sys.stdin:
+    testcase = json.loads(line)
+    with open(testcase["stdin"]) as f:
+        error = validate(f.read(), int(testcase["args"][0]))
+    if error is not None and testcase["stderr"] is not None:
+        with open(testcase["stderr"], "w") as f:
+            print(error, file=f)
+    print(1 if error else 42, flush=True)
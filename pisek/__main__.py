@@ -42,6 +42,7 @@ from pisek.utils.argparse_util import (
 from pisek.visualize import visualize
 from pisek.init import init_task
 from pisek.config.config_hierarchy import DEFAULT_CONFIG_FILENAME
+from pisek.env.env import JobExecutor
 from pisek.config.config_tools import export_config, update_and_replace_config
 from pisek.version import print_version
 
@@ -54,6 +55,18 @@ from pisek.utils.pipeline_tools import (
     assert_task_dir,
 )
 from pisek.utils.paths import INTERNALS_DIR
+from pisek.jobs.shared_cache import SHARED_CACHE_ENV, SHARED_CACHE_KEY_ENV
+from pisek.jobs.executors import WORKER_KEY_ENV, DEFAULT_WORKER_PORT
+from pisek.jobs.resources import available_cpus
+from pisek.jobs.worker import run_worker
+from pisek.jobs.cache import (
+    DEFAULT_HASH_ALGORITHM,
+    HASH_ALGORITHMS,
+    MAX_CACHE_ENTRIES,
+    MAX_CACHE_SIZE,
+    MB,
+)
+from pisek.jobs.cache_tools import print_cache_stats, prune_cache
 
 LOG_FILE = os.path.join(INTERNALS_DIR, "log")
 
@@ -179,6 +192,27 @@ def _main(argv: list[str]) -> None:
         type=int,
         help="how many jobs to run in parallel",
     )
+    parser_test.add_argument(
+        "--executor",
+        choices=list(JobExecutor),
+        default=JobExecutor.threads,
+        help="run jobs in threads, in separate processes or on remote workers (default threads, processes are faster for jobs doing a lot of work in Python)",
+    )
+    parser_test.add_argument(
+        "--workers",
+        type=lambda workers: workers.split(","),
+        help=f"comma separated HOST:PORT addresses of workers for the remote executor (workers must see the task at the same path, ${WORKER_KEY_ENV} must match)",
+    )
+    parser_test.add_argument(
+        "--isolate-timing",
+        action="store_true",
+        help="run solutions on dedicated CPU cores for more stable time measurements",
+    )
+    parser_test.add_argument(
+        "--warm-start",
+        action="store_true",
+        help="start generators, validators and judges faster (Python in pre-imported interpreters, Java from class data archives)",
+    )
     parser_test.add_argument(
         "--verbosity",
         "-v",
@@ -230,11 +264,81 @@ def _main(argv: list[str]) -> None:
         action="store_true",
         help="show resource usage statistics",
     )
+    parser_test.add_argument(
+        "--shared-cache",
+        type=str,
+        help=f"also use cache in SHARED_CACHE directory (can be shared between task directories and machines, default ${SHARED_CACHE_ENV}, requires a secret key in ${SHARED_CACHE_KEY_ENV})",
+    )
+    parser_test.add_argument(
+        "--shared-cache-size",
+        type=int,
+        default=10 * 1024,
+        help="limit size of the shared cache to SHARED_CACHE_SIZE megabytes (default 10240)",
+    )
+    parser_test.add_argument(
+        "--file-hash",
+        choices=HASH_ALGORITHMS,
+        default=DEFAULT_HASH_ALGORITHM,
+        help=f"algorithm for hashing files in cache (default {DEFAULT_HASH_ALGORITHM}, xxh3 needs the xxhash package)",
+    )
+    parser_test.add_argument(
+        "--output-store",
+        choices=["auto", "always", "never"],
+        default="auto",
+        help="keep copies of files produced by jobs in cache, so deleted files get restored instead of recomputed (default auto, only if the filesystem supports reflinks, so that they don't take extra disk space)",
+    )
+
+    # ------------------------------- pisek worker -------------------------------
+
+    parser_worker = subparsers.add_parser(
+        "worker", help="run jobs for pisek instances using the remote executor"
+    )
+    parser_worker.add_argument(
+        "--listen",
+        type=str,
+        default=f"127.0.0.1:{DEFAULT_WORKER_PORT}",
+        help=f"HOST:PORT to listen on (default 127.0.0.1:{DEFAULT_WORKER_PORT}, secret key ${WORKER_KEY_ENV} is required and must be the same for its clients)",
+    )
+    parser_worker.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=available_cpus(),
+        help="how many jobs to run in parallel (default number of CPUs)",
+    )
 
     # ------------------------------- pisek clean -------------------------------
 
     parser_clean = subparsers.add_parser("clean", help="clean task directory")
 
+    # ------------------------------- pisek cache -------------------------------
+
+    parser_cache = subparsers.add_parser("cache", help="manage cache")
+    cache_subparsers = parser_cache.add_subparsers(
+        help="subcommand to run", dest="cache_subcommand", required=True
+    )
+    cache_subparsers.add_parser("stats", help="show cache statistics")
+    parser_prune = cache_subparsers.add_parser(
+        "prune", help="remove least recently used cache entries"
+    )
+    parser_prune.add_argument(
+        "--max-size",
+        type=int,
+        default=MAX_CACHE_SIZE // MB,
+        help=f"keep cache smaller than MAX_SIZE megabytes (default {MAX_CACHE_SIZE // MB})",
+    )
+    parser_prune.add_argument(
+        "--max-entries",
+        type=int,
+        default=MAX_CACHE_ENTRIES,
+        help=f"keep at most MAX_ENTRIES entries (default {MAX_CACHE_ENTRIES})",
+    )
+    parser_prune.add_argument(
+        "--max-age",
+        type=argparse_nonnegative_Decimal,
+        help="remove entries not used for MAX_AGE days",
+    )
+
     # ------------------------------- pisek init -------------------------------
 
     parser_task = subparsers.add_parser("init", help="create a task skeleton")
@@ -361,6 +465,8 @@ def _main(argv: list[str]) -> None:
         return print_version()
     elif args.subcommand == "init":
         return init_task(args.config_filename, args.no_jumps)
+    elif args.subcommand == "worker":
+        return run_worker(args.listen, args.jobs)
 
     # !!! Ensure this is always run before clean_directory !!!
     assert_task_dir(PATH, args.pisek_dir, args.config_filename)
@@ -381,6 +487,10 @@ def _main(argv: list[str]) -> None:
     root_logger.addHandler(json_logging.get_handler())
 
     if args.subcommand == "test":
+        if args.shared_cache is None:
+            args.shared_cache = os.environ.get(SHARED_CACHE_ENV)
+        if args.shared_cache is not None:
+            args.shared_cache = os.path.abspath(args.shared_cache)
         return test_task(args)
 
     elif args.subcommand == "config":
@@ -427,6 +537,18 @@ def _main(argv: list[str]) -> None:
         else:
             assert False, "Unknown command"
 
+    elif args.subcommand == "cache":
+        if args.cache_subcommand == "stats":
+            return print_cache_stats()
+        elif args.cache_subcommand == "prune":
+            return locked_folder(prune_cache)(
+                args.max_size,
+                args.max_entries,
+                None if args.max_age is None else float(args.max_age),
+            )
+        else:
+            assert False, "Unknown command"
+
     elif args.subcommand == "clean":
         return clean_directory()
     elif args.subcommand == "visualize":
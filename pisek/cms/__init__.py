@@ -62,9 +62,12 @@ from pisek.utils.util import clean_non_relevant_files
 
 
 def generate_testcases(env: Env) -> list[IInputPath]:
-    env = env.fork()
-    env.solutions = [env.config.primary_solution]
-    env.target = TestingTarget.solutions
+    env = env.model_copy(
+        update={
+            "solutions": [env.config.primary_solution],
+            "target": TestingTarget.solutions,
+        }
+    )
 
     pipeline = TaskPipeline(env)
     cache = Cache.load()
@@ -756,6 +756,7 @@ class RunSection(BaseEnv):
     mem_limit: int = Field(ge=0)  # [MB]
     process_limit: int = Field(ge=0)  # [1]
     # limit=0 means unlimited
+    batch: bool  # Program can process several testcases in one run
     args: ListStr
     env: dict[str, str]
 
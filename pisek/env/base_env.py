@@ -14,72 +14,54 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import threading
 from typing import Any, TYPE_CHECKING
 
 from pisek.env.context import ContextModel
 
 
+class _Accesses(threading.local):
+    """Names accessed in each env in the current thread."""
+
+    def __init__(self) -> None:
+        # Envs are compared by identity (they aren't hashable) and kept alive,
+        # so their ids cannot be reused by other objects until cleared
+        self.by_env: dict[int, tuple["BaseEnv", set[str]]] = {}
+
+
+_accesses = _Accesses()
+
+
 class BaseEnv(ContextModel):
     """
     Collection of environment variables which logs whether each variable was accessed.
-    """
-
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self._accessed: set[str] = set()
-        self._logging: bool = True
 
-        self._direct_subenvs: list[str] = []
-        self._dict_subenvs: list[str] = []
-        self._precompute_subenvs()
+    Accesses are logged separately for each thread, so one env
+    can be shared by jobs running in parallel.
+    """
 
     if not TYPE_CHECKING:
         # XXX: This is a bit black-magicky because of efficiency
         # Be careful when touching this
         def __getattribute__(self, item: str) -> Any:
-            if not item.startswith("_") and hasattr(self, "_accessed"):
-                super().__getattribute__("_accessed").add(item)
+            if not item.startswith("_"):
+                entry = _accesses.by_env.get(id(self))
+                if entry is None:
+                    entry = _accesses.by_env[id(self)] = (self, set())
+                entry[1].add(item)
             return ContextModel.__getattribute__(self, item)
 
-    def fork(self):
-        """Make copy of this env with no accesses logged."""
-        model = self.model_copy(deep=True)
-        model.clear_accesses()
-        return model
-
-    def _precompute_subenvs(self):
-        def is_env(item: Any) -> bool:
-            return isinstance(item, BaseEnv)
-
-        for key in type(self).model_fields:
-            item = getattr(self, key)
-            if is_env(item):
-                self._direct_subenvs.append(key)
-            elif isinstance(item, dict) and any(map(is_env, item.values())):
-                assert all(map(is_env, item.values()))
-                self._dict_subenvs.append(key)
-
     def clear_accesses(self) -> None:
-        """Remove all logged accesses."""
-        accessed = super().__getattribute__("_accessed")
-        for direct_subenv in super().__getattribute__("_direct_subenvs"):
-            if direct_subenv in accessed:
-                super().__getattribute__(direct_subenv).clear_accesses()
-
-        for dict_subenv in super().__getattribute__("_dict_subenvs"):
-            if dict_subenv in accessed:
-                subenv = super().__getattribute__(dict_subenv)
-                for subitem in subenv.values():
-                    subitem.clear_accesses()
-
-        super().__getattribute__("_accessed").clear()
+        """Remove all accesses logged in this thread (in all envs)."""
+        _accesses.by_env.clear()
 
     def get_accessed(self) -> set[tuple[str, ...]]:
-        """Get all accessed field names in this env (and all subenvs)."""
+        """Get all field names accessed in this thread in this env (and all subenvs)."""
         cls = type(self)
         accessed = set()
-        self._accessed &= set(cls.model_fields) | set(cls.model_computed_fields)
-        for key in self._accessed:
+        fields = set(cls.model_fields) | set(cls.model_computed_fields)
+        _, names = _accesses.by_env.get(id(self), (self, set()))
+        for key in names & fields:
             item = getattr(self, key)
             if isinstance(item, BaseEnv):
                 accessed |= {(key, *subkey) for subkey in item.get_accessed()}
@@ -17,7 +17,7 @@
 from decimal import Decimal
 from enum import StrEnum, auto
 import os
-from pydantic import Field
+from pydantic import ConfigDict, Field
 from typing import assert_never, Optional
 
 from pisek.utils.colors import color_settings
@@ -25,6 +25,7 @@ from pisek.env.base_env import BaseEnv
 from pisek.config.config_hierarchy import DEFAULT_CONFIG_FILENAME
 from pisek.config.task_config import load_config, TaskConfig
 from pisek.config.select_solutions import expand_solutions
+from pisek.jobs.resources import available_cpus
 
 
 class TestingTarget(StrEnum):
@@ -35,14 +36,25 @@ class TestingTarget(StrEnum):
     solutions = auto()
 
 
+class JobExecutor(StrEnum):
+    threads = auto()
+    processes = auto()
+    remote = auto()
+
+
 class Env(BaseEnv):
     """
     Collection of environment variables for task testing.
+    Shared by all jobs, so it is frozen (use model_copy(update=...) to change it).
 
     Attributes:
         target: What is being tested
         config: Environment variables defined by task config
         jobs: How many jobs to run at most in parallel
+        executor: Where to run jobs (threads, processes or remote workers)
+        workers: Addresses of remote workers
+        isolate_timing: Run solutions on CPU cores not used by other jobs
+        warm_start: Start programs other than solutions faster (Python in pre-imported interpreters, Java from class data archives)
         verbosity: How much verbose to be
         file_contents: Show file contents in errors
         full: Whether to stop after the first failure
@@ -61,6 +73,10 @@ class Env(BaseEnv):
     target: TestingTarget
     config: TaskConfig
     jobs: int
+    executor: JobExecutor
+    workers: list[str]
+    isolate_timing: bool
+    warm_start: bool
     verbosity: int
     file_contents: bool
     full: bool
@@ -75,10 +91,16 @@ class Env(BaseEnv):
     repeat: int = Field(ge=1)
     iteration: int = Field(ge=0)
 
+    model_config = ConfigDict(frozen=True)
+
     @staticmethod
     def load(
         target: TestingTarget | None = TestingTarget.all,
         jobs: int | None = None,
+        executor: JobExecutor = JobExecutor.threads,
+        workers: list[str] | None = None,
+        isolate_timing: bool = False,
+        warm_start: bool = False,
         verbosity: int = 0,
         file_contents: bool = False,
         full: bool = False,
@@ -120,9 +142,11 @@ class Env(BaseEnv):
 
         return Env(
             target=TestingTarget(TestingTarget.all if target is None else target),
-            jobs=(
-                max(1, min((os.cpu_count() or 2) // 2, 32)) if jobs is None else jobs
-            ),
+            jobs=(max(1, min(available_cpus() // 2, 32)) if jobs is None else jobs),
+            executor=JobExecutor(executor),
+            workers=workers or [],
+            isolate_timing=isolate_timing,
+            warm_start=warm_start,
             config=config,
             verbosity=verbosity,
             file_contents=file_contents,
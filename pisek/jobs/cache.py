@@ -14,24 +14,93 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 import hashlib
-import time
-from typing import Any, Iterable
+from typing import Any, Callable, Iterable, Iterator
 import os
 import pickle
+import shutil
+import time
 
 from pisek.version import __version__
+from pisek.user_errors import NotSupported
+from pisek.env.base_env import BaseEnv
 from pisek.utils.text import eprint
 from pisek.utils.colors import color_settings
 from pisek.utils.paths import INTERNALS_DIR, TaskPath
+from pisek.utils.util import clone_file, globs_to_files, reflink_file
 from pisek.jobs.logging import LogEntry
+from pisek.jobs.shared_cache import SharedCache
 
 CACHE_VERSION_FILE = os.path.join(INTERNALS_DIR, "cache_version")
-CACHE_CONTENT_FILE = os.path.join(INTERNALS_DIR, "cache")
-HASH_INDEX_FILE = os.path.join(INTERNALS_DIR, "hash_index")
+CACHE_CONTENT_DIR = os.path.join(INTERNALS_DIR, "cache")
+HASH_INDEX_DIR = os.path.join(INTERNALS_DIR, "hash_index")
+OBJECTS_DIR = os.path.join(INTERNALS_DIR, "objects")
+CACHE_FORMAT = 8  # Increase on every change of the cache file format
 SAVED_LAST_SIGNATURES = 5
-CACHE_SAVE_INTERVAL = 1  # seconds
+# Rewrite journals once they have this many times more records than needed
+COMPACTION_RATIO = 2
+MB = 1024 * 1024
+# Cache larger than this is pruned after testing
+MAX_CACHE_SIZE = 4096 * MB
+MAX_CACHE_ENTRIES = 100_000
+# Automatic pruning shrinks the cache to this fraction of MAX_CACHE_SIZE
+AUTO_PRUNE_TARGET = 0.75
+# Files modified this recently when hashed could be modified again
+# with the same timestamp, so their hashes are not remembered
+RACY_WINDOW_NS = 50_000_000
+
+HASH_ALGORITHMS = ["sha256", "blake2b", "xxh3"]
+DEFAULT_HASH_ALGORITHM = "sha256"
+HASHING_THREADS = min(32, os.cpu_count() or 1)
+
+# (st_dev, st_ino, st_size, st_mtime_ns)
+# Not st_ctime_ns as hardlinking (which doesn't change contents) changes it
+FileKey = tuple[int, int, int, int]
+
+
+def _hash_prefix(algorithm: str) -> str:
+    # Hashes keep the sha256 format for compatibility
+    return "" if algorithm == DEFAULT_HASH_ALGORITHM else f"{algorithm}-"
+
+
+def _hash_constructor(algorithm: str) -> Callable[[], Any]:
+    if algorithm == "xxh3":
+        try:
+            import xxhash  # type: ignore[import-not-found]
+        except ImportError:
+            raise NotSupported("Hashing files with xxh3 requires the xxhash package.")
+        return xxhash.xxh3_128
+    return lambda: hashlib.new(algorithm)
+
+
+class FileHasher:
+    """Computes file hashes in the same format as Cache, incrementally."""
+
+    def __init__(self, algorithm: str) -> None:
+        self._algorithm = algorithm
+        self._digest = _hash_constructor(algorithm)()
+
+    def update(self, data: bytes | memoryview) -> None:
+        self._digest.update(data)
+
+    def hexdigest(self) -> str:
+        return _hash_prefix(self._algorithm) + self._digest.hexdigest()
+
+
+def file_key(path: str) -> FileKey:
+    """Identification of current file version used by the hash index."""
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _hash_file(path: str, algorithm: str) -> tuple[int, str]:
+    """Hash file contents. Returns also time when hashing started."""
+    hashing_start = time.time_ns()
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, lambda: FileHasher(algorithm))  # type: ignore[arg-type, return-value]
+    return hashing_start, digest.hexdigest()
 
 
 @dataclass(frozen=True, order=True)
@@ -49,6 +118,72 @@ class GlobsToFilesArgs:
         object.__setattr__(self, "exclude", tuple(sorted(exclude)))
 
 
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+class RunMemo:
+    """
+    Memoization of values jobs depend on, shared by signatures within a single run.
+    (Env doesn't change during a run, glob expansions are checked against
+    modification times of the directories.)
+    """
+
+    def __init__(self) -> None:
+        self._env_values: dict[tuple[str, ...], str | None] = {}
+        # args -> (directories with their mtimes, files)
+        self._globs: dict[
+            GlobsToFilesArgs, tuple[list[tuple[str, int]], list[TaskPath]]
+        ] = {}
+        self._average_durations: dict[str, float | None] = {}
+
+    def env_value(self, env_key: tuple[str, ...], env: BaseEnv) -> str | None:
+        """Value of env_key in env as a string, or None if it doesn't exist."""
+        if env_key not in self._env_values:
+            try:
+                value: str | None = f"{env.get_compound(env_key)}"
+            except (AttributeError, TypeError, ValueError, KeyError):
+                value = None
+            self._env_values[env_key] = value
+        return self._env_values[env_key]
+
+    def globs_to_files(self, args: GlobsToFilesArgs) -> list[TaskPath]:
+        """Files matching given globs."""
+        if (memo := self._globs.get(args)) is not None:
+            directories, files = memo
+            if all(_mtime_ns(d) == mtime for d, mtime in directories):
+                return files
+
+        expansion_start = time.time_ns()
+        directories = [(args.directory.path, _mtime_ns(args.directory.path))]
+        for root, dirs, _ in os.walk(args.directory.path):
+            directories += [
+                (d := os.path.join(root, name), _mtime_ns(d)) for name in dirs
+            ]
+        files = globs_to_files(args.globs, args.directory, args.exclude)
+
+        # Directory modified at the same time could be modified again unnoticed
+        if all(expansion_start - mtime > RACY_WINDOW_NS for _, mtime in directories):
+            self._globs[args] = (directories, files)
+        else:
+            self._globs.pop(args, None)
+        return files
+
+    def average_duration(
+        self, segment: str, durations: Callable[[], list[float]]
+    ) -> float | None:
+        """Average of durations of jobs in segment, or None if there are none."""
+        if segment not in self._average_durations:
+            values = durations()
+            self._average_durations[segment] = (
+                sum(values) / len(values) if values else None
+            )
+        return self._average_durations[segment]
+
+
 @dataclass
 class CacheEntry:
     """Object representing single cached job."""
@@ -62,6 +197,11 @@ class CacheEntry:
     globs: list[GlobsToFilesArgs]
     output: list[tuple[str, bool]]
     logs: list[LogEntry]
+    produced: dict[str, str]
+    duration: float
+    dependencies: str
+    last_hit: float
+    hits: int
 
     def __init__(
         self,
@@ -74,6 +214,8 @@ class CacheEntry:
         prerequisites_results: Iterable[str],
         output: list[tuple[str, bool]],
         logs: list[LogEntry],
+        produced: dict[str, str],
+        duration: float,
     ) -> None:
         self.name = name
         self.signature = signature
@@ -84,26 +226,238 @@ class CacheEntry:
         self.globs = sorted(globs)
         self.output = output
         self.logs = logs
+        self.produced = dict(sorted(produced.items()))
+        self.duration = duration
+        self.dependencies = self._dependencies_fingerprint()
+        self.last_hit = time.time()
+        self.hits = 0
+
+    def _dependencies_fingerprint(self) -> str:
+        """
+        Cheap fingerprint of what this entry depends on (envs, files and globs),
+        but not of their values.
+        """
+        fingerprint = hashlib.sha256()
+        for env in self.envs:
+            fingerprint.update(f"{env}\00".encode())
+        fingerprint.update(b"\01")
+        for file in self.files:
+            fingerprint.update(f"{file}\00".encode())
+        fingerprint.update(b"\01")
+        for glob in self.globs:
+            fingerprint.update(f"{glob}\00".encode())
+        return fingerprint.hexdigest()
+
+
+def _cache_version() -> str:
+    return f"{__version__} (cache format {CACHE_FORMAT})"
+
+
+@dataclass(frozen=True)
+class MovedToTop:
+    """Journal record of a cache hit of an existing entry."""
+
+    name: str
+    signature: str
+    time: float
+
+
+@dataclass
+class CacheStats:
+    """Statistics of the cache contents."""
+
+    entries: int
+    names: int
+    hits: int
+    oldest_hit: float | None
+    entries_size: int
+    hash_index_size: int
+    objects: int
+    objects_size: int
+    # segment -> (entries, hits)
+    segments: dict[str, tuple[int, int]]
+
+
+class Journal:
+    """Append-only file of pickled records."""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self.records = 0
+        # End of the last complete record if an incomplete one follows
+        self._valid_end: int | None = None
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self._path) if os.path.exists(self._path) else 0
+
+    def read(self) -> Iterator[Any]:
+        """
+        Read all records in this journal.
+        An incomplete last record (e.g. after a crash or being written
+        by another process) is skipped and dropped on the next append.
+        """
+        if not os.path.exists(self._path):
+            return
+
+        self._valid_end = None
+        with open(self._path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            while f.tell() < size:
+                record_start = f.tell()
+                try:
+                    record = pickle.load(f)
+                except Exception:
+                    self._valid_end = record_start
+                    break
+                self.records += 1
+                yield record
+
+    def append(self, record: Any) -> int:
+        """
+        Append record to the end of the journal and return how much it grew.
+        Only the process holding the task directory lock can write.
+        """
+        growth = 0
+        if self._valid_end is not None:
+            # Interrupted write, drop it so that the record can be read
+            growth -= self.size - self._valid_end
+            os.truncate(self._path, self._valid_end)
+            self._valid_end = None
+        data = pickle.dumps(record)
+        # Not keeping the file open as there can be many journals
+        with open(self._path, "ab") as f:
+            f.write(data)
+        self.records += 1
+        return growth + len(data)
+
+    def rewrite(self, records: Iterable[Any]) -> int:
+        """
+        Atomically replace the journal contents with given records
+        and return how much the journal grew.
+        Journal without records is removed.
+        """
+        old_size = self.size
+        tmp_path = self._path + ".tmp"
+        self.records = 0
+        self._valid_end = None
+        with open(tmp_path, "wb") as f:
+            for record in records:
+                pickle.dump(record, f)
+                self.records += 1
+        if self.records:
+            os.replace(tmp_path, self._path)
+        else:
+            os.remove(tmp_path)
+            if os.path.exists(self._path):
+                os.remove(self._path)
+        return self.size - old_size
+
+
+def cache_segment(name: str) -> str:
+    """
+    Get the cache segment of a job with given name.
+
+    Jobs that differ only in the files they work with
+    (e.g. "Run solve on input 01.in" and "Run solve on input 02.in")
+    share a segment, so segments roughly correspond to job managers.
+    """
+    words = []
+    for word in name.split():
+        if "/" in word:
+            words.append(os.path.dirname(word))
+        elif "." not in word:
+            words.append(word)
+    return " ".join(words)
+
+
+def _segment_path(directory: str, segment: str) -> str:
+    return os.path.join(directory, hashlib.sha256(segment.encode()).hexdigest()[:32])
 
 
 class Cache:
-    """Object for caching jobs and file hashes."""
+    """
+    Object for caching jobs and file hashes.
 
-    def __init__(self) -> None:
-        os.makedirs(INTERNALS_DIR, exist_ok=True)
-        with open(CACHE_VERSION_FILE, "w") as f:
-            f.write(f"{__version__}\n")
+    Entries are split into segments (see cache_segment), and file hashes
+    are split by directory. Each segment is loaded when first needed.
+
+    Files produced by jobs are kept in an object store addressed by their hash,
+    so they can be restored when a cached job is hit but its outputs are missing.
+    (Otherwise jobs with missing outputs are rerun.) With store_outputs None,
+    files are stored only while the filesystem can reflink them, so that
+    the store doesn't take extra disk space. With a shared cache they are
+    always stored, as they are uploaded from the store.
+
+    Optionally, entries missing here are looked up in a shared cache.
+
+    Read-only cache (e.g. for statistics) can be used without
+    the task directory lock, it never writes to the cache files.
+    """
+
+    def __init__(
+        self,
+        shared: SharedCache | None = None,
+        hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+        read_only: bool = False,
+        store_outputs: bool | None = None,
+    ) -> None:
+        if not read_only:
+            os.makedirs(INTERNALS_DIR, exist_ok=True)
+        self.read_only = read_only
+        if store_outputs is None and shared is not None:
+            store_outputs = True
+        self._store_outputs = store_outputs
+        # Cache files are missing or of another version, so they aren't read
+        self._outdated = False
+        self.shared = shared
+        self.hash_algorithm = hash_algorithm
+        _hash_constructor(hash_algorithm)  # Fail early if not available
         self.cache: dict[str, list[CacheEntry]] = {}
-        self.hash_index: dict[str, tuple[float, str]] = {}
-        self.last_save = time.time()
+        self.hash_index: dict[str, tuple[FileKey, str]] = {}
+        # Hardlinked files share hashes: (st_dev, st_ino) -> (key, hash)
+        self._inode_hashes: dict[tuple[int, int], tuple[FileKey, str]] = {}
+        # name -> dependencies fingerprint -> signature -> entry
+        self._index: dict[str, dict[str, dict[str, CacheEntry]]] = {}
+
+        self._segments: dict[str, Journal] = {}
+        self._segment_names: dict[str, set[str]] = {}
+        self._hash_segments: dict[str, Journal] = {}
+        self._hash_segment_paths: dict[str, set[str]] = {}
+
+        self.memo = RunMemo()
+        # Size of the cache files, computed once needed and then kept up to date
+        self._size: int | None = None
+
+        self._hashing_pool: ThreadPoolExecutor | None = None
+        # Files being hashed, so that every file is read only once
+        self._in_flight: dict[FileKey, Future[tuple[int, str]]] = {}
+        self._sharing_pool: ThreadPoolExecutor | None = None
+        # Entries being uploaded to the shared cache
+        self._sharing: list[Future[None]] = []
 
     @classmethod
-    def load(cls) -> "Cache":
-        """Load cache file."""
-        CACHE_FILES = [CACHE_VERSION_FILE, CACHE_CONTENT_FILE, HASH_INDEX_FILE]
+    def load(
+        cls,
+        shared: SharedCache | None = None,
+        hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+        read_only: bool = False,
+        store_outputs: bool | None = None,
+    ) -> "Cache":
+        """Check cache files. Cache segments are loaded lazily."""
+        cache = Cache(shared, hash_algorithm, read_only, store_outputs)
+        CACHE_FILES = [
+            CACHE_VERSION_FILE,
+            CACHE_CONTENT_DIR,
+            HASH_INDEX_DIR,
+            OBJECTS_DIR,
+        ]
         cache_existence = list(map(os.path.exists, CACHE_FILES))
 
         if not all(cache_existence):
+            if read_only:
+                cache._outdated = True
+                return cache
             if any(cache_existence):
                 eprint(
                     color_settings.colored(
@@ -111,86 +465,543 @@ class Cache:
                         "yellow",
                     )
                 )
-            return Cache()
+            cache._reset()
+            return cache
 
         with open(CACHE_VERSION_FILE) as f:
             version = f.read().strip()
 
-        if version != __version__:
+        if version != _cache_version():
+            if read_only:
+                cache._outdated = True
+                return cache
             eprint(
                 color_settings.colored(
                     "Different version of cache found. Starting from scratch...",
                     "yellow",
                 )
             )
-            return Cache()
+            cache._reset()
+            return cache
 
-        cache = Cache()
-        cache.cache = cls.pickle_load(CACHE_CONTENT_FILE)
-        cache.hash_index = cls.pickle_load(HASH_INDEX_FILE)
         return cache
 
-    def add(self, cache_entry: CacheEntry):
-        """Add entry to cache."""
+    def start_run(self) -> None:
+        """Forget values memoized during the previous run."""
+        self.memo = RunMemo()
+
+    def _reset(self) -> None:
+        """Discard all saved cache contents."""
+        for path in (CACHE_CONTENT_DIR, HASH_INDEX_DIR, OBJECTS_DIR):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            os.makedirs(path)
+        with open(CACHE_VERSION_FILE, "w") as f:
+            f.write(f"{_cache_version()}\n")
+
+    def _load_segment(self, name: str) -> str:
+        """Load segment of entries with given name and return it."""
+        segment = cache_segment(name)
+        if segment in self._segments:
+            return segment
+
+        journal = Journal(_segment_path(CACHE_CONTENT_DIR, segment))
+        self._segments[segment] = journal
+        self._segment_names[segment] = set()
+        for record in self._read(journal):
+            if isinstance(record, CacheEntry):
+                self._insert(record, segment)
+            elif isinstance(record, MovedToTop):
+                self._move_to_top(record.name, record.signature, record.time)
+        self._compact_segment(segment)
+        return segment
+
+    def _load_hash_segment(self, path: str) -> str:
+        """Load segment of file hashes of directory containing path and return it."""
+        segment = os.path.dirname(path)
+        if segment in self._hash_segments:
+            return segment
+
+        journal = Journal(_segment_path(HASH_INDEX_DIR, segment))
+        self._hash_segments[segment] = journal
+        self._hash_segment_paths[segment] = set()
+        for file_path, key, file_hash in self._read(journal):
+            self.hash_index[file_path] = (key, file_hash)
+            self._inode_hashes[key[:2]] = (key, file_hash)
+            self._hash_segment_paths[segment].add(file_path)
+        self._compact_hash_segment(segment)
+        return segment
+
+    def _read(self, journal: Journal) -> Iterator[Any]:
+        return iter(()) if self._outdated else journal.read()
+
+    def _insert(self, cache_entry: CacheEntry, segment: str) -> None:
         if cache_entry.name not in self.cache:
             self.cache[cache_entry.name] = []
+            self._segment_names[segment].add(cache_entry.name)
         self.cache[cache_entry.name].append(cache_entry)
 
         # trim number of entries per cache name in order to limit cache size
         self.cache[cache_entry.name] = self.cache[cache_entry.name][
             -SAVED_LAST_SIGNATURES:
         ]
-
-        # Throttling saves time massively
-        if time.time() - self.last_save > CACHE_SAVE_INTERVAL:
-            self.export()
+        self._index.pop(cache_entry.name, None)
+
+    def add(self, cache_entry: CacheEntry, share: bool = True):
+        """Add entry to cache (and to the shared cache if share is set)."""
+        segment = self._load_segment(cache_entry.name)
+        self._insert(cache_entry, segment)
+        self._grew(self._segments[segment].append(cache_entry))
+        if share and self.shared is not None:
+            # Uploading takes a while, so don't hold up the scheduler
+            if self._sharing_pool is None:
+                self._sharing_pool = ThreadPoolExecutor(1, thread_name_prefix="sharing")
+            self._sharing.append(
+                self._sharing_pool.submit(
+                    self.shared.add,
+                    cache_entry,
+                    {
+                        file_hash: self._object_path(file_hash)
+                        for file_hash in cache_entry.produced.values()
+                    },
+                )
+            )
 
     def __contains__(self, name: str) -> bool:
+        self._load_segment(name)
         return name in self.cache
 
     def __getitem__(self, name: str) -> list[CacheEntry]:
+        self._load_segment(name)
         return self.cache[name]
 
     def entry_names(self) -> list[str]:
+        """Names of entries in loaded segments."""
         return list(self.cache.keys())
 
     def last_entry(self, name: str) -> CacheEntry:
         return self[name][-1]
 
+    def entries_by_dependencies(self, name: str) -> dict[str, dict[str, CacheEntry]]:
+        """
+        Entries of given name grouped by their dependencies fingerprint
+        and indexed by signature. Most recent dependencies come first.
+        """
+        if name not in self._index:
+            index: dict[str, dict[str, CacheEntry]] = {}
+            for entry in reversed(self[name] if name in self else []):
+                index.setdefault(entry.dependencies, {}).setdefault(
+                    entry.signature, entry
+                )
+            self._index[name] = index
+        return self._index[name]
+
+    def expected_duration(self, name: str) -> float | None:
+        """
+        How long a job with given name is expected to run based on its last run.
+        Jobs never run before are estimated by similar jobs (of the same segment).
+        """
+        segment = self._load_segment(name)
+        if name in self.cache:
+            return self.cache[name][-1].duration
+
+        return self.memo.average_duration(
+            segment,
+            lambda: [
+                self.cache[similar][-1].duration
+                for similar in self._segment_names[segment]
+            ],
+        )
+
+    def _move_to_top(self, name: str, signature: str, hit_time: float) -> None:
+        for entry in self.cache.get(name, []):
+            if entry.signature == signature:
+                self.cache[name].remove(entry)
+                self.cache[name].append(entry)
+                self._index.pop(name, None)
+                entry.last_hit = hit_time
+                entry.hits += 1
+                return
+
     def move_to_top(self, entry: CacheEntry):
-        """Move given entry to most recent position."""
-        if entry in self.cache[entry.name]:
-            self.cache[entry.name].remove(entry)
-            self.cache[entry.name].append(entry)
+        """Move given entry to most recent position and record the hit."""
+        if entry in self[entry.name]:
+            hit_time = time.time()
+            self._move_to_top(entry.name, entry.signature, hit_time)
+            self._grew(
+                self._segments[cache_segment(entry.name)].append(
+                    MovedToTop(entry.name, entry.signature, hit_time)
+                )
+            )
         else:
             raise ValueError(
                 f"Cannot move to top entry which is not in Cache:\n{entry}"
             )
 
-    @staticmethod
-    def pickle_load(path: str) -> Any:
-        with open(path, "rb") as f:
-            return pickle.load(f)
+    def _compact_segment(self, segment: str) -> None:
+        if self.read_only:
+            return
+        names = self._segment_names[segment]
+        live_entries = sum(len(self.cache[name]) for name in names)
+        if self._segments[segment].records > COMPACTION_RATIO * live_entries:
+            self._grew(
+                self._segments[segment].rewrite(
+                    entry for name in names for entry in self.cache[name]
+                )
+            )
 
-    @staticmethod
-    def pickle_dump(obj: Any, path: str) -> None:
-        """Atomic pickle.dump."""
-        tmp_path = path + ".tmp"
-        with open(tmp_path, "wb") as f:
-            pickle.dump(obj, f)
-        os.rename(tmp_path, path)
+    def _compact_hash_segment(self, segment: str) -> None:
+        if self.read_only:
+            return
+        paths = self._hash_segment_paths[segment]
+        if self._hash_segments[segment].records > COMPACTION_RATIO * len(paths):
+            self._grew(
+                self._hash_segments[segment].rewrite(
+                    (path, *self.hash_index[path]) for path in paths
+                )
+            )
 
     def export(self) -> None:
-        """Export cache into a file."""
-        self.pickle_dump(self.cache, CACHE_CONTENT_FILE)
-        self.pickle_dump(self.hash_index, HASH_INDEX_FILE)
-        self.last_save = time.time()
-
-    def file_hash(self, path: str):
-        mtime = os.path.getmtime(path)
-        if path not in self.hash_index or self.hash_index[path][0] != mtime:
-            with open(path, "rb") as f:
-                file_sign = hashlib.file_digest(f, "sha256")
-            self.hash_index[path] = (mtime, file_sign.hexdigest())
-
-        return self.hash_index[path][1]
+        """
+        Compact loaded cache files if they have grown too much
+        and prune the cache if it is too large.
+        """
+        self._finish_sharing()
+        for segment in self._segments:
+            self._compact_segment(segment)
+        for segment in self._hash_segments:
+            self._compact_hash_segment(segment)
+        # Files prefetched for jobs that didn't need them
+        for future in self._in_flight.values():
+            future.cancel()
+        self._in_flight.clear()
+        if self._size is None:
+            self._size = self._disk_usage()
+        if self._size > MAX_CACHE_SIZE:
+            self.prune(int(AUTO_PRUNE_TARGET * MAX_CACHE_SIZE), MAX_CACHE_ENTRIES)
+        if self.shared is not None:
+            self.shared.evict()
+
+    def _finish_sharing(self) -> None:
+        """Wait until entries are uploaded to the shared cache."""
+        for future in self._sharing:
+            try:
+                future.result()
+            except OSError as e:
+                eprint(
+                    color_settings.colored(
+                        f"Uploading to the shared cache failed: {e}", "yellow"
+                    )
+                )
+        self._sharing.clear()
+
+    def _is_current(self, file_hash: str) -> bool:
+        """Whether file_hash was computed by the current hash algorithm."""
+        if prefix := _hash_prefix(self.hash_algorithm):
+            return file_hash.startswith(prefix)
+        return "-" not in file_hash
+
+    def _lookup_hash(self, path: str) -> tuple[FileKey, str | None]:
+        """
+        Get key of the file and its hash if known. Files are identified by
+        their inode, size and modification time, so contents are read only if changed.
+        """
+        self._load_hash_segment(path)
+        key = file_key(path)
+        if path in self.hash_index:
+            path_key, file_hash = self.hash_index[path]
+            if path_key == key and self._is_current(file_hash):
+                return key, file_hash
+
+        if (inode := self._inode_hashes.get(key[:2])) is not None:
+            inode_key, file_hash = inode
+            if inode_key == key and self._is_current(file_hash):
+                # Hardlink of an already hashed file
+                self._register_hash(path, key, file_hash)
+                return key, file_hash
+
+        return key, None
+
+    def _hash_in_background(self, key: FileKey, path: str) -> Future[tuple[int, str]]:
+        if key not in self._in_flight:
+            if self._hashing_pool is None:
+                self._hashing_pool = ThreadPoolExecutor(
+                    HASHING_THREADS, thread_name_prefix="hashing"
+                )
+            self._in_flight[key] = self._hashing_pool.submit(
+                _hash_file, path, self.hash_algorithm
+            )
+        return self._in_flight[key]
+
+    def prefetch_hashes(self, paths: Iterable[str]) -> None:
+        """Start hashing given files in the background."""
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            try:
+                key, file_hash = self._lookup_hash(path)
+            except OSError:
+                continue  # Removed meanwhile, jobs will find out
+            if file_hash is None:
+                self._hash_in_background(key, path)
+
+    def file_hashes(self, paths: Iterable[str]) -> dict[str, str]:
+        """
+        Get hashes of given files. Files with unknown hashes are read in parallel.
+        Files that don't exist (anymore) are left out.
+        """
+        hashes: dict[str, str] = {}
+        pending: dict[str, tuple[FileKey, Future[tuple[int, str]]]] = {}
+        for path in paths:
+            try:
+                key, file_hash = self._lookup_hash(path)
+            except OSError:
+                continue
+            if file_hash is None:
+                pending[path] = (key, self._hash_in_background(key, path))
+            else:
+                hashes[path] = file_hash
+
+        for path, (key, future) in pending.items():
+            self._in_flight.pop(key, None)
+            try:
+                hashing_start, file_hash = future.result()
+            except OSError:
+                continue
+            if hashing_start - key[3] > RACY_WINDOW_NS:
+                self._register_hash(path, key, file_hash)
+            hashes[path] = file_hash
+
+        return hashes
+
+    def file_hash(self, path: str) -> str:
+        """Get hash of file contents."""
+        return self.file_hashes([path])[path]
+
+    def add_file_hashes(self, hashes: dict[str, tuple[FileKey, str]]) -> None:
+        """Add hashes (path -> (key, hash)) computed while the files were written."""
+        for path, (key, file_hash) in hashes.items():
+            if self._is_current(file_hash):
+                self._register_hash(path, key, file_hash)
+
+    def _register_hash(self, path: str, key: FileKey, file_hash: str) -> None:
+        segment = self._load_hash_segment(path)
+        self.hash_index[path] = (key, file_hash)
+        self._inode_hashes[key[:2]] = (key, file_hash)
+        self._hash_segment_paths[segment].add(path)
+        self._grew(self._hash_segments[segment].append((path, key, file_hash)))
+
+    def _object_path(self, file_hash: str) -> str:
+        return os.path.join(OBJECTS_DIR, file_hash[:2], file_hash[2:])
+
+    def has_object(self, file_hash: str) -> bool:
+        """Whether a file with given hash is in the object store (or the shared one)."""
+        return os.path.isfile(self._object_path(file_hash)) or (
+            self.shared is not None and self.shared.has_object(file_hash)
+        )
+
+    @property
+    def store_outputs(self) -> bool:
+        """Whether files produced by jobs are (still) being stored."""
+        return self._store_outputs is not False
+
+    def store_files(self, paths: Iterable[str]) -> dict[str, str]:
+        """Save files to the object store and return hashes of the stored ones."""
+        stored = {}
+        for path in sorted(paths):
+            if not self.store_outputs:
+                break
+            file_hash = self.file_hash(path)
+            if os.path.exists(self._object_path(file_hash)):
+                stored[path] = file_hash
+            elif self._save_object(path, file_hash, copy=bool(self._store_outputs)):
+                stored[path] = file_hash
+            else:
+                self._store_outputs = False  # Copying them would take disk space
+        return stored
+
+    def _save_object(self, source: str, file_hash: str, copy: bool = True) -> bool:
+        """
+        Save file to the object store. Without copy, only reflinking is tried.
+        Returns whether the file was saved.
+        """
+        object_path = self._object_path(file_hash)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = f"{object_path}.{os.getpid()}.tmp"
+        if copy:
+            clone_file(source, tmp_path)
+        elif not reflink_file(source, tmp_path):
+            return False
+        os.replace(tmp_path, object_path)
+        self._grew(os.path.getsize(object_path))
+        return True
+
+    def _fetch_object(self, file_hash: str) -> bool:
+        """
+        Copy object from the shared cache to the object store.
+        Anybody can write to the shared cache, so the contents are checked
+        against the hash. Returns whether the object was fetched.
+        """
+        assert self.shared is not None
+        object_path = self._object_path(file_hash)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = f"{object_path}.{os.getpid()}.tmp"
+        try:
+            clone_file(self.shared.object_path(file_hash), tmp_path)
+        except OSError:
+            return False  # Evicted meanwhile
+
+        if _hash_file(tmp_path, self.hash_algorithm)[1] != file_hash:
+            os.remove(tmp_path)
+            self.shared.remove_object(file_hash)
+            return False
+        os.replace(tmp_path, object_path)
+        self._grew(os.path.getsize(object_path))
+        return True
+
+    def restore_file(self, path: str, file_hash: str) -> bool:
+        """
+        Restore file with given hash from the object store to path.
+        Returns whether the file could be restored.
+        """
+        object_path = self._object_path(file_hash)
+        if not os.path.exists(object_path) and (
+            self.shared is None or not self._fetch_object(file_hash)
+        ):
+            return False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        clone_file(object_path, path)
+        self._register_hash(path, file_key(path), file_hash)
+        return True
+
+    def load_all(self) -> None:
+        """Load all segments of entries and file hashes."""
+        if self._outdated:
+            return
+        for filename in os.listdir(CACHE_CONTENT_DIR):
+            for record in Journal(os.path.join(CACHE_CONTENT_DIR, filename)).read():
+                if isinstance(record, CacheEntry):
+                    self._load_segment(record.name)
+                    break
+
+        for filename in os.listdir(HASH_INDEX_DIR):
+            for path, _, _ in Journal(os.path.join(HASH_INDEX_DIR, filename)).read():
+                self._load_hash_segment(path)
+                break
+
+    def _all_entries(self) -> list[CacheEntry]:
+        return [entry for entries in self.cache.values() for entry in entries]
+
+    def _object_size(self, file_hash: str) -> int:
+        object_path = self._object_path(file_hash)
+        return os.path.getsize(object_path) if os.path.exists(object_path) else 0
+
+    def _grew(self, size: int) -> None:
+        if self._size is not None:
+            self._size += size
+
+    def _disk_usage(self) -> int:
+        total = 0
+        for directory in (CACHE_CONTENT_DIR, HASH_INDEX_DIR, OBJECTS_DIR):
+            for root, _, files in os.walk(directory):
+                total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return total
+
+    def prune(
+        self, max_size: int, max_entries: int, max_age: float | None = None
+    ) -> tuple[int, int]:
+        """
+        Remove least recently hit entries until there are at most max_entries
+        of them taking at most max_size bytes (including produced files).
+        Entries not hit for max_age seconds are removed too.
+        Also removes unused objects and hashes of nonexistent files.
+
+        Returns number of removed entries and objects.
+        """
+        self.load_all()
+        now = time.time()
+
+        kept_objects: set[str] = set()
+        size = 0
+        evicted: list[CacheEntry] = []
+        entries = sorted(self._all_entries(), key=lambda e: e.last_hit, reverse=True)
+        for i, entry in enumerate(entries):
+            new_objects = set(entry.produced.values()) - kept_objects
+            size += len(pickle.dumps(entry)) + sum(map(self._object_size, new_objects))
+            if (
+                evicted
+                or i >= max_entries
+                or size > max_size
+                or (max_age is not None and now - entry.last_hit > max_age)
+            ):
+                evicted.append(entry)
+            else:
+                kept_objects |= new_objects
+
+        for entry in evicted:
+            self.cache[entry.name].remove(entry)
+            self._index.pop(entry.name, None)
+            if not self.cache[entry.name]:
+                del self.cache[entry.name]
+                self._segment_names[cache_segment(entry.name)].remove(entry.name)
+
+        for segment, names in self._segment_names.items():
+            self._segments[segment].rewrite(
+                entry for name in names for entry in self.cache[name]
+            )
+
+        for segment, paths in self._hash_segment_paths.items():
+            for path in list(paths):
+                if not os.path.exists(path):
+                    paths.remove(path)
+                    del self.hash_index[path]
+            self._hash_segments[segment].rewrite(
+                (path, *self.hash_index[path]) for path in paths
+            )
+
+        removed_objects = 0
+        for root, _, files in os.walk(OBJECTS_DIR, topdown=False):
+            for file in files:
+                if os.path.basename(root) + file not in kept_objects:
+                    os.remove(os.path.join(root, file))
+                    removed_objects += 1
+            if root != OBJECTS_DIR and not os.listdir(root):
+                os.rmdir(root)
+
+        self._size = None
+        return len(evicted), removed_objects
+
+    def stats(self) -> CacheStats:
+        """Compute statistics of all cache contents."""
+        self.load_all()
+        entries = self._all_entries()
+
+        objects = 0
+        objects_size = 0
+        for root, _, files in os.walk(OBJECTS_DIR):
+            objects += len(files)
+            objects_size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+
+        segments = {}
+        for segment, names in sorted(self._segment_names.items()):
+            segment_entries = [e for name in names for e in self.cache[name]]
+            if segment_entries:
+                segments[segment] = (
+                    len(segment_entries),
+                    sum(e.hits for e in segment_entries),
+                )
+
+        return CacheStats(
+            entries=len(entries),
+            names=len(self.cache),
+            hits=sum(e.hits for e in entries),
+            oldest_hit=min((e.last_hit for e in entries), default=None),
+            entries_size=sum(j.size for j in self._segments.values()),
+            hash_index_size=sum(j.size for j in self._hash_segments.values()),
+            objects=objects,
+            objects_size=objects_size,
+            segments=segments,
+        )
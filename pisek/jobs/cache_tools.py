@@ -0,0 +1,56 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+
+from pisek.jobs.cache import Cache, MB
+from pisek.utils.text import tab
+
+DAY = 24 * 60 * 60
+SHOWN_SEGMENTS = 10
+
+
+def _format_size(size: int) -> str:
+    return f"{size / MB:.1f}MB"
+
+
+def print_cache_stats() -> None:
+    stats = Cache.load(read_only=True).stats()
+
+    print(f"Entries: {stats.entries} ({stats.names} jobs)")
+    print(f"Hits: {stats.hits}")
+    if stats.oldest_hit is not None:
+        print(
+            f"Least recent hit: {(time.time() - stats.oldest_hit) / DAY:.1f} days ago"
+        )
+    print(
+        f"Size: {_format_size(stats.entries_size)} entries, "
+        f"{_format_size(stats.hash_index_size)} file hashes, "
+        f"{_format_size(stats.objects_size)} stored files ({stats.objects} files)"
+    )
+
+    if stats.segments:
+        print("Most hit job groups:")
+        segments = sorted(stats.segments.items(), key=lambda s: s[1][1], reverse=True)
+        for segment, (entries, hits) in segments[:SHOWN_SEGMENTS]:
+            print(tab(f"{segment}: {entries} entries, {hits} hits"))
+
+
+def prune_cache(max_size: int, max_entries: int, max_age: float | None) -> None:
+    entries, objects = Cache.load().prune(
+        max_size * MB, max_entries, None if max_age is None else max_age * DAY
+    )
+    print(f"Removed {entries} entries and {objects} stored files.")
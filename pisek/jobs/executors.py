@@ -0,0 +1,267 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import multiprocessing
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import os
+import threading
+from typing import Any
+
+from pisek.env.env import Env, JobExecutor
+from pisek.jobs.jobs import Job
+from pisek.jobs.logging import log, LogEntry, CallbackHandler
+from pisek.user_errors import InvalidArgument, InvalidOperation
+
+root_logger = logging.getLogger()
+
+WORKER_KEY_ENV = "PISEK_WORKER_KEY"
+DEFAULT_WORKER_PORT = 7823
+
+# Log entries emitted by the job running in this worker process
+_worker_logs: list[LogEntry] = []
+
+
+class Executor(ABC):
+    """Runs jobs in parallel."""
+
+    remote_slots: int = 0  # How many jobs can run on other machines at once
+
+    def runs_remotely(self, job: Job) -> bool:
+        """Whether the job runs on another machine (not using resources of this one)."""
+        return False
+
+    @abstractmethod
+    def submit(self, job: Job, env: Env) -> Future:
+        """Start running the job. The future is done once the job state is updated."""
+        pass
+
+    @abstractmethod
+    def shutdown(self) -> None:
+        pass
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.shutdown()
+
+
+class ThreadExecutor(Executor):
+    """
+    Runs jobs in threads of this process.
+    Scales well on free-threaded Python builds, otherwise jobs share the GIL.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, job: Job, env: Env) -> Future:
+        return self._pool.submit(job.run, env)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+
+
+def _init_worker() -> None:
+    root_logger.handlers = [CallbackHandler(_worker_logs.append)]
+
+
+def run_detached_job(
+    job: Job, env: Env, cwd: str, log_level: int
+) -> tuple[dict[str, Any], list[LogEntry]]:
+    """Run detached job in a worker process and return its run state and logs."""
+    os.chdir(cwd)
+    root_logger.setLevel(log_level)
+    _worker_logs.clear()
+    job.run(env)
+    return job.run_state(), list(_worker_logs)
+
+
+def create_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool of processes for running run_detached_job."""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        # Forking is unsafe as the parent process has other threads
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=_init_worker,
+    )
+
+
+def _apply_when_done(job: Job, worker_future: Future) -> Future:
+    """Future that is done once the job is updated with result of run_detached_job."""
+    future: Future = Future()
+    future.set_running_or_notify_cancel()
+
+    def done(worker_future: Future) -> None:
+        try:
+            state, logs = worker_future.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+
+        for entry in logs:
+            log(entry)
+        job.apply_run_state(state)
+        future.set_result(None)
+
+    worker_future.add_done_callback(done)
+    return future
+
+
+class ProcessExecutor(Executor):
+    """Runs jobs in worker processes, so Python code of jobs doesn't share the GIL."""
+
+    def __init__(self, workers: int) -> None:
+        self._pool = create_process_pool(workers)
+        self._cwd = os.getcwd()
+
+    def submit(self, job: Job, env: Env) -> Future:
+        job.start(env)
+        worker_future = self._pool.submit(
+            run_detached_job,
+            job.detached(),
+            env,
+            self._cwd,
+            root_logger.getEffectiveLevel(),
+        )
+        return _apply_when_done(job, worker_future)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Parse HOST:PORT address."""
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise InvalidArgument(f"Invalid address '{address}', expected HOST:PORT.")
+    return host, int(port)
+
+
+def worker_authkey() -> bytes:
+    """Secret shared by pisek instances and workers, workers run anything they get."""
+    key = os.environ.get(WORKER_KEY_ENV)
+    if not key:
+        raise InvalidArgument(
+            f"Set ${WORKER_KEY_ENV} to a secret shared by the workers and their clients."
+        )
+    return key.encode()
+
+
+class WorkerConnection:
+    """
+    Connection to a pisek worker. Requests (id, job, env, cwd, log level)
+    are answered by (id, succeeded, result of run_detached_job or exception)
+    in order of completion.
+    """
+
+    def __init__(self, address: str) -> None:
+        self.address = address
+        try:
+            self._conn = Client(parse_address(address), authkey=worker_authkey())
+            # Worker starts by telling how many jobs it runs in parallel
+            self.slots: int = self._conn.recv()
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise InvalidOperation(f"Cannot connect to worker {address}: {e}")
+
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._pending: dict[int, Future] = {}
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def load(self) -> float:
+        return len(self._pending) / self.slots
+
+    def submit(self, job: Job, env: Env, cwd: str, log_level: int) -> Future:
+        future: Future = Future()
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = future
+            self._conn.send((request_id, job, env, cwd, log_level))
+        return future
+
+    def _read(self) -> None:
+        try:
+            while True:
+                request_id, succeeded, result = self._conn.recv()
+                with self._lock:
+                    future = self._pending.pop(request_id)
+                if succeeded:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        except (EOFError, OSError):
+            with self._lock:
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for future in pending:
+                future.set_exception(
+                    ConnectionError(f"Lost connection to worker {self.address}")
+                )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RemoteExecutor(Executor):
+    """
+    Runs jobs with programs on remote workers (see `pisek worker`), other jobs locally.
+    Workers must see the task directory at the same path (e.g. on a shared filesystem).
+    """
+
+    def __init__(self, workers: int, addresses: list[str]) -> None:
+        if not addresses:
+            raise InvalidArgument("No workers given for the remote executor.")
+        self._local = ThreadExecutor(workers)
+        self._workers = [WorkerConnection(address) for address in addresses]
+        self._cwd = os.getcwd()
+        self.remote_slots = sum(worker.slots for worker in self._workers)
+
+    def runs_remotely(self, job: Job) -> bool:
+        return job.remote
+
+    def submit(self, job: Job, env: Env) -> Future:
+        if not self.runs_remotely(job):
+            return self._local.submit(job, env)
+
+        worker = min(self._workers, key=lambda w: w.load())
+        job.start(env)
+        worker_future = worker.submit(
+            job.detached(), env, self._cwd, root_logger.getEffectiveLevel()
+        )
+        return _apply_when_done(job, worker_future)
+
+    def shutdown(self) -> None:
+        self._local.shutdown()
+        for worker in self._workers:
+            worker.close()
+
+
+def create_executor(kind: JobExecutor, workers: int, addresses: list[str]) -> Executor:
+    if kind == JobExecutor.threads:
+        return ThreadExecutor(workers)
+    elif kind == JobExecutor.processes:
+        return ProcessExecutor(workers)
+    elif kind == JobExecutor.remote:
+        return RemoteExecutor(workers, addresses)
+    else:
+        raise ValueError(f"Unknown executor: {kind}")
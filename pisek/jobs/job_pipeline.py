@@ -15,13 +15,34 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor, Future, wait
+from collections import deque
+from concurrent.futures import Future
+import heapq
+import os
+from queue import Empty, SimpleQueue
+import time
 
 from pisek.env.env import Env
 from pisek.jobs.logging import json_logging
-from pisek.jobs.jobs import State, Job, JobManager
+from pisek.jobs.jobs import State, PipelineItem, Job, JobManager
 from pisek.jobs.cache import Cache
+from pisek.jobs.executors import create_executor
 from pisek.jobs.reporting import Reporter, CommandLineReporter
+from pisek.jobs.resources import (
+    Resources,
+    ResourceBudget,
+    CoreAssignment,
+    available_memory,
+)
+
+# How often to refresh the reporter when nothing else happens
+REPORTER_REFRESH = 0.1
+# How long to create jobs of ready managers before running some
+MANAGERS_TIME_SLICE = 0.05
+# How many ready jobs can be overtaken by smaller jobs fitting the resource budget
+MAX_OVERTAKEN_JOBS = 64
+# Expected duration of jobs not seen in cache before
+DEFAULT_JOB_DURATION = 0.1
 
 
 class JobPipeline(ABC):
@@ -35,35 +56,59 @@ class JobPipeline(ABC):
 
     def run_jobs(self, cache: Cache | None, env: Env) -> bool:
         self._reporter: Reporter = CommandLineReporter(env, self.job_managers)
+        self._last_report = 0.0
 
+        self._cache = cache
         self._futures: dict[Future, Job] = {}
-        self._queue: list[Job] = []
-        self._envs: list[Env] = [env.model_copy(deep=True) for _ in range(env.jobs)]
+        self._budget = ResourceBudget(env.jobs, available_memory())
+        self._reserved: dict[Job, Resources] = {}
+        self._cores: CoreAssignment | None = None
+        if env.isolate_timing:
+            self._cores = CoreAssignment(sorted(os.sched_getaffinity(0)))
+        # Jobs already prepared but waiting for resources
+        self._prepared: set[Job] = set()
+        # Futures of finished jobs, put there by the worker threads
+        self._done: SimpleQueue[Future] = SimpleQueue()
+        # How many more jobs can be running (all of them share the env)
+        self._free_workers = env.jobs
+        # Jobs running on remote workers, they don't use local resources
+        self._remote: set[Job] = set()
+
+        # Jobs waiting for their prerequisites
+        self._waiting: set[Job] = set()
+        # Heap of jobs that can be started, longest critical path first
+        self._ready_jobs: list[tuple[float, int, Job]] = []
+        self._critical_paths: dict[Job, float] = {}
+        self._ready_counter = 0
+        self._ready_managers: deque[JobManager] = deque()
+        self._job_managers_of: dict[Job, JobManager] = {}
+        # Managers whose jobs changed state since their last update
+        self._dirty_managers: set[JobManager] = set()
 
         for job_man in self.job_managers:
             job_man.set_env(env)
+        if cache is not None:
+            cache.start_run()
+        for job_man in self.job_managers:
+            job_man.set_on_ready(self._item_ready)
 
-        with ThreadPoolExecutor(max_workers=env.jobs) as self._thread_pool:
-            self._update(cache, env)
+        with create_executor(env.executor, env.jobs, env.workers) as self._executor:
+            self._free_remote = self._executor.remote_slots
             while not all(man.state.finished() for man in self.job_managers):
-                done, _ = wait(
-                    self._futures, timeout=0.1, return_when="FIRST_COMPLETED"
-                )
-
-                for future in done:
-                    exception = future.exception()
-                    if exception is not None:
-                        raise exception
-
-                    job = self._futures[future]
-                    del self._futures[future]
-                    self._envs.append(job._env)
-                    self._finalize_job(job, cache)
-
                 if not self._update(cache, env):
                     break
+                self._report()
 
-                self._reporter.update(list(self._futures.values()))
+                if self._ready_managers:
+                    continue  # Start other managers right away
+
+                try:
+                    future = self._done.get(timeout=REPORTER_REFRESH)
+                except Empty:
+                    continue
+                self._job_done(future, cache)
+                while not self._done.empty():
+                    self._job_done(self._done.get(), cache)
 
             for job in self._futures.values():
                 if job.state == State.succeeded:
@@ -71,45 +116,143 @@ class JobPipeline(ABC):
                 else:
                     job.cancel()
             self._reporter.update([])
+            if env.stats:
+                self._reporter.report_budget(self._budget)
 
         if cache is not None:
-            cache.export()  # Save last version of cache
+            cache.export()  # Compact cache files
         json_logging.write()
 
         return any(man.state == State.failed for man in self.job_managers)
 
+    def _item_ready(self, item: PipelineItem) -> None:
+        """Called when item's prerequisites have finished or it was cancelled."""
+        if isinstance(item, JobManager):
+            self._ready_managers.append(item)
+        elif isinstance(item, Job) and item in self._waiting:
+            self._waiting.remove(item)
+            if item.prerequisites > 0:
+                # Cancelled before its prerequisites finished, nothing to do
+                self._dirty_managers.add(self._job_managers_of[item])
+                return
+            heapq.heappush(
+                self._ready_jobs,
+                (-self._critical_path(item), self._ready_counter, item),
+            )
+            self._ready_counter += 1
+            if self._cache is not None:
+                item.prefetch_hashes(self._cache)  # Hash its files in the background
+
+    def _critical_path(self, job: Job) -> float:
+        """
+        Expected time from starting the job to finishing all jobs depending on it.
+        Durations are estimated from previous runs stored in cache.
+        """
+        if job not in self._critical_paths:
+            duration = None
+            if self._cache is not None:
+                duration = self._cache.expected_duration(job.name)
+            if duration is None:
+                duration = DEFAULT_JOB_DURATION
+
+            self._critical_paths[job] = duration + max(
+                (
+                    self._critical_path(item)
+                    for item, _, _ in job.required_by
+                    if isinstance(item, Job)
+                ),
+                default=0.0,
+            )
+        return self._critical_paths[job]
+
+    def _job_done(self, future: Future, cache: Cache | None) -> None:
+        exception = future.exception()
+        if exception is not None:
+            raise exception
+
+        job = self._futures.pop(future)
+        self._release(job)
+        self._finalize_job(job, cache)
+
+    def _report(self) -> None:
+        now = time.time()
+        if now - self._last_report >= REPORTER_REFRESH:
+            self._last_report = now
+            self._reporter.update(list(self._futures.values()))
+
     def _update(self, cache: Cache | None, env: Env) -> bool:
         """Updates currently running JobManagers and Jobs, runs new ones
         and returns if we should continue in testing."""
 
-        # Start new managers
-        for manager in self.job_managers:
-            if manager.state == State.in_queue and manager.prerequisites == 0:
-                self._queue.extend(manager.create_jobs())
-                if manager.any_failed():
-                    manager.finalize()
-                    self._reporter.report_manager(manager)
-                    if not env.full:
-                        return False
-                break  # We don't want to start many managers at once because that can lead to UI freeze
-
-        # Process new jobs
-        new_queue: list[Job] = []
-        to_run: list[tuple[Job, Env]] = []
-        for job in self._queue:
-            if len(self._envs) > 0 and job.prerequisites == 0:
-                job.prepare(cache)
-                if job.state.finished():
-                    self._finalize_job(job, cache)
-                elif job.state:
-                    to_run.append((job, self._envs.pop()))
-            else:
-                new_queue.append(job)
+        # Create jobs of managers, but only for a limited time so that
+        # their jobs get started and the UI doesn't freeze
+        deadline = time.time() + MANAGERS_TIME_SLICE
+        while self._ready_managers and time.time() < deadline:
+            manager = self._ready_managers.popleft()
+            if manager.state != State.in_queue and not manager.creating:
+                continue
+
+            new_jobs = manager.create_jobs(deadline)
+            if manager.creating:
+                self._ready_managers.append(manager)  # Continue later
+            for job in new_jobs:
+                self._job_managers_of[job] = manager
+                self._waiting.add(job)
+            for job in new_jobs:
+                job.set_on_ready(self._item_ready)
+            self._dirty_managers.add(manager)
+
+            if manager.any_failed():
+                manager.finalize()
+                self._reporter.report_manager(manager)
+                if not env.full:
+                    return False
 
-        self._queue = new_queue
+        # Process new jobs, smaller jobs can overtake ones not fitting into the budget
+        to_run: list[Job] = []
+        overtaken: list[tuple[float, int, Job]] = []
+        while (
+            self._ready_jobs
+            and (self._free_workers or self._free_remote)
+            and len(overtaken) < MAX_OVERTAKEN_JOBS
+        ):
+            item = heapq.heappop(self._ready_jobs)
+            job = item[2]
+            if job not in self._prepared:
+                job.prepare(cache)
+                self._prepared.add(job)
+            if job.state.finished():
+                self._finalize_job(job, cache)
+            elif self._executor.runs_remotely(job):
+                if not self._free_remote:
+                    overtaken.append(item)
+                    continue
+                self._free_remote -= 1
+                self._remote.add(job)
+                to_run.append(job)
+            elif job.state:
+                resources = job.resources()
+                if (
+                    not self._free_workers
+                    or not self._budget.fits(resources)
+                    or (self._cores is not None and not self._cores.fits(resources))
+                ):
+                    overtaken.append(item)
+                    continue
+                self._budget.reserve(resources)
+                self._reserved[job] = resources
+                if self._cores is not None:
+                    job.cpus = self._cores.assign(resources)
+                self._free_workers -= 1
+                to_run.append(job)
+        for item in overtaken:
+            heapq.heappush(self._ready_jobs, item)
 
         # Update managers
         for manager in self.job_managers:
+            if manager not in self._dirty_managers:
+                continue
+            self._dirty_managers.remove(manager)
             if manager.state == State.running:
                 manager.update()
                 if manager.ready() or manager.any_failed():
@@ -119,15 +262,31 @@ class JobPipeline(ABC):
                     return False
 
         # Start new jobs
-        for job, env in to_run:
+        for job in to_run:
             if job.state == State.in_queue:
-                self._futures[self._thread_pool.submit(job.run, env)] = job
+                future = self._executor.submit(job, env)
+                self._futures[future] = job
+                future.add_done_callback(self._done.put)
             else:
-                self._envs.append(env)
+                self._release(job)
 
         return True
 
+    def _release(self, job: Job) -> None:
+        """Release the worker and resources reserved for the job."""
+        if job in self._remote:
+            self._remote.remove(job)
+            self._free_remote += 1
+            return
+        self._free_workers += 1
+        resources = self._reserved.pop(job)
+        self._budget.release(resources)
+        if self._cores is not None and job.cpus is not None:
+            self._cores.release(resources, job.cpus)
+
     def _finalize_job(self, job: Job, cache: Cache | None) -> None:
         job.finalize(cache)
         self.all_accessed_files |= job.accessed_files
         self._reporter.report_job(job)
+        if job in self._job_managers_of:
+            self._dirty_managers.add(self._job_managers_of[job])
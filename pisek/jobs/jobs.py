@@ -15,27 +15,32 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from abc import ABC, abstractmethod
-from copy import deepcopy
+from copy import copy
 from enum import Enum, auto
 import dataclasses
 from functools import wraps
 import hashlib
 import logging
 import os.path
+import threading
 import time
 from typing import (
     AbstractSet,
     Any,
     Callable,
+    Iterable,
+    Iterator,
+    Mapping,
     MutableSet,
     NamedTuple,
     TYPE_CHECKING,
 )
 
 from pisek.jobs.logging import log, LogLevel, LogEntry
-from pisek.jobs.cache import Cache, CacheEntry, GlobsToFilesArgs
-from pisek.utils.paths import TaskPath
-from pisek.utils.util import globs_to_files
+from pisek.jobs.cache import Cache, CacheEntry, FileKey, GlobsToFilesArgs
+from pisek.jobs.resources import Resources
+from pisek.jobs.shared_cache import SharedEntries
+from pisek.utils.paths import TESTS_DIR, TaskPath
 
 if TYPE_CHECKING:
     from pisek.env.env import Env
@@ -43,6 +48,31 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+EntryGroup = Mapping[str, CacheEntry] | SharedEntries
+
+# Guards jobs against being cancelled and started at once
+_state_lock = threading.Lock()
+
+# Attributes of a job that its run can change (together with cached attributes)
+RUN_STATE_ATTRIBUTES = [
+    "state",
+    "fail_msg",
+    "duration",
+    "terminal_output",
+    "_logs",
+    "_accessed_envs",
+    "_accessed_globs",
+    "_accessed_files",
+    "_written_files",
+    "_written_hashes",
+]
+
+
+def _resolve_symlinks(path: str) -> str:
+    while os.path.islink(path):
+        path = os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
+    return path
+
 
 class State(Enum):
     in_queue = auto()
@@ -118,6 +148,28 @@ class PipelineItem(ABC):
         self._prerequisites_results: dict[str, Any] = {}
         # List of prints (string to print, whether to use stderr)
         self.terminal_output: list[tuple[str, bool]] = []
+        self._on_ready: Callable[["PipelineItem"], None] | None = None
+        # Whether items that require this one were already notified
+        self._dependants_notified = False
+
+    def set_on_ready(self, callback: Callable[["PipelineItem"], None]) -> None:
+        """
+        Set function to be called when this item can be processed.
+        (All prerequisites finished or it was cancelled.)
+        Called immediately if the item is already ready.
+        """
+        self._on_ready = callback
+        if self.prerequisites == 0 or self.state == State.cancelled:
+            callback(self)
+
+    def _notify_ready(self) -> None:
+        if self._on_ready is not None:
+            self._on_ready(self)
+
+    def _prerequisite_finished(self) -> None:
+        self.prerequisites -= 1
+        if self.prerequisites == 0:
+            self._notify_ready()
 
     def _colored(self, msg: str, color: str) -> str:
         return self._env.colored(msg, color)
@@ -146,14 +198,17 @@ class PipelineItem(ABC):
 
     def cancel(self) -> None:
         """Cancels job and all that require it."""
-        if self.state.finished():
-            return  # No need to cancel
-        self.state = State.cancelled
+        with _state_lock:
+            if self.state.finished():
+                return  # No need to cancel
+            self.state = State.cancelled
+        self._dependants_notified = True
+        self._notify_ready()
         for item, _, _ in self.required_by:
             if not item.run_always:
                 item.cancel()
             else:
-                item.prerequisites -= 1
+                item._prerequisite_finished()
 
     def _check_prerequisites(self) -> None:
         """Checks if all prerequisites are finished raises error otherwise."""
@@ -171,6 +226,16 @@ class PipelineItem(ABC):
         """Adds given PipelineItem as a prerequisite to this job."""
         if item is None:
             return
+        if item._dependants_notified:
+            # Item finished before this one was created, resolve it right away
+            if self.run_always or (
+                item.state == State.succeeded and condition(item.result)
+            ):
+                if name is not None and item.state != State.cancelled:
+                    self._prerequisites_results[name] = item.result
+            else:
+                self.cancel()
+            return
 
         self.prerequisites += 1
         item.required_by.append(RequiredBy(self, name, condition))
@@ -190,13 +255,17 @@ class PipelineItem(ABC):
 
     def finish(self) -> None:
         """Notifies PipelineItems that depend on this job."""
+        if self.state == State.cancelled:
+            return  # They were notified when cancelling
+        self._dependants_notified = True
         for item, name, condition in self.required_by:
             if item.run_always or (
                 self.state == State.succeeded and condition(self.result)
             ):
-                item.prerequisites -= 1
                 if name is not None:
-                    item._prerequisites_results[name] = deepcopy(self.result)
+                    # Results are immutable, so they can be shared
+                    item._prerequisites_results[name] = self.result
+                item._prerequisite_finished()
             else:
                 item.cancel()
 
@@ -204,6 +273,8 @@ class PipelineItem(ABC):
 class Job(PipelineItem, CaptureInitParams):
     """One simple cacheable task in pipeline."""
 
+    remote: bool = False  # Worth running on remote workers
+
     _args: list[Any]
     _kwargs: dict[str, Any]
 
@@ -213,9 +284,19 @@ class Job(PipelineItem, CaptureInitParams):
         self._accessed_envs: MutableSet[tuple[str, ...]] = set()
         self._accessed_globs: MutableSet[GlobsToFilesArgs] = set()
         self._accessed_files: MutableSet[str] = set()
+        # Files this job writes (subset of accessed files)
+        self._written_files: MutableSet[str] = set()
         self._logs: list[LogEntry] = []
         self.name = name
         self.started: float | None = None
+        # How long the run of this job took
+        self.duration: float | None = None
+        # CPUs programs of this job are pinned to (None for no pinning)
+        self.cpus: list[int] | None = None
+        # Algorithm of cache file hashes or None if there is no cache
+        self._hash_algorithm: str | None = None
+        # Hashes of files computed while this job was writing them
+        self._written_hashes: dict[str, tuple[FileKey, str]] = {}
         super().__init__(name)
 
     def _register_cached_attribute(self, name: str) -> None:
@@ -231,6 +312,11 @@ class Job(PipelineItem, CaptureInitParams):
         """Add file this job depends on."""
         self._accessed_files.add(filename.path)
 
+    def _write_file(self, filename: TaskPath) -> None:
+        """Add file this job writes to."""
+        self._accessed_files.add(filename.path)
+        self._written_files.add(filename.path)
+
     @property
     def accessed_files(self) -> set[str]:
         return set(self._accessed_files)
@@ -242,8 +328,15 @@ class Job(PipelineItem, CaptureInitParams):
         globs: AbstractSet[GlobsToFilesArgs],
         results: dict[str, Any],
         cache: Cache,
+        restorable: dict[str, str] | None = None,
     ) -> tuple[str | None, str | None]:
-        """Compute a signature (i.e. hash) of given envs, files and prerequisites results."""
+        """
+        Compute a signature (i.e. hash) of given envs, files and prerequisites results.
+        Missing files in restorable (path -> hash) are treated as if restored.
+        """
+        if restorable is None:
+            restorable = {}
+
         sign = hashlib.sha256()
         sign.update(f"{self.__class__.__name__}\00".encode())
         for i, arg in enumerate(self._args):
@@ -252,27 +345,25 @@ class Job(PipelineItem, CaptureInitParams):
             sign.update(f"{key}={val}\00".encode())
 
         for env_key in sorted(envs):
-            try:
-                value = self._env.get_compound(env_key)
-            except (AttributeError, TypeError, ValueError, KeyError):
+            value = cache.memo.env_value(env_key, self._env)
+            if value is None:
                 return (None, f"Key nonexistent: {env_key}")
             sign.update(f"{env_key}={value}\00".encode())
 
-        for path in sorted(paths):
-            while os.path.islink(path):
-                path = os.path.normpath(
-                    os.path.join(os.path.dirname(path), os.readlink(path))
-                )
-
-            if os.path.isfile(path):
-                sign.update(f"{path}={cache.file_hash(path)}\00".encode())
+        resolved_paths = [_resolve_symlinks(path) for path in sorted(paths)]
+        hashes = cache.file_hashes(filter(os.path.isfile, resolved_paths))
+        for path in resolved_paths:
+            if path in hashes:
+                sign.update(f"{path}={hashes[path]}\00".encode())
             elif os.path.isdir(path):
                 sign.update(f"{path} is directory\00".encode())
+            elif path in restorable and cache.has_object(restorable[path]):
+                sign.update(f"{path}={restorable[path]}\00".encode())
             else:
                 return (None, f"File nonexistent: {path}")
 
         for args in sorted(globs):
-            files = globs_to_files(args.globs, args.directory, args.exclude)
+            files = cache.memo.globs_to_files(args)
             sign.update(f"{args.globs}\n{args.exclude}\n{files}\00".encode())
 
         for name, result in sorted(results.items()):
@@ -288,18 +379,83 @@ class Job(PipelineItem, CaptureInitParams):
 
     def _find_entry(self, cache: Cache) -> CacheEntry | None:
         """Finds a corresponding CacheEntry for this Job."""
-        for cache_entry in cache[self.name]:
+        entry = self._find_entry_in(
+            cache.entries_by_dependencies(self.name).values(), cache
+        )
+        if entry is None and cache.shared is not None:
+            entry = self._find_entry_in(
+                cache.shared.entries_by_dependencies(self.name), cache
+            )
+            if entry is not None:
+                self._log(
+                    "info", f"Found '{self.name}' in shared cache", bypass_cache=True
+                )
+                cache.add(entry, share=False)
+        return entry
+
+    def _find_entry_in(
+        self, groups: Iterable[EntryGroup], cache: Cache
+    ) -> CacheEntry | None:
+        """Finds a corresponding CacheEntry in given groups of entries with same dependencies."""
+        # Entries with same dependencies share the signature computation
+        for entries in groups:
+            some_entry = next(iter(entries.values()), None)
+            if some_entry is None:
+                continue
             sign, err = self._signature(
-                set(cache_entry.envs),
-                set(cache_entry.files),
-                set(cache_entry.globs),
+                set(some_entry.envs),
+                set(some_entry.files),
+                set(some_entry.globs),
                 self._prerequisites_results,
                 cache,
             )
-            if cache_entry.signature == sign:
-                return cache_entry
+            if sign is not None and (entry := entries.get(sign)) is not None:
+                return entry
+            elif sign is None:
+                # Some files are missing, maybe they can be restored
+                for entry in entries.values():
+                    if not entry.produced:
+                        continue
+                    sign, err = self._signature(
+                        set(entry.envs),
+                        set(entry.files),
+                        set(entry.globs),
+                        self._prerequisites_results,
+                        cache,
+                        entry.produced,
+                    )
+                    if sign == entry.signature:
+                        return entry
         return None
 
+    def prefetch_hashes(self, cache: Cache) -> None:
+        """Start hashing files this job most likely depends on."""
+        if self.name not in cache:
+            return
+        for entries in cache.entries_by_dependencies(self.name).values():
+            cache.prefetch_hashes(next(iter(entries.values())).files)
+            break
+
+    def _produced_files(self) -> set[str]:
+        """Files in tests directory this job has written to."""
+        return {
+            path
+            for path in self._written_files
+            if path.startswith(TESTS_DIR) and os.path.isfile(path)
+        }
+
+    def _restore_produced(self, entry: CacheEntry, cache: Cache) -> bool:
+        """
+        Restore missing files produced by the cached job.
+        Returns whether all of them could be restored.
+        """
+        for path, file_hash in entry.produced.items():
+            if not os.path.exists(path):
+                self._log("debug", f"Restoring '{path}' from cache", bypass_cache=True)
+                if not cache.restore_file(path, file_hash):
+                    return False
+        return True
+
     def _export(self, cache: Cache) -> CacheEntry:
         """Export this job into CacheEntry."""
         sign, err = self._signature(
@@ -323,17 +479,21 @@ class Job(PipelineItem, CaptureInitParams):
             self._prerequisites_results,
             self.terminal_output,
             self._logs,
+            cache.store_files(self._produced_files()),
+            self.duration or 0.0,
         )
 
     def prepare(self, cache: Cache | None) -> None:
         if self.state == State.cancelled:
             return None
+        if cache is not None:
+            self._hash_algorithm = cache.hash_algorithm
         self._check_prerequisites()
 
         if (
             cache is not None
-            and self.name in cache
             and (entry := self._find_entry(cache))
+            and self._restore_produced(entry, cache)
         ):
             self._log("info", f"Loading cached '{self.name}'", bypass_cache=True)
             cache.move_to_top(entry)
@@ -347,25 +507,60 @@ class Job(PipelineItem, CaptureInitParams):
                 )
             self.state = State.succeeded
 
-    def run(self, env: "Env") -> None:
-        """Run this job."""
-        if self.state == State.cancelled:
-            return
+    def resources(self) -> Resources:
+        """Resources to reserve while running this job."""
+        return Resources()
+
+    def start(self, env: "Env") -> None:
+        """Mark this job as running in given env."""
         self.state = State.running
         self.started = time.time()
+        self._env = env
+
+    def run(self, env: "Env") -> None:
+        """Run this job."""
+        with _state_lock:
+            if self.state == State.cancelled:
+                return
+            self.start(env)
         self._log("info", f"Running '{self.name}'", bypass_cache=True)
 
         try:
-            self._env = env
             self._env.clear_accesses()
             self.result = self._run()
             self._accessed_envs |= self._env.get_accessed()
         except PipelineItemFailure as failure:
             self._fail(failure)
+        except PipelineItemAbort:
+            pass  # Cancelled while running
+        finally:
+            self._env.clear_accesses()
+        assert self.started is not None
+        self.duration = time.time() - self.started
+
+    def detached(self) -> "Job":
+        """Copy of this job without links to other pipeline items (to send it to another process)."""
+        job = copy(self)
+        job.required_by = []
+        job._on_ready = None
+        return job
+
+    def run_state(self) -> dict[str, Any]:
+        """Attributes changed by running this job."""
+        attributes = set(RUN_STATE_ATTRIBUTES) | set(self._cached_attributes)
+        return {attr: getattr(self, attr) for attr in attributes}
+
+    def apply_run_state(self, state: dict[str, Any]) -> None:
+        """Update this job with run_state of its detached copy."""
+        if self.state == State.cancelled:
+            state = {attr: val for attr, val in state.items() if attr != "state"}
+        for attr, val in state.items():
+            setattr(self, attr, val)
 
     def finalize(self, cache: Cache | None):
         if self.state == State.running:
             if cache is not None:
+                cache.add_file_hashes(self._written_hashes)
                 cache.add(self._export(cache))
             self.state = State.succeeded
         return self.finish()
@@ -379,28 +574,55 @@ class Job(PipelineItem, CaptureInitParams):
 class JobManager(PipelineItem):
     """Object that can create jobs and compute depending on their results."""
 
+    creating: bool = False  # Some jobs are yet to be created
+    _job_source: Iterator[Job] | None = None
+
     def set_env(self, env: "Env") -> None:
         self._env = env
 
-    def create_jobs(self) -> list[Job]:
-        """Crates this JobManager's jobs."""
+    def create_jobs(self, deadline: float | None = None) -> list[Job]:
+        """
+        Creates this JobManager's jobs until the deadline passes.
+        Returns the newly created jobs, call again while `creating` is set.
+        """
         self.result: Any | None
-        if self.state == State.cancelled:
+        if self._job_source is None:
+            self._jobs_done = 0
             self.jobs = []
-        else:
+            if self.state == State.cancelled:
+                return []
             self.state = State.running
             self._check_prerequisites()
-            try:
-                self.jobs = self._get_jobs()
-            except PipelineItemFailure as failure:
-                self._fail(failure)
-                self.jobs = []
+            self.creating = True
+            self._job_source = self._iter_jobs()
+        elif self.state.finished():
+            self.creating = False  # Finalized early, e.g. after a failure
+            return []
 
-        return self.jobs
+        new_jobs: list[Job] = []
+        try:
+            for job in self._job_source:
+                new_jobs.append(job)
+                if deadline is not None and time.time() >= deadline:
+                    break
+            else:
+                self.creating = False
+        except PipelineItemFailure as failure:
+            self._fail(failure)
+            self.creating = False
+
+        self.jobs += new_jobs
+        return new_jobs
+
+    def _iter_jobs(self) -> Iterator[Job]:
+        yield from self._get_jobs()
 
     @abstractmethod
-    def _get_jobs(self) -> list[Job]:
-        """Actually creates this JobManager's jobs (without management)."""
+    def _get_jobs(self) -> Iterable[Job]:
+        """
+        Actually creates this JobManager's jobs (without management).
+        Managers with many jobs should yield them so they can start early.
+        """
         pass
 
     def _job_states(self) -> tuple[State, ...]:
@@ -425,14 +647,23 @@ class JobManager(PipelineItem):
         Returns whether manager is ready for evaluation.
         (i.e. All of it's jobs have finished)
         """
-        return self.state == State.running and len(
-            self.jobs_with_state(State.succeeded)
-            + self.jobs_with_state(State.cancelled)
-        ) == len(self.jobs)
+        # Jobs never leave finished states, so we don't need to check them again
+        while self._jobs_done < len(self.jobs) and self.jobs[self._jobs_done].state in (
+            State.succeeded,
+            State.cancelled,
+        ):
+            self._jobs_done += 1
+        return (
+            self.state == State.running
+            and not self.creating
+            and self._jobs_done == len(self.jobs)
+        )
 
     def any_failed(self) -> bool:
         """Returns whether this manager or its jobs had any failures so far."""
-        return self.state == State.failed or len(self.jobs_with_state(State.failed)) > 0
+        return self.state == State.failed or any(
+            job.state == State.failed for job in self.jobs
+        )
 
     def finalize(self) -> None:
         """Does final evaluation and computes the result of this job manager."""
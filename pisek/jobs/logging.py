@@ -69,7 +69,9 @@ def map_log_level(log_level: str) -> int:
         fatal_user_error(f"Invalid log level: '{log_level}'")
 
 
-class _CallbackHandler(logging.Handler):
+class CallbackHandler(logging.Handler):
+    """Logging handler passing records as LogEntries to a callback."""
+
     def __init__(self, callback: Callable[[LogEntry], None], level=logging.NOTSET):
         self.__callback = callback
         super().__init__(level)
@@ -95,7 +97,7 @@ class _JSONLogging:
         self._enabled = True
 
     def get_handler(self) -> logging.Handler:
-        return _CallbackHandler(self._log)
+        return CallbackHandler(self._log)
 
     def _log(self, entry: LogEntry) -> None:
         self._entries.append(entry)
@@ -23,6 +23,7 @@ from pisek.utils.text import tab
 from pisek.utils.terminal import terminal_width, terminal_height, LINE_SEPARATOR
 
 from pisek.jobs.jobs import State, PipelineItem, Job, JobManager
+from pisek.jobs.resources import ResourceBudget
 from pisek.env.env import Env
 
 P = ParamSpec("P")
@@ -45,6 +46,10 @@ class Reporter(ABC):
     def report_manager(self, job_manager: JobManager) -> None:
         pass
 
+    @abstractmethod
+    def report_budget(self, budget: ResourceBudget) -> None:
+        pass
+
 
 class CommandLineReporter(Reporter):
     def __init__(self, env: Env, job_managers: list[JobManager]) -> None:
@@ -99,6 +104,12 @@ class CommandLineReporter(Reporter):
     def report_manager(self, job_manager: JobManager) -> None:
         pass
 
+    def report_budget(self, budget: ResourceBudget) -> None:
+        self._print(
+            f"Jobs used at most {budget.peak.cpus}/{budget.total.cpus} CPU slots "
+            f"and {budget.peak.memory}/{budget.total.memory} MB of reserved memory"
+        )
+
     def _report_manager(self, job_manager: JobManager) -> None:
         self._clear_lines(self._dirty_lines)
         report_about: list[PipelineItem] = job_manager.jobs + [job_manager]
@@ -0,0 +1,178 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from dataclasses import dataclass
+import math
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# cgroup v1 uses a huge number for no limit
+UNLIMITED_V1 = 2**62
+
+
+@dataclass(frozen=True)
+class Resources:
+    """
+    Resources reserved for a job while it runs.
+
+    Attributes:
+        cpus: Number of CPU slots
+        memory: Memory in MB (0 if not known)
+        timed: Whether the job measures time (and needs cores for itself)
+    """
+
+    cpus: int = 1
+    memory: int = 0
+    timed: bool = False
+
+
+def _read_cgroup_file(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths(controller: str) -> list[str]:
+    """Directories of the cgroup of this process and its ancestors."""
+    relative = None
+    content = _read_cgroup_file("/proc/self/cgroup") or ""
+    for line in content.splitlines():
+        _, controllers, path = line.split(":", 2)
+        if controllers == "" or controller in controllers.split(","):
+            relative = path.lstrip("/")
+            if controllers != "":
+                break  # cgroup v1 controller takes precedence
+
+    paths = []
+    while relative is not None:
+        for root in (CGROUP_ROOT, os.path.join(CGROUP_ROOT, controller)):
+            paths.append(os.path.join(root, relative))
+        relative = os.path.dirname(relative) if relative else None
+    return paths
+
+
+def _cgroup_cpus() -> int | None:
+    limit = None
+    for path in _cgroup_paths("cpu"):
+        if (content := _read_cgroup_file(os.path.join(path, "cpu.max"))) is not None:
+            quota, period = content.split()
+            if quota == "max":
+                continue
+            cpus = math.ceil(int(quota) / int(period))
+        elif (
+            cfs_quota := _read_cgroup_file(os.path.join(path, "cpu.cfs_quota_us"))
+        ) is not None and int(cfs_quota) > 0:
+            cfs_period = _read_cgroup_file(os.path.join(path, "cpu.cfs_period_us"))
+            cpus = math.ceil(int(cfs_quota) / int(cfs_period or 100_000))
+        else:
+            continue
+        limit = cpus if limit is None else min(limit, cpus)
+    return limit
+
+
+def _cgroup_memory() -> int | None:
+    limit = None
+    for path in _cgroup_paths("memory"):
+        content = _read_cgroup_file(os.path.join(path, "memory.max"))
+        if content is None:
+            content = _read_cgroup_file(os.path.join(path, "memory.limit_in_bytes"))
+        if content is None or content == "max" or int(content) >= UNLIMITED_V1:
+            continue
+        limit = int(content) if limit is None else min(limit, int(content))
+    return limit
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process can use (respecting affinity and cgroups)."""
+    cpus = len(os.sched_getaffinity(0))
+    if (cgroup_cpus := _cgroup_cpus()) is not None:
+        cpus = min(cpus, cgroup_cpus)
+    return max(1, cpus)
+
+
+def available_memory() -> int:
+    """Memory in MB this process can use (respecting cgroups)."""
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    if (cgroup_memory := _cgroup_memory()) is not None:
+        memory = min(memory, cgroup_memory)
+    return memory // (1024 * 1024)
+
+
+class ResourceBudget:
+    """Resources jobs can use at once. Keeps track of current reservations."""
+
+    def __init__(self, cpus: int, memory: int) -> None:
+        self.total = Resources(cpus, memory)
+        self._cpus = 0
+        self._memory = 0
+        self._running = 0
+        self.peak = Resources(0, 0)
+
+    def fits(self, resources: Resources) -> bool:
+        """
+        Whether resources can be reserved now. Anything fits
+        when nothing is running, so that big jobs can run alone.
+        """
+        if self._running == 0:
+            return True
+        return (
+            self._cpus + resources.cpus <= self.total.cpus
+            and self._memory + resources.memory <= self.total.memory
+        )
+
+    def reserve(self, resources: Resources) -> None:
+        self._cpus += resources.cpus
+        self._memory += resources.memory
+        self._running += 1
+        self.peak = Resources(
+            max(self.peak.cpus, self._cpus), max(self.peak.memory, self._memory)
+        )
+
+    def release(self, resources: Resources) -> None:
+        self._cpus -= resources.cpus
+        self._memory -= resources.memory
+        self._running -= 1
+
+
+class CoreAssignment:
+    """
+    Splits CPU cores between timed jobs, which get their cores exclusively,
+    and other jobs, which share the remaining cores.
+    """
+
+    def __init__(self, cores: list[int]) -> None:
+        self._timed_cores = max(1, len(cores) // 2)
+        self._free = cores[: self._timed_cores]
+        self.shared = cores[self._timed_cores :] or cores
+
+    def _needed(self, resources: Resources) -> int:
+        return min(resources.cpus, self._timed_cores)
+
+    def fits(self, resources: Resources) -> bool:
+        return not resources.timed or len(self._free) >= self._needed(resources)
+
+    def assign(self, resources: Resources) -> list[int]:
+        if not resources.timed:
+            return self.shared
+        cores = self._free[: self._needed(resources)]
+        self._free = self._free[len(cores) :]
+        return cores
+
+    def release(self, resources: Resources, cores: list[int]) -> None:
+        if resources.timed:
+            self._free = sorted(self._free + cores)
@@ -0,0 +1,248 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Callable, Iterator, TYPE_CHECKING
+
+from pisek.version import __version__
+from pisek.user_errors import InvalidArgument
+from pisek.utils.util import clone_file
+
+if TYPE_CHECKING:
+    from pisek.jobs.cache import CacheEntry
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_ENV = "PISEK_SHARED_CACHE"
+SHARED_CACHE_KEY_ENV = "PISEK_SHARED_CACHE_KEY"
+ENTRIES_SUBDIR = "entries"
+OBJECTS_SUBDIR = "objects"
+# Temporary files older than this were left by a crashed writer
+STALE_TMP_AGE = 24 * 60 * 60
+
+
+def _write_atomically(path: str, write: Callable[[str], None]) -> None:
+    """
+    Write file so that others never see it incomplete.
+    Function write gets a temporary path to write to.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def shared_cache_key() -> bytes:
+    """Secret key for signing entries of the shared cache."""
+    key = os.environ.get(SHARED_CACHE_KEY_ENV)
+    if not key:
+        raise InvalidArgument(
+            f"Using a shared cache requires a secret key in ${SHARED_CACHE_KEY_ENV}."
+        )
+    return key.encode()
+
+
+def _signature(key: bytes, data: bytes) -> bytes:
+    return hmac.digest(key, data, "sha256")
+
+
+def _dump(obj: Any, path: str, key: bytes) -> None:
+    data = pickle.dumps(obj)
+    with open(path, "wb") as f:
+        f.write(_signature(key, data))
+        f.write(data)
+
+
+def _load(path: str, key: bytes) -> Any:
+    """
+    Load object written by _dump. Objects not signed by the key are refused,
+    as unpickling them could run code of anyone who can write to the cache.
+    """
+    with open(path, "rb") as f:
+        signature = f.read(hashlib.sha256().digest_size)
+        data = f.read()
+    if not hmac.compare_digest(signature, _signature(key, data)):
+        raise ValueError("invalid signature")
+    return pickle.loads(data)
+
+
+def _touch(path: str) -> None:
+    """Mark file as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+class SharedEntries:
+    """Entries of given name and dependencies in a shared cache, loaded lazily."""
+
+    def __init__(self, directory: str, key: bytes) -> None:
+        self._directory = directory
+        self._key = key
+
+    def _load(self, signature: str) -> "CacheEntry | None":
+        path = os.path.join(self._directory, signature)
+        try:
+            entry = _load(path, self._key)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Skipping unreadable shared cache entry '{path}': {e}")
+            return None
+        return entry
+
+    def get(self, signature: str) -> "CacheEntry | None":
+        """Entry with given signature (if present)."""
+        entry = self._load(signature)
+        if entry is not None:
+            _touch(os.path.join(self._directory, signature))
+        return entry
+
+    def values(self) -> Iterator["CacheEntry"]:
+        """All entries, most recently used first."""
+        signatures = []
+        try:
+            with os.scandir(self._directory) as it:
+                for dir_entry in it:
+                    if not dir_entry.name.startswith("."):
+                        signatures.append((dir_entry.stat().st_mtime, dir_entry.name))
+        except FileNotFoundError:
+            return
+
+        for _, signature in sorted(signatures, reverse=True):
+            if (entry := self._load(signature)) is not None:
+                yield entry
+
+
+class SharedCache:
+    """
+    Cache directory shared between task checkouts (and possibly machines).
+
+    Entries are stored as separate files keyed by job name, dependencies
+    and signature, together with objects of files they produced.
+    Entries are signed by a secret key, entries with invalid signatures are ignored.
+    All writes are atomic, so multiple pisek instances can use it at once.
+    When it grows over max_size, least recently used files are evicted.
+    """
+
+    def __init__(self, directory: str, max_size: int, key: bytes) -> None:
+        from pisek.jobs.cache import CACHE_FORMAT
+
+        self._root = os.path.join(
+            directory, f"pisek-{__version__}-format-{CACHE_FORMAT}"
+        )
+        self._max_size = max_size
+        self._key = key
+        self._written = False
+
+    def _entries_dir(self, name: str) -> str:
+        return os.path.join(
+            self._root, ENTRIES_SUBDIR, hashlib.sha256(name.encode()).hexdigest()[:32]
+        )
+
+    def object_path(self, file_hash: str) -> str:
+        return os.path.join(self._root, OBJECTS_SUBDIR, file_hash[:2], file_hash[2:])
+
+    def entries_by_dependencies(self, name: str) -> Iterator[SharedEntries]:
+        """Entries of given name grouped by their dependencies fingerprint."""
+        directory = self._entries_dir(name)
+        try:
+            dependencies = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        for dependency in dependencies:
+            yield SharedEntries(os.path.join(directory, dependency), self._key)
+
+    def has_object(self, file_hash: str) -> bool:
+        return os.path.isfile(self.object_path(file_hash))
+
+    def remove_object(self, file_hash: str) -> None:
+        """Remove object whose contents don't match its hash."""
+        logger.warning(f"Removing corrupted shared cache object '{file_hash}'")
+        self._remove(self.object_path(file_hash))
+
+    def add(self, entry: "CacheEntry", objects: dict[str, str]) -> None:
+        """
+        Add entry to the shared cache.
+        Objects (hash -> local path) of produced files are uploaded first.
+        """
+        for file_hash, local_path in objects.items():
+            path = self.object_path(file_hash)
+            if os.path.exists(path):
+                _touch(path)
+            else:
+                _write_atomically(path, lambda tmp: clone_file(local_path, tmp))
+                self._written = True
+
+        path = os.path.join(
+            self._entries_dir(entry.name), entry.dependencies, entry.signature
+        )
+        if os.path.exists(path):
+            _touch(path)
+        else:
+            _write_atomically(path, lambda tmp: _dump(entry, tmp, self._key))
+            self._written = True
+
+    def evict(self) -> None:
+        """Remove least recently used files until the cache fits max_size."""
+        if not self._written:
+            return
+
+        files: list[tuple[float, int, str]] = []
+        total_size = 0
+        now = time.time()
+        for root, _, filenames in os.walk(self._root):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if filename.startswith("."):
+                    if now - stat.st_mtime > STALE_TMP_AGE:
+                        self._remove(path)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total_size <= self._max_size:
+                break
+            self._remove(path)
+            total_size -= size
+        self._written = False
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            # Somebody else removed it or the directory is not empty
+            pass
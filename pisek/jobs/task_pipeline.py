@@ -163,4 +163,4 @@ class TaskPipeline(JobPipeline):
         if self.input_generator.result is None:
             raise RuntimeError("Input dataset has not been computed yet.")
         assert isinstance(result, RunGeneratorResult)
-        return result.input_dataset
+        return list(result.input_dataset)
@@ -0,0 +1,80 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import logging
+from functools import partial
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener
+import threading
+
+from pisek.jobs.executors import (
+    create_process_pool,
+    parse_address,
+    worker_authkey,
+    run_detached_job,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _serve_client(conn: Connection, pool: ProcessPoolExecutor, jobs: int) -> None:
+    """Run jobs requested by one pisek instance (see WorkerConnection)."""
+    send_lock = threading.Lock()
+
+    def reply(request_id: int, future: Future) -> None:
+        try:
+            response = (request_id, True, future.result())
+        except BaseException as e:
+            response = (request_id, False, e)
+        with send_lock:
+            try:
+                conn.send(response)
+            except OSError:
+                pass  # Client is gone
+
+    try:
+        conn.send(jobs)
+        while True:
+            request_id, job, env, cwd, log_level = conn.recv()
+            future = pool.submit(run_detached_job, job, env, cwd, log_level)
+            future.add_done_callback(partial(reply, request_id))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def run_worker(address: str, jobs: int) -> None:
+    """Run jobs for pisek instances connecting to given address."""
+    authkey = worker_authkey()
+    with (
+        create_process_pool(jobs) as pool,
+        Listener(parse_address(address), authkey=authkey) as listener,
+    ):
+        print(
+            f"Worker listening on {address} running {jobs} jobs in parallel",
+            flush=True,
+        )
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                logger.warning(f"Rejected connection: {e}")
+                continue
+            threading.Thread(
+                target=_serve_client, args=(conn, pool, jobs), daemon=True
+            ).start()
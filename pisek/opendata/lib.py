@@ -15,6 +15,7 @@
 import os
 import shutil
 import tempfile
+from typing import Any
 
 from pisek.user_errors import (
     InvalidArgument,
@@ -32,6 +33,7 @@ from pisek.utils.paths import (
     OpendataOutputPath,
 )
 from pisek.utils.pipeline_tools import run_pipeline
+from pisek.utils.scratch import scratch_root
 from pisek.config.config_types import GenType
 from pisek.config.config_hierarchy import DEFAULT_CONFIG_FILENAME
 from pisek.config.task_config import load_config
@@ -44,7 +46,7 @@ from pisek.task_jobs.data.data_manager import TEST_SEED
 from pisek.opendata.types import OpendataTestInfo, OpendataTestcaseInfo, OpendataVerdict
 from pisek.opendata.managers import OpendataPipeline
 
-ENV_ARGS = {
+ENV_ARGS: dict[str, Any] = {
     "no_colors": True,
     "no_jumps": True,
 }
@@ -230,7 +232,9 @@ class Testcase:
 
     def _make_tmp_dir(self) -> None:
         if self.tmp_dir is None:
-            self.tmp_dir = tempfile.mkdtemp(prefix="pisek_opendata_")
+            self.tmp_dir = tempfile.mkdtemp(
+                prefix="pisek_opendata_", dir=scratch_root()
+            )
 
     def _clear_tmp_dir(self) -> None:
         assert self.tmp_dir is not None
@@ -21,6 +21,7 @@ import shutil
 import subprocess
 from tempfile import NamedTemporaryFile, _TemporaryFileWrapper
 from typing import Any, IO, Optional, Protocol, TYPE_CHECKING
+import zipfile
 
 from pisek.utils.text import tab
 from pisek.jobs.logging import LogLevel
@@ -33,6 +34,10 @@ if TYPE_CHECKING:
 
 ALL_STRATEGIES: dict[BuildStrategyName, type["BuildStrategy"]] = {}
 
+# Seconds the training run of a Java program (for --warm-start) may take
+JAVA_TRAINING_TIMEOUT = 10
+JAVA_WARM_FLAGS = ["-XX:+UseSerialGC", "-XX:-UsePerfData"]
+
 
 class FakeChangedCWD:
     def __init__(self, strategy: "BuildStrategy", path: str):
@@ -55,6 +60,7 @@ class RunPopen(Protocol):
         stderr: _TemporaryFileWrapper,
         text: bool,
         cwd: str | None,
+        stdin: int | None = None,
     ) -> subprocess.Popen: ...
 
 
@@ -433,8 +439,64 @@ class Java(BuildStrategy):
             )
         st = self._stat(run_path)
         self._chmod(run_path, st.st_mode | 0o111)
+        if self._env.warm_start:
+            self._build_warm_start(entry_class)
         return self.target
 
+    def _build_warm_start(self, entry_class: str) -> None:
+        """
+        Dumps classes loaded by a training run of the program to a dynamic class
+        data sharing archive (on top of the JDK's default one) and adds a run-warm
+        script using it, which starts faster (used with --warm-start).
+        """
+        # Class data sharing doesn't support classes in directories
+        jar = os.path.join(self.target, "program.jar")
+        with zipfile.ZipFile(self._path(jar), "w") as jar_file:
+            for root, _, filenames in os.walk(self._path(self.target)):
+                for filename in filenames:
+                    if filename.endswith(".class"):
+                        class_path = os.path.join(root, filename)
+                        jar_file.write(
+                            class_path,
+                            os.path.relpath(class_path, self._path(self.target)),
+                        )
+
+        # The program gets empty input, so it should exit soon
+        archive = os.path.join(self.target, "classes.jsa")
+        with NamedTemporaryFile(prefix="pisek_", delete_on_close=False) as output:
+            self._run_popen(
+                [
+                    "timeout",
+                    str(JAVA_TRAINING_TIMEOUT),
+                    "java",
+                    f"-XX:ArchiveClassesAtExit={archive}",
+                    *JAVA_WARM_FLAGS,
+                    "--class-path",
+                    jar,
+                    entry_class,
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=output,
+                stderr=output,
+                text=True,
+                cwd=self.workdir,
+            )
+        if not self._exists(archive):
+            # Dynamic class data archives need Java 13+
+            self._log("debug", f"Cannot create class data archive for {entry_class}")
+            return
+
+        run_path = os.path.join(self.target, "run-warm")
+        with self._open(run_path, "w") as run_file:
+            run_file.write(
+                "#!/bin/sh\n"
+                + "exec java -XX:SharedArchiveFile=${0%/run-warm}/classes.jsa "
+                + " ".join(JAVA_WARM_FLAGS)
+                + f" --class-path ${{0%/run-warm}}/program.jar {entry_class} $@\n"
+            )
+        st = self._stat(run_path)
+        self._chmod(run_path, st.st_mode | 0o111)
+
 
 class Go(BuildBinary):
     name = BuildStrategyName.go
@@ -40,6 +40,7 @@ class RunCMSJudge(RunChecker):
     ) -> None:
         super().__init__(env=env, checker_name=judge.name, **kwargs)
         self.judge = judge
+        self._add_run_section(judge)
         self.points_file = self.checker_log_file.replace_suffix(".points")
 
     def _load_points(self, result: RunResult) -> Decimal:
@@ -11,6 +11,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import random
+from typing import Iterator
 
 from pisek.utils.paths import IInputPath, IOutputPath, IRawPath
 from pisek.jobs.jobs import Job
@@ -36,9 +37,7 @@ class FuzzingManager(TaskJobManager):
     def __init__(self) -> None:
         super().__init__("Fuzz judge")
 
-    def _get_jobs(self) -> list[Job]:
-        jobs: list[Job] = []
-
+    def _get_jobs(self) -> Iterator[Job]:
         primary_sol = self.prerequisite_result(
             SOLUTION_MAN_CODE + self._env.config.primary_solution, SolutionManagerResult
         )
@@ -72,11 +71,11 @@ class FuzzingManager(TaskJobManager):
                 for _ in range(times):
                     seed = seeds.pop()
                     inp, out = rand_gen.choice(testcases)
-                    jobs += self._fuzz_jobs(job, inp, out, seed, rand_gen)
+                    yield from self._fuzz_jobs(job, inp, out, seed, rand_gen)
 
         if self._env.config.tests.checks_judge_rejects_trailing_string:
             for inp, out in testcases:
-                jobs += self._fuzz_jobs(
+                yield from self._fuzz_jobs(
                     TrailingString,
                     inp,
                     out,
@@ -85,8 +84,6 @@ class FuzzingManager(TaskJobManager):
                     Verdict.wrong_answer,
                 )
 
-        return jobs
-
     def _fuzz_jobs(
         self,
         job: type[Invalidate],
@@ -120,4 +117,4 @@ class FuzzingManager(TaskJobManager):
                     checker_outs.add(job.points_file)
                 checker_outs.add(job.checker_log_file)
 
-        return FuzzingManagerResult(checker_outs)
+        return FuzzingManagerResult(frozenset(checker_outs))
@@ -66,6 +66,7 @@ class RunOpendataJudge(RunBatchChecker):
             **kwargs,
         )
         self.judge = judge
+        self._add_run_section(judge)
         self.seed = seed
 
     def _load_stderr(self) -> tuple[str, dict[str, Any]]:
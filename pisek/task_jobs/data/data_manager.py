@@ -189,4 +189,6 @@ class DataManager(TaskJobManager):
         )
 
     def _compute_result(self) -> DataManagerResult:
-        return DataManagerResult(self._testcase_infos)
+        return DataManagerResult(
+            {num: tuple(infos) for num, infos in self._testcase_infos.items()}
+        )
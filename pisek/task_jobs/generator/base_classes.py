@@ -33,6 +33,7 @@ class GeneratorListInputs(ProgramsJob):
     ) -> None:
         self.generator = generator
         super().__init__(env=env, name=name or "List generator inputs", **kwargs)
+        self._add_run_section(generator)
 
     @abstractmethod
     def _run(self) -> list[TestcaseInfo]:
@@ -62,6 +63,7 @@ class GenerateInput(ProgramsJob):
         super().__init__(
             env=env, name=name or f"Generate {self.input_path.name}", **kwargs
         )
+        self._add_run_section(generator)
 
         self.run_result: RunResult | None = None
         self._register_cached_attribute("run_result")
@@ -99,6 +101,7 @@ class GeneratorTestDeterminism(ProgramsJob):
             name=name or f"Generator is deterministic (on {self._original:p})",
             **kwargs,
         )
+        self._add_run_section(generator)
 
     def _run(self) -> None:
         input_path = self.input_path.to_raw(self._env.config.tests.in_format)
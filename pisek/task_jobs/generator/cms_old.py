@@ -44,7 +44,7 @@ class CmsOldListInputs(GeneratorListInputs):
             args=[gen_dir.abspath],
             stderr=LogPath.generator_log(self.generator.name),
         )
-        self._access_dir(gen_dir)
+        self._write_dir(gen_dir)
 
         if run_result.kind != RunResultKind.OK:
             raise self._create_program_failure(
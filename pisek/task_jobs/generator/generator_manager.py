@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import cast, Optional
+from typing import cast, Iterator, Optional
 from hashlib import blake2b
 
 from pisek.env.env import Env
@@ -77,7 +77,7 @@ class PrepareGenerator(TaskJobManager):
         if self._list_inputs.result is None:
             return InvalidResult()
         else:
-            return PrepareGeneratorResult(self._list_inputs.result)
+            return PrepareGeneratorResult(tuple(self._list_inputs.result))
 
 
 def list_inputs_job(env: Env, generator: RunSection) -> GeneratorListInputs:
@@ -311,14 +311,14 @@ class TestcaseInfoMixin(JobManager):
 
     def _compute_result(self) -> RunGeneratorResult:
         return RunGeneratorResult(
-            input_dataset=list(sorted(self.input_dataset, key=lambda i: i.name)),
-            inputs={i.name: (list(sorted(t)), s) for i, (t, s) in self.inputs.items()},
-            generator_run_results=[
+            input_dataset=tuple(sorted(self.input_dataset, key=lambda i: i.name)),
+            inputs={i.name: (tuple(sorted(t)), s) for i, (t, s) in self.inputs.items()},
+            generator_run_results=tuple(
                 j.run_result
                 for j in self._jobs
                 if isinstance(j, GenerateInput)
                 if isinstance(j.run_result, RunResult)
-            ],
+            ),
         )
 
 
@@ -326,9 +326,9 @@ class RunGenerator(TaskJobManager, TestcaseInfoMixin):
     def __init__(self) -> None:
         super().__init__("Run generator")
 
-    def _get_jobs(self) -> list[Job]:
+    def _get_jobs(self) -> Iterator[Job]:
         for sub_num, inputs in self._all_testcases().items():
             for inp in inputs:
+                created = len(self._jobs)
                 self._add_testcase_info_jobs(inp, sub_num)
-
-        return self._jobs
+                yield from self._jobs[created:]
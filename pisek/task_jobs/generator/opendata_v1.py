@@ -67,6 +67,7 @@ class OpendataV1GeneratorJob(ProgramsJob):
             args=[str(test), f"{self.seed:016x}"],
             stdout=self.input_path.to_raw(self._env.config.tests.in_format),
             stderr=self.input_path.to_log(self.generator.name),
+            hash_stdout=True,
         )
         if self.run_result.kind != RunResultKind.OK:
             raise self._create_program_failure(
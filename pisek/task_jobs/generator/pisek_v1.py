@@ -111,6 +111,7 @@ class PisekV1GeneratorJob(ProgramsJob):
             args=args,
             stdout=self.input_path.to_raw(self._env.config.tests.in_format),
             stderr=self.input_path.to_log(self.generator.name),
+            hash_stdout=True,
         )
         if self.run_result.kind != RunResultKind.OK:
             raise self._create_program_failure(
@@ -10,43 +10,76 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from dataclasses import dataclass
+from collections.abc import Mapping
+from dataclasses import dataclass, fields
+from types import MappingProxyType
+from typing import Any
 
 from pisek.utils.paths import IInputPath, TaskPath
 from pisek.task_jobs.run_result import RunResult
 from pisek.task_jobs.data.testcase_info import TestcaseInfo
 from pisek.task_jobs.solution.solution_result import SolutionResultDetail, Verdict
 
+# Results are shared by all dependent items, so they must not be modified.
 
-@dataclass
+
+@dataclass(frozen=True)
+class FrozenMappingsResult:
+    """Result whose mappings are wrapped in read-only proxies."""
+
+    def __post_init__(self) -> None:
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, Mapping):
+                object.__setattr__(self, field.name, MappingProxyType(dict(value)))
+
+    # Proxies cannot be pickled (e.g. when sending jobs to worker processes)
+    def __getstate__(self) -> dict[str, Any]:
+        return {
+            field.name: (
+                dict(value)
+                if isinstance(value := getattr(self, field.name), MappingProxyType)
+                else value
+            )
+            for field in fields(self)
+        }
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        for name, value in state.items():
+            if isinstance(value, dict):
+                value = MappingProxyType(value)
+            object.__setattr__(self, name, value)
+
+
+@dataclass(frozen=True)
 class InvalidResult:
     pass
 
 
-@dataclass
+@dataclass(frozen=True)
 class PrepareGeneratorResult:
-    inputs: list[TestcaseInfo]
+    inputs: tuple[TestcaseInfo, ...]
 
 
-@dataclass
-class DataManagerResult:
-    testcase_infos: dict[int, list[TestcaseInfo]]
+@dataclass(frozen=True)
+class DataManagerResult(FrozenMappingsResult):
+    testcase_infos: Mapping[int, tuple[TestcaseInfo, ...]]
 
 
-@dataclass
-class RunGeneratorResult:
-    input_dataset: list[IInputPath]
-    inputs: dict[str, tuple[list[int], int | None]]
-    generator_run_results: list[RunResult]
+@dataclass(frozen=True)
+class RunGeneratorResult(FrozenMappingsResult):
+    input_dataset: tuple[IInputPath, ...]
+    inputs: Mapping[str, tuple[tuple[int, ...], int | None]]
+    generator_run_results: tuple[RunResult, ...]
 
 
-@dataclass
+@dataclass(frozen=True)
 class SolutionManagerResult(RunGeneratorResult):
-    testcase_results: dict[IInputPath, SolutionResultDetail | None]
-    tests_results: dict[int, Verdict]
-    checker_outs: set[TaskPath]
+    testcase_results: Mapping[IInputPath, SolutionResultDetail | None]
+    tests_results: Mapping[int, Verdict]
+    checker_outs: frozenset[TaskPath]
 
 
-@dataclass
+@dataclass(frozen=True)
 class FuzzingManagerResult:
-    checker_outs: set[TaskPath]
+    checker_outs: frozenset[TaskPath]
@@ -0,0 +1,144 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import atexit
+from multiprocessing.util import Finalize
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+
+from pisek.utils.scratch import scratch_root
+
+
+class MiniboxServer:
+    """
+    Long-running minibox (minibox --server) that runs programs on request.
+    Saves starting minibox, creating a meta file and a working directory
+    for every program run. Runs one program at a time.
+    """
+
+    def __init__(self, minibox: str) -> None:
+        self.key = _server_key(minibox)
+        self._socket, server_socket = socket.socketpair()
+        with server_socket:
+            self._process = subprocess.Popen(
+                [minibox, "--server"],
+                stdin=server_socket.fileno(),
+                stdout=subprocess.DEVNULL,
+            )
+        self._devnull = os.open(os.devnull, os.O_RDWR)
+        # Working directory of programs, reused while it stays empty
+        self.cwd = tempfile.mkdtemp(prefix="pisek_", dir=self.key[2])
+
+        self._lock = threading.Lock()
+        self._running = False
+        self.returncode: int | None = None
+        self.meta = ""
+
+    def start(self, args: list[str], stdio: list[int | None]) -> None:
+        """Start running minibox with given args, stdin, stdout and stderr."""
+        payload = b"".join(arg.encode() + b"\0" for arg in args)
+        fds = [self._devnull if fd is None else fd for fd in stdio]
+        with self._lock:
+            self.returncode = None
+            self._running = True
+            socket.send_fds(
+                self._socket, [b"R" + struct.pack("=I", len(payload)) + payload], fds
+            )
+
+    def wait(self) -> int:
+        """Wait for the program to finish and return exit code of minibox."""
+        if self.returncode is None:
+            returncode, meta_len = struct.unpack("=iI", self._recv(8))
+            meta = self._recv(meta_len).decode()
+            with self._lock:
+                self._running = False
+                self.returncode = returncode
+                self.meta = meta
+        return self.returncode
+
+    def terminate(self) -> None:
+        with self._lock:
+            if self._running:
+                self._socket.send(b"K")
+
+    def _recv(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise RuntimeError("Minibox server exited unexpectedly.")
+            data += chunk
+        return data
+
+    def clean_cwd(self) -> None:
+        for name in os.listdir(self.cwd):
+            path = os.path.join(self.cwd, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def close(self) -> None:
+        """Stop the server (and the program it runs)."""
+        self._socket.close()
+        os.close(self._devnull)
+        self._process.wait()
+        shutil.rmtree(self.cwd, ignore_errors=True)
+
+
+_idle_servers: dict[tuple[str, int, str], list[MiniboxServer]] = {}
+_idle_servers_lock = threading.Lock()
+
+
+def _server_key(minibox: str) -> tuple[str, int, str]:
+    # Minibox gets recompiled when its source changes and
+    # the scratch directory changes once it gets almost full
+    return minibox, os.stat(minibox).st_mtime_ns, scratch_root()
+
+
+def acquire_minibox_server(minibox: str) -> MiniboxServer:
+    """Get an idle server running given minibox or start a new one."""
+    with _idle_servers_lock:
+        idle = _idle_servers.get(_server_key(minibox))
+        if idle:
+            return idle.pop()
+    return MiniboxServer(minibox)
+
+
+def release_minibox_server(server: MiniboxServer) -> None:
+    """Return server that has finished its program to the idle ones."""
+    assert server.returncode is not None
+    server.clean_cwd()
+    with _idle_servers_lock:
+        _idle_servers.setdefault(server.key, []).append(server)
+
+
+@atexit.register
+def _close_idle_servers() -> None:
+    with _idle_servers_lock:
+        for servers in _idle_servers.values():
+            for server in servers:
+                server.close()
+        _idle_servers.clear()
+
+
+# Worker processes of process pools exit without running atexit handlers
+Finalize(None, _close_idle_servers, exitpriority=0)
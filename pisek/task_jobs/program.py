@@ -15,24 +15,34 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from contextlib import ExitStack
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from decimal import Decimal
+import fcntl
+from importlib.resources import files
+import json
 from math import ceil
 import os
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from typing import assert_never, Optional, Any, Union, Callable
 import signal
 import subprocess
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from typing import Optional, Any, Union, Callable
+from tempfile import TemporaryDirectory
+import threading
+from typing import assert_never, Optional, Any, BinaryIO, Union, Callable, Sequence
 
 from pisek.config.task_config import ProgramRole, RunSection
 from pisek.env.env import Env
 from pisek.utils.paths import TaskPath, LogPath
+from pisek.utils.scratch import scratch_root
+from pisek.jobs.cache import FileHasher, FileKey, file_key
 from pisek.jobs.jobs import PipelineItemFailure
+from pisek.jobs.resources import Resources
 from pisek.utils.text import tab
 from pisek.task_jobs.run_result import RunResultKind, RunResult
 from pisek.task_jobs.task_job import TaskJob
+from pisek.task_jobs.minibox_server import (
+    MiniboxServer,
+    acquire_minibox_server,
+    release_minibox_server,
+)
 
 
 @dataclass
@@ -48,12 +58,12 @@ class ProgramPoolItem:
     stdout: Optional[Union[TaskPath, int]]
     stderr: Optional[TaskPath]
     env: dict[str, str] = field(default_factory=lambda: {})
+    hash_stdout: bool = False
+    cpus: list[int] | None = None
 
-    def to_popen(self, minibox: str, meta_file: str) -> dict[str, Any]:
-        """Returns subprocess.Popen args for executing this PoolItem."""
-        result: dict[str, Any] = {}
-
-        minibox_args = []
+    def minibox_args(self) -> list[str]:
+        """Returns minibox options for executing this PoolItem (without the command)."""
+        minibox_args = ["--meta-json"]
         minibox_args.append(f"--time={self.time_limit}")
         minibox_args.append(f"--wall-time={self.clock_limit}")
         minibox_args.append(f"--mem={self.mem_limit*1024}")
@@ -68,33 +78,154 @@ class ProgramPoolItem:
             elif getattr(self, std) is None:
                 minibox_args.append(f"--{std}=/dev/null")
 
-            if isinstance(attr, int):
-                result[std] = attr
-            else:
-                result[std] = subprocess.PIPE
-
         for key, val in self.env.items():
             minibox_args.append(f"--env={key}={val}")
 
+        if self.cpus is not None:
+            minibox_args.append(f"--cpus={','.join(map(str, self.cpus))}")
+
         minibox_args.append("--silent")
-        minibox_args.append(f"--meta={meta_file}")
+        return minibox_args
+
+    def command(self) -> list[str]:
+        return ["--run", "--", self.executable.abspath] + self.args
+
+    def stdio(self) -> list[int | None]:
+        """File descriptors for stdin, stdout and stderr of minibox (None if not given)."""
+        return [
+            attr if isinstance(attr, int) else None
+            for attr in (self.stdin, self.stdout, self.stderr)
+        ]
+
+    def to_popen(self, minibox: str, meta_fd: int) -> dict[str, Any]:
+        """Returns subprocess.Popen args for executing this PoolItem."""
+        result: dict[str, Any] = {}
+        for std, fd in zip(("stdin", "stdout", "stderr"), self.stdio()):
+            result[std] = subprocess.PIPE if fd is None else fd
 
         result["args"] = (
-            [minibox]
-            + minibox_args
-            + ["--run", "--", self.executable.abspath]
-            + self.args
+            [minibox] + self.minibox_args() + [f"--meta-fd={meta_fd}"] + self.command()
         )
+        result["pass_fds"] = (meta_fd,)
         return result
 
 
+# Bigger pipe buffer lets programs write while their previous output is hashed
+STDOUT_PIPE_SIZE = 1024 * 1024
+
+
+class StdoutHasher:
+    """Writes program stdout from a pipe to a file, hashing it on the way."""
+
+    def __init__(self, path: TaskPath, algorithm: str) -> None:
+        self.path = path
+        self._hasher = FileHasher(algorithm)
+        self._error: Exception | None = None
+
+        read_fd, self.write_fd = os.pipe()
+        try:
+            fcntl.fcntl(self.write_fd, fcntl.F_SETPIPE_SZ, STDOUT_PIPE_SIZE)
+        except OSError:
+            pass  # Bigger than allowed by the system
+        self._pipe = open(read_fd, "rb", buffering=0)
+        self._file = open(path.path, "wb")
+        self._write_end_open = True
+        self._thread = threading.Thread(target=self._copy, daemon=True)
+        self._thread.start()
+
+    def _copy(self) -> None:
+        with self._pipe, self._file:
+            try:
+                while chunk := self._pipe.read(STDOUT_PIPE_SIZE):
+                    self._file.write(chunk)
+                    self._hasher.update(chunk)
+            except Exception as e:
+                self._error = e
+
+    def close_write_end(self) -> None:
+        """Close our copy of the pipe write end (after the program has got it)."""
+        if self._write_end_open:
+            os.close(self.write_fd)
+            self._write_end_open = False
+
+    def result(self) -> tuple[FileKey, str]:
+        """Wait for the program output to be written and return its key and hash."""
+        self.close_write_end()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return file_key(self.path.path), self._hasher.hexdigest()
+
+
+# Most testcases run in one batch
+MAX_BATCH_SIZE = 64
+# While a batch runs, another batch of the same program starts only with this
+# many runs waiting, so that runs arriving together form one batch
+MIN_PARALLEL_BATCH_SIZE = 4
+
+
+@dataclass
+class BatchedRun:
+    """Run of a program waiting to be processed in a batch."""
+
+    pool_item: ProgramPoolItem
+    args: list[str]  # Arguments specific to this testcase
+    env: dict[str, str]  # Environment variables specific to this testcase
+    done: bool = False
+    result: RunResult | None = None  # None if the batch failed
+
+    def testcase(self) -> dict[str, Any]:
+        """Description of this run given to the batched program."""
+
+        def path(file: TaskPath | int | None) -> str | None:
+            return file.abspath if isinstance(file, TaskPath) else None
+
+        return {
+            "args": self.args,
+            "env": self.env,
+            "stdin": path(self.pool_item.stdin),
+            "stdout": path(self.pool_item.stdout),
+            "stderr": path(self.pool_item.stderr),
+        }
+
+
+@dataclass(frozen=True)
+class BatchProgram:
+    """Program (with its arguments) run on a batch of testcases."""
+
+    executable: TaskPath
+    args: tuple[str, ...]
+    env: tuple[tuple[str, str], ...]
+    process_limit: int
+
+
+@dataclass
+class BatchQueue:
+    """Runs of one program waiting for a batch."""
+
+    waiting: list[BatchedRun] = field(default_factory=list)
+    running: int = 0  # Number of batches running now
+
+    def can_start(self) -> bool:
+        return bool(self.waiting) and (
+            self.running == 0 or len(self.waiting) >= MIN_PARALLEL_BATCH_SIZE
+        )
+
+
+_batch_queues: dict[tuple, BatchQueue] = {}
+_batch_condition = threading.Condition()
+
+
 class ProgramsJob(TaskJob):
     """Job that deals with a program."""
 
+    remote = True
+
     def __init__(self, env: Env, name: str, **kwargs) -> None:
         super().__init__(env=env, name=name, **kwargs)
         self._program_pool: list[ProgramPoolItem] = []
         self._callback: Optional[Callable[[subprocess.Popen], None]] = None
+        self._run_sections: list[RunSection] = []
 
     @staticmethod
     def _env_disjoint_union(
@@ -108,6 +239,19 @@ class ProgramsJob(TaskJob):
             )
         return union
 
+    def _add_run_section(self, program: RunSection) -> None:
+        """Registers a program this job runs, so its resources get reserved."""
+        self._run_sections.append(program)
+
+    def resources(self) -> Resources:
+        """Reserve resources for all programs of this job (they may run at once)."""
+        if not self._run_sections:
+            return super().resources()
+        return Resources(
+            cpus=sum(max(1, program.process_limit) for program in self._run_sections),
+            memory=sum(program.mem_limit for program in self._run_sections),
+        )
+
     def _load_executable(
         self,
         path: TaskPath,
@@ -120,13 +264,24 @@ class ProgramsJob(TaskJob):
         stdout: Optional[Union[TaskPath, int]] = None,
         stderr: Optional[LogPath] = None,
         env: dict[str, str] = {},
+        hash_stdout: bool = False,
+        warm: bool = False,
     ):
+        """
+        Adds executable to execution pool.
+        With hash_stdout, stdout file is hashed while being written
+        (batched runs write it directly, so it's hashed afterwards).
+        (Don't use it for timed programs, copying the output could slow them down.)
+        With warm, the faster starting variant of the program is used if built.
+        """
         if self._is_file(path):
             self._access_file(path)
             executable = path
         elif self._is_dir(path):
             self._access_dir(path)
             executable = path.join("run")
+            if warm and self._is_file(path.join("run-warm")):
+                executable = path.join("run-warm")
 
         if self._is_dir(executable):
             raise PipelineItemFailure(
@@ -139,10 +294,10 @@ class ProgramsJob(TaskJob):
             self._access_file(stdin)
         if isinstance(stdout, TaskPath):
             self.make_filedirs(stdout)
-            self._access_file(stdout)
+            self._write_file(stdout)
         if isinstance(stderr, TaskPath):
             self.make_filedirs(stderr)
-            self._access_file(stderr)
+            self._write_file(stderr)
 
         self._program_pool.append(
             ProgramPoolItem(
@@ -157,6 +312,8 @@ class ProgramsJob(TaskJob):
                 stdout=stdout,
                 stderr=stderr,
                 env=env,
+                hash_stdout=hash_stdout,
+                cpus=self.cpus,
             )
         )
 
@@ -169,6 +326,7 @@ class ProgramsJob(TaskJob):
         stdout: Optional[Union[TaskPath, int]] = None,
         stderr: Optional[LogPath] = None,
         env={},
+        hash_stdout: bool = False,
     ) -> None:
         """Adds program to execution pool."""
         time_limit: Decimal | None = None
@@ -186,6 +344,8 @@ class ProgramsJob(TaskJob):
             stdout=stdout,
             stderr=stderr,
             env=self._env_disjoint_union(env, program.env),
+            hash_stdout=hash_stdout,
+            warm=self._warm_start(program_role),
         )
 
     def _load_callback(self, callback: Callable[[subprocess.Popen], None]) -> None:
@@ -194,7 +354,7 @@ class ProgramsJob(TaskJob):
         self._callback = callback
 
     def _read_run_result(
-        self, pool_item: ProgramPoolItem, process: subprocess.Popen, meta_file: str
+        self, pool_item: ProgramPoolItem, process: subprocess.Popen, meta_text: str
     ) -> RunResult:
         assert process.stderr is not None  # To make mypy happy
 
@@ -203,15 +363,35 @@ class ProgramsJob(TaskJob):
                 f"Minibox error:\n{tab(process.stderr.read().decode())}"
             )
 
-        with open(meta_file) as f:
-            meta_raw = f.read().strip().split("\n")
-        meta = {key: val for key, val in map(lambda x: x.split(":", 1), meta_raw)}
-
-        time = Decimal(meta["time"])
-        wall_time = Decimal(meta["time-wall"])
-        memory = ceil(int(meta["max-rss"]) / 1024)
+        return self._parse_run_result(pool_item, process.returncode, meta_text)
 
-        if process.returncode == 0:
+    @staticmethod
+    def _parse_meta(meta_text: str) -> dict[str, Any]:
+        try:
+            meta = json.loads(meta_text, parse_float=Decimal)
+        except json.JSONDecodeError:
+            meta = None
+        if not isinstance(meta, dict):
+            raise PipelineItemFailure(f"Invalid minibox meta:\n{tab(meta_text)}")
+        return meta
+
+    def _parse_run_result(
+        self, pool_item: ProgramPoolItem, returncode: int, meta_text: str
+    ) -> RunResult:
+        meta = self._parse_meta(meta_text)
+
+        time = meta["time"]
+        wall_time = meta["time-wall"]
+        memory = ceil(meta["max-rss"] / 1024)
+        cpus = None if pool_item.cpus is None else tuple(pool_item.cpus)
+        counters = {
+            "context_switches": meta["csw-voluntary"] + meta["csw-forced"],
+            "page_faults": meta["page-faults-minor"] + meta["page-faults-major"],
+            "read_bytes": meta["read-bytes"],
+            "written_bytes": meta["write-bytes"],
+        }
+
+        if returncode == 0:
             return RunResult(
                 RunResultKind.OK,
                 0,
@@ -222,14 +402,16 @@ class ProgramsJob(TaskJob):
                 pool_item.stdout,
                 pool_item.stderr,
                 "Exited with return code 0",
+                cpus,
+                **counters,
             )
 
-        elif process.returncode == 1:
+        elif returncode == 1:
             if meta["status"] in ("RE", "SG"):
                 if meta["status"] == "RE":
-                    return_code = int(meta["exitcode"])
+                    return_code = meta["exitcode"]
                 elif meta["status"] == "SG":
-                    return_code = int(meta["exitsig"])
+                    return_code = meta["exitsig"]
                     meta["message"] += f" ({signal.Signals(return_code).name})"
 
                 return RunResult(
@@ -242,6 +424,8 @@ class ProgramsJob(TaskJob):
                     pool_item.stdout,
                     pool_item.stderr,
                     meta["message"],
+                    cpus,
+                    **counters,
                 )
 
             elif meta["status"] == "TO":
@@ -260,6 +444,8 @@ class ProgramsJob(TaskJob):
                     pool_item.stdout,
                     pool_item.stderr,
                     f"Timeout after {time_limit}",
+                    cpus,
+                    **counters,
                 )
             else:
                 raise RuntimeError(f"Unknown minibox status {meta['message']}.")
@@ -268,29 +454,50 @@ class ProgramsJob(TaskJob):
 
     def _run_programs(self) -> list[RunResult]:
         """Runs all programs in execution pool."""
+        if self._callback is None:
+            return self._run_programs_in_servers()
+
         running_pool: list[subprocess.Popen] = []
-        meta_files: list[str] = []
+        meta_pipes: list[BinaryIO] = []
         tmp_dirs: list[TemporaryDirectory] = []
+        stdout_hashers: list[StdoutHasher | None] = []
         minibox = TaskPath.executable_path("_minibox").abspath
         with ExitStack() as exit_stack:
             for pool_item in self._program_pool:
-                meta_file = NamedTemporaryFile(prefix="pisek_", delete_on_close=False)
-                exit_stack.enter_context(meta_file)
-                meta_file.close()
-                meta_files.append(meta_file.name)
-
-                popen = pool_item.to_popen(minibox, meta_file.name)
+                meta_read, meta_write = os.pipe()
+                meta_pipes.append(exit_stack.enter_context(open(meta_read, "rb")))
+
+                stdout_hasher = None
+                popen_item = pool_item
+                if (
+                    pool_item.hash_stdout
+                    and self._hash_algorithm is not None
+                    and isinstance(pool_item.stdout, TaskPath)
+                ):
+                    stdout_hasher = StdoutHasher(pool_item.stdout, self._hash_algorithm)
+                    exit_stack.callback(stdout_hasher.close_write_end)
+                    popen_item = replace(pool_item, stdout=stdout_hasher.write_fd)
+                stdout_hashers.append(stdout_hasher)
+
+                popen = popen_item.to_popen(minibox, meta_write)
                 self._log(
                     "debug",
                     "Executing '" + " ".join(popen["args"]) + "'",
                     bypass_cache=True,
                 )
 
-                tmp_dir = TemporaryDirectory(prefix="pisek_")
+                tmp_dir = TemporaryDirectory(prefix="pisek_", dir=scratch_root())
                 exit_stack.enter_context(tmp_dir)
                 tmp_dirs.append(tmp_dir)
 
-                running_pool.append(subprocess.Popen(**popen, cwd=tmp_dir.name))
+                try:
+                    running_pool.append(
+                        self._start_subprocess(**popen, cwd=tmp_dir.name)
+                    )
+                finally:
+                    os.close(meta_write)
+                if stdout_hasher is not None:
+                    stdout_hasher.close_write_end()
 
             if self._callback is not None:
                 callback_exec = False
@@ -304,32 +511,113 @@ class ProgramsJob(TaskJob):
                         break
 
             run_results = []
-            for pool_item, process, tmp_dir, meta_file_path in zip(
-                self._program_pool, running_pool, tmp_dirs, meta_files
+            for pool_item, process, tmp_dir, meta_pipe, stdout_hasher in zip(
+                self._program_pool, running_pool, tmp_dirs, meta_pipes, stdout_hashers
             ):
                 self._wait_for_subprocess(process)
+                if stdout_hasher is not None:
+                    self._written_hashes[stdout_hasher.path.path] = (
+                        stdout_hasher.result()
+                    )
                 run_results.append(
-                    self._read_run_result(pool_item, process, meta_file_path)
+                    self._read_run_result(pool_item, process, meta_pipe.read().decode())
                 )
 
-                created_paths = self._listdir(TaskPath(tmp_dir.name))
-                if created_paths:
-                    file_list = "".join(
-                        [
-                            (
-                                self._quote_file_with_name(p)
-                                if self._is_file(p)
-                                else p.col_name(self._env) + "\n"
+                self._check_cwd_empty(pool_item, tmp_dir.name)
+
+        return run_results
+
+    def _run_programs_in_servers(self) -> list[RunResult]:
+        """Runs all programs in execution pool, each in an idle minibox server."""
+        servers: list[MiniboxServer] = []
+        stdout_hashers: list[StdoutHasher | None] = []
+        minibox = TaskPath.executable_path("_minibox").abspath
+        try:
+            with ExitStack() as exit_stack:
+                for pool_item in self._program_pool:
+                    stdout_hasher = None
+                    popen_item = pool_item
+                    if (
+                        pool_item.hash_stdout
+                        and self._hash_algorithm is not None
+                        and isinstance(pool_item.stdout, TaskPath)
+                    ):
+                        stdout_hasher = StdoutHasher(
+                            pool_item.stdout, self._hash_algorithm
+                        )
+                        exit_stack.callback(stdout_hasher.close_write_end)
+                        popen_item = replace(pool_item, stdout=stdout_hasher.write_fd)
+                    stdout_hashers.append(stdout_hasher)
+
+                    server = acquire_minibox_server(minibox)
+                    servers.append(server)
+                    args = (
+                        popen_item.minibox_args()
+                        + [f"--chdir={server.cwd}"]
+                        + popen_item.command()
+                    )
+                    self._log(
+                        "debug",
+                        f"Executing '{minibox} " + " ".join(args) + "'",
+                        bypass_cache=True,
+                    )
+                    server.start(args, popen_item.stdio())
+                    self._track_process(server)
+                    if stdout_hasher is not None:
+                        stdout_hasher.close_write_end()
+
+                run_results = []
+                for pool_item, server, stdout_hasher in zip(
+                    self._program_pool, servers, stdout_hashers
+                ):
+                    self._wait_for_subprocess(server)
+                    if stdout_hasher is not None:
+                        self._written_hashes[stdout_hasher.path.path] = (
+                            stdout_hasher.result()
+                        )
+                    if server.returncode not in (0, 1):
+                        try:
+                            message = self._parse_meta(server.meta).get(
+                                "message", server.meta
                             )
-                            for p in created_paths
-                        ]
-                    ).removesuffix("\n")
-                    raise PipelineItemFailure(
-                        f"'{pool_item.name}' created paths in cwd:\n" + tab(file_list)
+                        except PipelineItemFailure:
+                            message = server.meta  # Minibox failed before writing it
+                        raise PipelineItemFailure(f"Minibox error:\n{tab(message)}")
+                    assert server.returncode is not None
+                    run_results.append(
+                        self._parse_run_result(
+                            pool_item, server.returncode, server.meta
+                        )
                     )
+                    self._check_cwd_empty(pool_item, server.cwd)
+        finally:
+            for server in servers:
+                # Server is closed or serves other jobs from now on
+                self._untrack_process(server)
+                if server.returncode is None:
+                    server.close()  # Still running
+                else:
+                    release_minibox_server(server)
 
         return run_results
 
+    def _check_cwd_empty(self, pool_item: ProgramPoolItem, cwd: str) -> None:
+        created_paths = self._listdir(TaskPath(cwd))
+        if created_paths:
+            file_list = "".join(
+                [
+                    (
+                        self._quote_file_with_name(p)
+                        if self._is_file(p)
+                        else p.col_name(self._env) + "\n"
+                    )
+                    for p in created_paths
+                ]
+            ).removesuffix("\n")
+            raise PipelineItemFailure(
+                f"'{pool_item.name}' created paths in cwd:\n" + tab(file_list)
+            )
+
     def _run_program(
         self,
         program_role: ProgramRole,
@@ -338,8 +626,220 @@ class ProgramsJob(TaskJob):
     ) -> RunResult:
         """Loads one program and runs it."""
         self._load_program(program_role, program, **kwargs)
+        pool_item = self._program_pool[-1]
+        if self._can_batch(pool_item):
+            batch_program = None
+            if program.batch and program_role in (
+                ProgramRole.validator,
+                ProgramRole.judge,
+            ):
+                batch_program = BatchProgram(
+                    pool_item.executable,
+                    tuple(program.args),
+                    tuple(sorted(program.env.items())),
+                    pool_item.process_limit,
+                )
+            elif self._warm_start(program_role):
+                batch_program = self._python_forkserver(program, pool_item)
+
+            if batch_program is not None:
+                return self._run_batched(
+                    batch_program,
+                    BatchedRun(
+                        self._program_pool.pop(),
+                        kwargs.get("args", []),
+                        kwargs.get("env", {}),
+                    ),
+                )
         return self._run_programs()[0]
 
+    def _warm_start(self, program_role: ProgramRole) -> bool:
+        """Whether to start the program quickly at the cost of less exact timing."""
+        return self._env.warm_start and not program_role.is_solution()
+
+    def _python_forkserver(
+        self, program: RunSection, pool_item: ProgramPoolItem
+    ) -> BatchProgram | None:
+        """Batch program running a Python script in pre-imported interpreters."""
+        with open(pool_item.executable.path, "rb") as f:
+            first_line = f.readline().decode(errors="replace")
+        if not first_line.startswith("#!"):
+            return None
+        interpreter = first_line.removeprefix("#!").split()
+        if interpreter and os.path.basename(interpreter[0]) == "env":
+            interpreter = interpreter[1:]
+        if not interpreter or "python" not in os.path.basename(interpreter[0]):
+            return None
+        if not os.path.isabs(interpreter[0]):
+            interpreter = ["/usr/bin/env"] + interpreter
+
+        forkserver = files("pisek").joinpath("tools/python_forkserver.py")
+        return BatchProgram(
+            TaskPath(interpreter[0]),
+            (
+                *interpreter[1:],
+                str(forkserver),
+                pool_item.executable.abspath,
+                *program.args,
+            ),
+            tuple(sorted(program.env.items())),
+            # Forks for every testcase
+            0 if pool_item.process_limit == 0 else pool_item.process_limit + 1,
+        )
+
+    def _can_batch(self, pool_item: ProgramPoolItem) -> bool:
+        return (
+            self._callback is None
+            and len(self._program_pool) == 1
+            and not isinstance(pool_item.stdin, int)
+            and not isinstance(pool_item.stdout, int)
+        )
+
+    def _run_batched(self, program: BatchProgram, run: BatchedRun) -> RunResult:
+        """
+        Runs the program together with runs of the same program from other jobs.
+        While a batch runs, new runs wait and then form the next batch.
+        Several batches run at once if enough runs are waiting.
+
+        The batched program gets its configured arguments and on stdin one line
+        per testcase, each a JSON object with keys "args" and "env" (specific
+        to the testcase) and "stdin", "stdout", "stderr" (absolute paths
+        or null for none). After processing a testcase, the program writes
+        its exit code on a separate line to stdout, optionally followed by
+        the CPU time and wall clock time the testcase took in seconds.
+
+        If the batch fails, each testcase is run on its own.
+        """
+        pool_item = run.pool_item
+        key = (
+            program,
+            pool_item.time_limit,
+            pool_item.clock_limit,
+            pool_item.mem_limit,
+            None if pool_item.cpus is None else tuple(pool_item.cpus),
+        )
+        with _batch_condition:
+            queue = _batch_queues.setdefault(key, BatchQueue())
+            queue.waiting.append(run)
+
+        while True:
+            with _batch_condition:
+                while not run.done and not queue.can_start():
+                    _batch_condition.wait()
+                if run.done:
+                    break
+                queue.running += 1
+                batch = queue.waiting[:MAX_BATCH_SIZE]
+                del queue.waiting[:MAX_BATCH_SIZE]
+
+            results: Sequence[RunResult | None] = [None] * len(batch)
+            try:
+                results = self._run_batch(program, batch) or results
+            finally:
+                with _batch_condition:
+                    for batched_run, result in zip(batch, results):
+                        batched_run.result = result
+                        batched_run.done = True
+                    queue.running -= 1
+                    _batch_condition.notify_all()
+
+        if run.result is None:
+            self._program_pool.append(pool_item)
+            return self._run_programs()[0]
+        return run.result
+
+    def _run_batch(
+        self, program: BatchProgram, batch: list[BatchedRun]
+    ) -> list[RunResult] | None:
+        """Runs the program once for the whole batch. Returns None if it fails."""
+        for batched_run in batch:
+            for file in (batched_run.pool_item.stdout, batched_run.pool_item.stderr):
+                if isinstance(file, TaskPath):
+                    open(file.path, "w").close()
+
+        first = batch[0].pool_item
+        with TemporaryDirectory(prefix="pisek_batch_", dir=scratch_root()) as tmp_dir:
+            testcases = TaskPath(os.path.join(tmp_dir, "testcases"))
+            exit_codes = TaskPath(os.path.join(tmp_dir, "exit_codes"))
+            with open(testcases.path, "w") as f:
+                for batched_run in batch:
+                    f.write(json.dumps(batched_run.testcase()) + "\n")
+
+            self._program_pool.append(
+                replace(
+                    first,
+                    name=f"{first.name} (batch of {len(batch)})",
+                    executable=program.executable,
+                    args=list(program.args),
+                    env=dict(program.env),
+                    process_limit=program.process_limit,
+                    time_limit=first.time_limit * len(batch),
+                    clock_limit=first.clock_limit * len(batch),
+                    stdin=testcases,
+                    stdout=exit_codes,
+                    stderr=None,
+                )
+            )
+            try:
+                batch_rr = self._run_programs()[0]
+            finally:
+                self._program_pool.clear()
+            with open(exit_codes.path) as f:
+                lines = f.read().splitlines()
+
+        if batch_rr.kind != RunResultKind.OK or len(lines) != len(batch):
+            return None
+        returncodes: list[int] = []
+        measured: list[tuple[Decimal, Decimal] | None] = []
+        try:
+            for line in lines:
+                code, *reported = line.split()
+                returncodes.append(int(code))
+                if reported:
+                    cpu, wall = reported
+                    measured.append((Decimal(cpu), Decimal(wall)))
+                else:
+                    measured.append(None)
+        except (ValueError, ArithmeticError):
+            return None
+
+        # Testcases without reported times get the average of the whole batch
+        average = (
+            (batch_rr.time / len(batch)).quantize(Decimal("0.001")),
+            (batch_rr.wall_time / len(batch)).quantize(Decimal("0.001")),
+        )
+        results = []
+        for batched_run, returncode, times in zip(batch, returncodes, measured):
+            pool_item = batched_run.pool_item
+            time, wall_time = average if times is None else times
+            kind = RunResultKind.OK if returncode == 0 else RunResultKind.RUNTIME_ERROR
+            message = (
+                "Exited with return code 0"
+                if returncode == 0
+                else f"Exited with error status {returncode}"
+            )
+            if 0 < pool_item.time_limit < time:
+                kind, returncode = RunResultKind.TIMEOUT, -1
+                message = f"Timeout after {pool_item.time_limit}s"
+            elif 0 < pool_item.clock_limit < wall_time:
+                kind, returncode = RunResultKind.TIMEOUT, -1
+                message = f"Timeout after {pool_item.clock_limit}ws"
+            results.append(
+                RunResult(
+                    kind,
+                    returncode,
+                    time,
+                    wall_time,
+                    batch_rr.memory,
+                    pool_item.stdin,
+                    pool_item.stdout,
+                    pool_item.stderr,
+                    message,
+                    batch_rr.cpus,
+                )
+            )
+        return results
+
     def _run_tool(
         self,
         program: str,
@@ -348,6 +848,7 @@ class ProgramsJob(TaskJob):
         stdout: Optional[Union[TaskPath, int]] = None,
         stderr: Optional[LogPath] = None,
         env={},
+        hash_stdout: bool = False,
     ) -> RunResult:
         """Loads one program and runs it."""
         self._load_executable(
@@ -361,5 +862,6 @@ class ProgramsJob(TaskJob):
             stdout=stdout,
             stderr=stderr,
             env=env,
+            hash_stdout=hash_stdout,
         )
         return self._run_programs()[0]
@@ -11,6 +11,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from collections import defaultdict
+from collections.abc import Sequence
 from decimal import Decimal
 
 from pisek.jobs.jobs import State, Job
@@ -33,7 +34,7 @@ class ResourceStatistics(StatusJobManager):
 
     def get_status(self) -> str:
         def format_stat(
-            run_results: list[RunResult],
+            run_results: Sequence[RunResult],
             limit: Decimal | int,
             attr: str,
             dec_places: int = 0,
@@ -55,7 +56,7 @@ class ResourceStatistics(StatusJobManager):
             return [self._colored(str_value, color), "/", f"{limit:.{dec_places}f}"]
 
         def part_statistics(
-            name: str, run_results: list[RunResult], run_section: RunSection
+            name: str, run_results: Sequence[RunResult], run_section: RunSection
         ) -> list[str]:
             return [
                 f"{name:<30} ",
@@ -38,3 +38,9 @@ class RunResult:
     stdout_file: TaskPath | int | None = None
     stderr_file: TaskPath | None = None
     status: str = ""
+    cpus: tuple[int, ...] | None = None  # CPUs the program was pinned to
+    # Counters reported by minibox
+    context_switches: int | None = None
+    page_faults: int | None = None
+    read_bytes: int | None = None
+    written_bytes: int | None = None
@@ -11,6 +11,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from dataclasses import replace
 import os
 import tempfile
 import time
@@ -18,7 +19,9 @@ from typing import Optional, override
 
 from pisek.env.env import Env
 from pisek.jobs.jobs import State
+from pisek.jobs.resources import Resources
 from pisek.utils.paths import IInputPath, IOutputPath
+from pisek.utils.scratch import scratch_root
 from pisek.config.config_types import ProgramRole
 from pisek.config.task_config import RunSection
 from pisek.task_jobs.program import ProgramsJob, RunResult, RunResultKind
@@ -40,7 +43,10 @@ class RunSolution(ProgramsJob):
         super().__init__(env=env, name=name, **kwargs)
         self._needed_by = 1
         self.solution = solution
+        self._add_run_section(solution)
         self.is_primary = is_primary
+        # Timings measured in isolation must not be mixed with others in cache
+        self._isolate_timing = env.isolate_timing
 
         self.solution_rr: RunResult | None = None
         self._register_cached_attribute("solution_rr")
@@ -50,10 +56,13 @@ class RunSolution(ProgramsJob):
 
     def unrequire(self):
         self._needed_by -= 1
-        if self._needed_by == 0 and self.state == State.in_queue:
+        if self._needed_by == 0 and self.state in (State.in_queue, State.running):
             self.cancel()
         assert self._needed_by >= 0
 
+    def resources(self) -> Resources:
+        return replace(super().resources(), timed=self._isolate_timing)
+
     def _solution_type(self) -> ProgramRole:
         return (
             (ProgramRole.primary_solution)
@@ -122,7 +131,7 @@ class RunInteractive(RunCMSJudge, RunSolution):
 
     @override
     def _get_solution_run_res_kind(self) -> RunResultKind:
-        with tempfile.TemporaryDirectory() as fifo_dir:
+        with tempfile.TemporaryDirectory(dir=scratch_root()) as fifo_dir:
             fifo_from_solution = os.path.join(fifo_dir, "solution-to-manager")
             fifo_to_solution = os.path.join(fifo_dir, "manager-to-solution")
 
@@ -345,7 +345,7 @@ class SolutionManager(TaskJobManager, TestcaseInfoMixin):
             generator_run_results=run_gen_result.generator_run_results,
             testcase_results=testcase_results,
             tests_results=self._tests_results,
-            checker_outs=checker_outs,
+            checker_outs=frozenset(checker_outs),
         )
 
 
@@ -19,12 +19,14 @@ import filecmp
 from math import ceil
 import os
 import shutil
+import threading
 from typing import (
     Callable,
     Concatenate,
     Iterable,
     Literal,
     ParamSpec,
+    Protocol,
     TypeVar,
 )
 
@@ -42,6 +44,17 @@ from pisek.task_jobs.run_result import RunResult
 T = TypeVar("T")
 P = ParamSpec("P")
 
+# Guards subprocesses of jobs against being started and killed at once
+_subprocesses_lock = threading.Lock()
+
+
+class RunningProcess(Protocol):
+    """Process like subprocess.Popen."""
+
+    def wait(self) -> int: ...
+
+    def terminate(self) -> None: ...
+
 
 class TaskHelper:
     _env: Env
@@ -200,10 +213,28 @@ class TaskHelper:
 class TaskJob(Job, TaskHelper):
     """Job class that implements useful methods"""
 
+    def __init__(self, env: Env, name: str) -> None:
+        super().__init__(env, name)
+        # Running subprocesses, terminated when the job is cancelled
+        self._subprocesses: list[RunningProcess] = []
+
+    def cancel(self) -> None:
+        super().cancel()
+        if self.state == State.cancelled:
+            with _subprocesses_lock:
+                for popen in self._subprocesses:
+                    popen.terminate()
+
     def _access_dir(self, dirname: TaskPath, exclude_paths: Iterable[str] = ()) -> None:
         for file in self._globs_to_files(["**"], dirname, exclude=exclude_paths):
             self._access_file(file)
 
+    def _write_dir(self, dirname: TaskPath) -> None:
+        """Add files in directory this job has written."""
+        for file in self._globs_to_files(["**"], dirname):
+            if os.path.isfile(file.path):
+                self._write_file(file)
+
     @staticmethod
     def _file_access(files: int):
         """Adds first i args as accessed files."""
@@ -224,6 +255,8 @@ class TaskJob(Job, TaskHelper):
 
     @_file_access(1)
     def _open_file(self, filename: TaskPath, mode="r", **kwargs):
+        if any(c in mode for c in "wax+"):
+            self._write_file(filename)
         return super()._open_file(filename, mode, **kwargs)
 
     @_file_access(1)
@@ -246,6 +279,7 @@ class TaskJob(Job, TaskHelper):
     def _remove_file(self, filename: TaskPath) -> None:
         "Removes given file. It must be created inside this job."
         self._accessed_files.remove(filename.path)
+        self._written_files.discard(filename.path)
         return os.remove(filename.path)
 
     @_file_access(1)
@@ -262,12 +296,13 @@ class TaskJob(Job, TaskHelper):
     def _copy_file(self, filename: TaskPath, dst: TaskPath) -> None:
         self.make_filedirs(dst)
         shutil.copy(filename.path, dst.path)
+        self._write_file(dst)
 
     def _copy_dir(self, path: TaskPath, dst: TaskPath) -> None:
         self.make_filedirs(dst)
         shutil.copytree(path.path, dst.path)
         self._access_dir(path)
-        self._access_dir(dst)
+        self._write_dir(dst)
 
     def _copy_target(self, path: TaskPath, dst: TaskPath) -> None:
         if self._is_dir(path):
@@ -278,6 +313,7 @@ class TaskJob(Job, TaskHelper):
     @_file_access(2)
     def _rename_file(self, filename: TaskPath, dst: TaskPath) -> None:
         self.make_filedirs(dst)
+        self._write_file(dst)
         return os.rename(filename.path, dst.path)
 
     @_file_access(2)
@@ -298,6 +334,7 @@ class TaskJob(Job, TaskHelper):
             os.link(source, dst.path)
         except OSError:
             shutil.copyfile(source, dst.path)
+        self._write_file(dst)
 
     @_file_access(2)
     def _symlink_file(
@@ -322,17 +359,31 @@ class TaskJob(Job, TaskHelper):
         return super()._globs_to_files(globs, directory, exclude)
 
     def _run_subprocess(self, *args, **kwargs) -> subprocess.Popen:
-        process = subprocess.Popen(*args, **kwargs)
+        process = self._start_subprocess(*args, **kwargs)
         self._wait_for_subprocess(process)
         return process
 
-    def _wait_for_subprocess(self, popen: subprocess.Popen) -> None:
-        while popen.poll() is None:
-            try:
-                popen.wait(timeout=0.2)
-            except subprocess.TimeoutExpired:
-                pass
+    def _start_subprocess(self, *args, **kwargs) -> subprocess.Popen:
+        """Starts a subprocess that is terminated as soon as this job is cancelled."""
+        return self._track_process(subprocess.Popen(*args, **kwargs))
 
+    def _track_process[T: RunningProcess](self, process: T) -> T:
+        """Terminate running process as soon as this job is cancelled."""
+        with _subprocesses_lock:
+            self._subprocesses.append(process)
             if self.state == State.cancelled:
-                popen.terminate()
-                raise PipelineItemAbort(self)
+                process.terminate()
+        return process
+
+    def _untrack_process(self, process: RunningProcess) -> None:
+        """Stop terminating the process when this job is cancelled."""
+        with _subprocesses_lock:
+            if process in self._subprocesses:
+                self._subprocesses.remove(process)
+
+    def _wait_for_subprocess(self, popen: RunningProcess) -> None:
+        popen.wait()
+        with _subprocesses_lock:
+            self._subprocesses.remove(popen)
+        if self.state == State.cancelled:
+            raise PipelineItemAbort(self)
@@ -10,6 +10,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections.abc import Mapping
 from dataclasses import dataclass
 
 from pisek.utils.paths import IInputPath, IOutputPath
@@ -42,10 +43,10 @@ class TaskJobManager(StatusJobManager, TaskHelper):
             for inp in self._test_testcases(self._env.config.test_sections[0])
         ]
 
-    def _all_testcases(self) -> dict[int, list[TestcaseInfo]]:
+    def _all_testcases(self) -> Mapping[int, tuple[TestcaseInfo, ...]]:
         """Get all inputs grouped by test."""
         return self.prerequisite_result(DATA_MAN_CODE, DataManagerResult).testcase_infos
 
-    def _test_testcases(self, test: TestSection) -> list[TestcaseInfo]:
+    def _test_testcases(self, test: TestSection) -> tuple[TestcaseInfo, ...]:
         """Get all inputs of given test."""
         return self._all_testcases()[test.num]
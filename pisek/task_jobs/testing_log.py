@@ -76,6 +76,19 @@ class CreateTestingLog(TaskJobManager):
                     "wall_clock_time": detail.solution_run_result.wall_time,
                     "result": detail.result.verdict.name,
                 }
+                if detail.solution_run_result.cpus is not None:
+                    solution_results[inp.name]["cpus"] = list(
+                        detail.solution_run_result.cpus
+                    )
+                for counter in (
+                    "context_switches",
+                    "page_faults",
+                    "read_bytes",
+                    "written_bytes",
+                ):
+                    value = getattr(detail.solution_run_result, counter)
+                    if value is not None:
+                        solution_results[inp.name][counter] = value
 
                 if isinstance(detail.result, RelativeSolutionResult):
                     solution_results[inp.name]["relative_points"] = str(
@@ -186,6 +186,7 @@ class TextPreprocAbstract(ProgramsJob):
             stdin=input_,
             stdout=output,
             stderr=input_.to_sanitization_log(),
+            hash_stdout=True,
         )
         msg = self._read_file(result.stderr_file).strip()
         if result.returncode == 42:
@@ -32,6 +32,7 @@ class ValidatorJob(ProgramsJob):
     ):
         super().__init__(env=env, name=f"Validate {input_:n} on test {test}", **kwargs)
         self.validator = validator
+        self._add_run_section(validator)
         self.test = test
         self.input = input_
         self.log_file = input_.to_log(f"{validator.name}{test}")
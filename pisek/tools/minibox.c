@@ -25,6 +25,8 @@
 #include <sched.h>
 #include <time.h>
 #include <limits.h>
+#include <poll.h>
+#include <sys/socket.h>
 #include <sys/wait.h>
 #include <sys/time.h>
 #include <sys/signal.h>
@@ -55,6 +57,10 @@ static int max_processes = 1;
 static char *redir_stdin, *redir_stdout, *redir_stderr;
 static int redir_stderr_to_stdout;
 static char *set_cwd;
+#ifdef __linux__
+static int set_cpus;
+static cpu_set_t cpus;
+#endif
 
 static pid_t box_pid;
 
@@ -76,6 +82,8 @@ static int get_run_time_ms(struct rusage *rus);
 /*** Meta-files ***/
 
 static FILE *metafile;
+static int meta_json;		// Write meta as a JSON object instead of name:value lines
+static int meta_items;
 
 static void
 meta_open(const char *name)
@@ -91,22 +99,76 @@ meta_open(const char *name)
 }
 
 static void
-meta_close(void)
+meta_open_fd(const char *fd)
+{
+  metafile = fdopen(atoi(fd), "w");
+  if (!metafile)
+    die("Failed to open metafile descriptor %s: %m", fd);
+  fcntl(fileno(metafile), F_SETFD, FD_CLOEXEC);
+}
+
+/* Close the metafile without finishing it (inside the box) */
+static void
+meta_detach(void)
 {
   if (metafile && metafile != stdout)
     fclose(metafile);
+  metafile = NULL;
 }
 
-static void __attribute__((format(printf,1,2)))
-meta_printf(const char *fmt, ...)
+static void
+meta_close(void)
+{
+  if (metafile && meta_json)
+    fputs(meta_items ? "}\n" : "{}\n", metafile);
+  meta_detach();
+}
+
+static void
+meta_key(const char *key)
+{
+  if (meta_json)
+    fprintf(metafile, "%s\"%s\": ", meta_items++ ? ", " : "{", key);
+  else
+    fprintf(metafile, "%s:", key);
+}
+
+static void __attribute__((format(printf,2,3)))
+meta_number(const char *key, const char *fmt, ...)
 {
   if (!metafile)
     return;
 
+  meta_key(key);
   va_list args;
   va_start(args, fmt);
   vfprintf(metafile, fmt, args);
   va_end(args);
+  if (!meta_json)
+    fputc('\n', metafile);
+}
+
+static void
+meta_string(const char *key, const char *val)
+{
+  if (!metafile)
+    return;
+
+  meta_key(key);
+  if (!meta_json)
+    {
+      fprintf(metafile, "%s\n", val);
+      return;
+    }
+  fputc('"', metafile);
+  for (const unsigned char *c = (const unsigned char *) val; *c; c++)
+    if (*c == '"' || *c == '\\')
+      fprintf(metafile, "\\%c", *c);
+    else if (*c < 0x20)
+      fprintf(metafile, "\\u%04x", *c);
+    else
+      fputc(*c, metafile);
+  fputc('"', metafile);
 }
 
 static void
@@ -115,11 +177,16 @@ final_stats(struct rusage *rus)
   total_ms = get_run_time_ms(rus);
   wall_ms = get_wall_time_ms();
 
-  meta_printf("time:%d.%03d\n", total_ms/1000, total_ms%1000);
-  meta_printf("time-wall:%d.%03d\n", wall_ms/1000, wall_ms%1000);
-  meta_printf("max-rss:%ld\n", rus->ru_maxrss);
-  meta_printf("csw-voluntary:%ld\n", rus->ru_nvcsw);
-  meta_printf("csw-forced:%ld\n", rus->ru_nivcsw);
+  meta_number("time", "%d.%03d", total_ms/1000, total_ms%1000);
+  meta_number("time-wall", "%d.%03d", wall_ms/1000, wall_ms%1000);
+  meta_number("max-rss", "%ld", rus->ru_maxrss);
+  meta_number("csw-voluntary", "%ld", rus->ru_nvcsw);
+  meta_number("csw-forced", "%ld", rus->ru_nivcsw);
+  meta_number("page-faults-minor", "%ld", rus->ru_minflt);
+  meta_number("page-faults-major", "%ld", rus->ru_majflt);
+  // Block I/O operations are counted in 512-byte units
+  meta_number("read-bytes", "%lld", (long long) rus->ru_inblock * 512);
+  meta_number("write-bytes", "%lld", (long long) rus->ru_oublock * 512);
 }
 
 /*** Messages and exits ***/
@@ -131,7 +198,7 @@ box_exit(int rc)
     {
       kill(-box_pid, SIGKILL);
       kill(box_pid, SIGKILL);
-      meta_printf("killed:1\n");
+      meta_number("killed", "1");
 
       struct rusage rus;
       int p, stat;
@@ -182,7 +249,8 @@ die(char *msg, ...)
 
   // Otherwise, we in the box keeper process, so we report errors normally
   flush_line();
-  meta_printf("status:XX\nmessage:%s\n", buf);
+  meta_string("status", "XX");
+  meta_string("message", buf);
   fputs(buf, stderr);
   fputc('\n', stderr);
   box_exit(2);
@@ -197,12 +265,13 @@ err(char *msg, ...)
   flush_line();
   if (msg[0] && msg[1] && msg[2] == ':' && msg[3] == ' ')
     {
-      meta_printf("status:%c%c\n", msg[0], msg[1]);
+      char status[3] = { msg[0], msg[1], 0 };
+      meta_string("status", status);
       msg += 4;
     }
   char buf[1024];
   vsnprintf(buf, sizeof(buf), msg, args);
-  meta_printf("message:%s\n", buf);
+  meta_string("message", buf);
   if (!silent)
     {
       fputs(buf, stderr);
@@ -578,7 +647,7 @@ box_keeper(void)
       pid_t p;
       if (interrupt)
 	{
-	  meta_printf("exitsig:%d\n", interrupt);
+	  meta_number("exitsig", "%d", interrupt);
 	  err("SG: Interrupted");
 	}
       if (timer_tick)
@@ -611,7 +680,7 @@ box_keeper(void)
 	  final_stats(&rus);
 	  if (WEXITSTATUS(stat))
 	    {
-	      meta_printf("exitcode:%d\n", WEXITSTATUS(stat));
+	      meta_number("exitcode", "%d", WEXITSTATUS(stat));
 	      err("RE: Exited with error status %d", WEXITSTATUS(stat));
 	    }
 	  if (timeout && total_ms > timeout)
@@ -629,13 +698,13 @@ box_keeper(void)
 	}
       else if (WIFSIGNALED(stat))
 	{
-	  meta_printf("exitsig:%d\n", WTERMSIG(stat));
+	  meta_number("exitsig", "%d", WTERMSIG(stat));
 	  final_stats(&rus);
 	  err("SG: Caught fatal signal %d", WTERMSIG(stat));
 	}
       else if (WIFSTOPPED(stat))
 	{
-	  meta_printf("exitsig:%d\n", WSTOPSIG(stat));
+	  meta_number("exitsig", "%d", WSTOPSIG(stat));
 	  final_stats(&rus);
 	  err("SG: Stopped by signal %d", WSTOPSIG(stat));
 	}
@@ -680,6 +749,15 @@ setup_fds(void)
     }
 }
 
+static void
+setup_affinity(void)
+{
+#ifdef __linux__
+  if (set_cpus && sched_setaffinity(0, sizeof(cpus), &cpus) < 0)
+    die("sched_setaffinity: %m");
+#endif
+}
+
 static void
 setup_rlim(const char *res_name, int res, rlim_t limit)
 {
@@ -715,12 +793,13 @@ box_inside(void *arg)
   char **args = arg;
   write_errors_to_fd = error_pipes[1];
   close(error_pipes[0]);
-  meta_close();
+  meta_detach();
 
   reset_signals();
   setup_credentials();
   setup_fds();
   setup_rlimits();
+  setup_affinity();
   char **env = setup_environment();
 
   if (set_cwd && chdir(set_cwd))
@@ -777,6 +856,7 @@ Usage: minibox [<options>] <command>\n\
 \n\
 Options:\n\
 -c, --chdir=<dir>\tChange directory to <dir> before executing the program\n\
+    --cpus=<list>\tRun the program only on given CPUs (e.g. 0,2-3)\n\
 -f, --fsize=<size>\tMax size (in KB) of files that can be created\n\
 -E, --env=<var>\t\tInherit the environment variable <var> from the parent process\n\
 -E, --env=<var>=<val>\tSet the environment variable <var> to <val>; unset it if <var> is empty\n\
@@ -785,6 +865,8 @@ Options:\n\
 -e, --full-env\t\tInherit full environment of the parent process\n\
 -m, --mem=<size>\tLimit address space to <size> KB\n\
 -M, --meta=<file>\tOutput process information to <file> (name:value)\n\
+    --meta-fd=<fd>\tOutput process information to file descriptor <fd>\n\
+    --meta-json\t\tOutput process information as a JSON object\n\
 -s, --silent\t\tDo not print status messages except for fatal errors\n\
 -k, --stack=<size>\tLimit stack size to <size> KB (default: 0=unlimited)\n\
 -r, --stderr=<file>\tRedirect stderr to <file>\n\
@@ -798,29 +880,72 @@ Options:\n\
 \n\
 Commands:\n\
     --run -- <cmd> ...\tRun given command within sandbox\n\
+    --server\t\tRun commands requested on a unix socket on stdin (see the source)\n\
     --version\t\tDisplay program version and configuration\n\
 ");
   exit(2);
 }
 
+static void
+parse_cpus(char *list)
+{
+#ifdef __linux__
+  char *s = list, *end;
+  CPU_ZERO(&cpus);
+  while (*s)
+    {
+      long first = strtol(s, &end, 10), last = first;
+      if (end == s)
+	usage("Invalid CPU list: %s\n", list);
+      if (*end == '-')
+	{
+	  s = end + 1;
+	  last = strtol(s, &end, 10);
+	  if (end == s)
+	    usage("Invalid CPU list: %s\n", list);
+	}
+      if (first < 0 || last < first || last >= CPU_SETSIZE)
+	usage("Invalid CPU list: %s\n", list);
+      for (long cpu = first; cpu <= last; cpu++)
+	CPU_SET(cpu, &cpus);
+      if (*end == ',')
+	end++;
+      else if (*end)
+	usage("Invalid CPU list: %s\n", list);
+      s = end;
+    }
+  set_cpus = 1;
+#else
+  usage("Setting CPUs is not supported on this system: %s\n", list);
+#endif
+}
+
 enum opt_code {
   OPT_VERSION = 256,
   OPT_RUN,
   OPT_STDERR_TO_STDOUT,
+  OPT_CPUS,
+  OPT_SERVER,
+  OPT_META_FD,
+  OPT_META_JSON,
 };
 
 static const char short_opts[] = "b:c:d:eE:i:k:m:M:o:p::q:r:st:vw:x:";
 
 static const struct option long_opts[] = {
   { "chdir",		1, NULL, 'c' },
+  { "cpus",		1, NULL, OPT_CPUS },
   { "fsize",		1, NULL, 'f' },
   { "env",		1, NULL, 'E' },
   { "extra-time",	1, NULL, 'x' },
   { "full-env",		0, NULL, 'e' },
   { "mem",		1, NULL, 'm' },
   { "meta",		1, NULL, 'M' },
+  { "meta-fd",		1, NULL, OPT_META_FD },
+  { "meta-json",	0, NULL, OPT_META_JSON },
   { "processes",	2, NULL, 'p' },
   { "run",		0, NULL, OPT_RUN },
+  { "server",		0, NULL, OPT_SERVER },
   { "silent",		0, NULL, 's' },
   { "stack",		1, NULL, 'k' },
   { "stderr",		1, NULL, 'r' },
@@ -834,8 +959,8 @@ static const struct option long_opts[] = {
   { NULL,		0, NULL, 0 }
 };
 
-int
-main(int argc, char **argv)
+static int
+parse_options(int argc, char **argv)
 {
   int c;
   enum opt_code mode = 0;
@@ -868,6 +993,12 @@ main(int argc, char **argv)
       case 'M':
 	meta_open(optarg);
 	break;
+      case OPT_META_FD:
+	meta_open_fd(optarg);
+	break;
+      case OPT_META_JSON:
+	meta_json = 1;
+	break;
       case 'o':
 	redir_stdout = optarg;
 	break;
@@ -897,6 +1028,7 @@ main(int argc, char **argv)
 	extra_timeout = 1000*atof(optarg);
 	break;
       case OPT_RUN:
+      case OPT_SERVER:
       case OPT_VERSION:
 	if (!mode || (int) mode == c)
 	  mode = c;
@@ -907,9 +1039,277 @@ main(int argc, char **argv)
 	redir_stderr = NULL;
 	redir_stderr_to_stdout = 1;
 	break;
+      case OPT_CPUS:
+	parse_cpus(optarg);
+	break;
       default:
 	usage(NULL);
       }
+  return mode;
+}
+
+/*** Server mode ***/
+
+/*
+ *  In server mode, minibox reads requests from a unix socket on its stdin.
+ *  A request is a byte 'R' with exactly three file descriptors attached
+ *  (stdin, stdout and stderr of the program), a 32-bit length and
+ *  NUL-terminated arguments (options and the command as for --run).
+ *  For each request, a keeper process is forked, which runs the program
+ *  just like --run would, sending the meta file to the server. The reply
+ *  is a 32-bit exit code of the keeper, a 32-bit length and the meta file.
+ *  A byte 'K' terminates the running program (and is ignored otherwise).
+ */
+
+#define SERVER_FDS 3
+#define SERVER_MAX_REQUEST (1 << 20)
+
+static int server_sock;
+
+static int
+read_full(int fd, void *buf, size_t len)
+{
+  char *p = buf;
+  while (len)
+    {
+      ssize_t n = read(fd, p, len);
+      if (n < 0 && errno == EINTR)
+	continue;
+      if (n < 0)
+	die("read: %m");
+      if (!n)
+	return 0;
+      p += n;
+      len -= n;
+    }
+  return 1;
+}
+
+static void
+write_full(int fd, const void *buf, size_t len)
+{
+  const char *p = buf;
+  while (len)
+    {
+      ssize_t n = write(fd, p, len);
+      if (n < 0 && errno == EINTR)
+	continue;
+      if (n < 0)
+	die("write: %m");
+      p += n;
+      len -= n;
+    }
+}
+
+/* Wait for the next request, returns its command byte (0 at the end of input) */
+static int
+server_recv_command(int *fds, int *nfds)
+{
+  char cmd;
+  char cbuf[CMSG_SPACE(SERVER_FDS * sizeof(int))];
+  struct iovec iov = { .iov_base = &cmd, .iov_len = 1 };
+  struct msghdr msg = {
+    .msg_iov = &iov, .msg_iovlen = 1,
+    .msg_control = cbuf, .msg_controllen = sizeof(cbuf),
+  };
+  ssize_t n;
+  do
+    n = recvmsg(server_sock, &msg, 0);
+  while (n < 0 && errno == EINTR);
+  if (n < 0)
+    die("recvmsg: %m");
+  if (!n)
+    return 0;
+
+  *nfds = 0;
+  for (struct cmsghdr *c = CMSG_FIRSTHDR(&msg); c; c = CMSG_NXTHDR(&msg, c))
+    if (c->cmsg_level == SOL_SOCKET && c->cmsg_type == SCM_RIGHTS)
+      {
+	int k = (c->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+	if (*nfds + k > SERVER_FDS)
+	  die("Too many file descriptors in request");
+	memcpy(fds + *nfds, CMSG_DATA(c), k * sizeof(int));
+	*nfds += k;
+      }
+  if (msg.msg_flags & MSG_CTRUNC)
+    die("Truncated file descriptors in request");
+  return cmd;
+}
+
+static char **
+server_parse_args(char *payload, uint32_t len, int *argcp)
+{
+  int argc = 0;
+  for (uint32_t i=0; i < len; i++)
+    argc += !payload[i];
+  if (!len || payload[len-1])
+    die("Arguments in request are not NUL-terminated");
+
+  char **argv = xmalloc((argc + 2) * sizeof(char *));
+  argv[0] = "minibox";
+  char *arg = payload;
+  for (int i=1; i <= argc; i++)
+    {
+      argv[i] = arg;
+      arg += strlen(arg) + 1;
+    }
+  argv[argc+1] = NULL;
+  *argcp = argc + 1;
+  return argv;
+}
+
+static void NONRET
+server_keeper(char *payload, uint32_t len, int *fds, int meta_fd)
+{
+  close(server_sock);
+  for (int i=0; i < SERVER_FDS; i++)
+    if (dup2(fds[i], i) < 0)
+      die("dup2: %m");
+  for (int i=0; i < SERVER_FDS; i++)
+    if (fds[i] >= SERVER_FDS)
+      close(fds[i]);
+
+  metafile = fdopen(meta_fd, "w");
+  if (!metafile)
+    die("fdopen: %m");
+
+  int argc;
+  char **argv = server_parse_args(payload, len, &argc);
+#ifdef __APPLE__
+  optreset = 1;
+  optind = 1;
+#else
+  optind = 0;
+#endif
+  if (parse_options(argc, argv) != OPT_RUN || optind >= argc)
+    die("Server requests must run a command");
+
+  umask(022);
+  signal(SIGPIPE, SIG_DFL);
+  run(argv+optind);
+  exit(0);
+}
+
+static void
+server_run(char *payload, uint32_t len, int *fds)
+{
+  int meta_pipe[2];
+  if (pipe(meta_pipe) < 0)
+    die("pipe: %m");
+
+  pid_t keeper = fork();
+  if (keeper < 0)
+    die("fork: %m");
+  if (!keeper)
+    {
+      close(meta_pipe[0]);
+      server_keeper(payload, len, fds, meta_pipe[1]);
+    }
+  close(meta_pipe[1]);
+  for (int i=0; i < SERVER_FDS; i++)
+    close(fds[i]);
+
+  // Collect the meta file, watching for requests to terminate the program
+  size_t meta_len = 0, meta_size = 4096;
+  char *meta = xmalloc(meta_size);
+  int client_gone = 0;
+  for (;;)
+    {
+      struct pollfd pfds[2] = {
+	{ .fd = meta_pipe[0], .events = POLLIN },
+	{ .fd = server_sock, .events = POLLIN },
+      };
+      if (poll(pfds, client_gone ? 1 : 2, -1) < 0)
+	{
+	  if (errno == EINTR)
+	    continue;
+	  die("poll: %m");
+	}
+
+      if (pfds[1].revents)
+	{
+	  char cmd;
+	  ssize_t n = read(server_sock, &cmd, 1);
+	  if (n <= 0)
+	    client_gone = 1;
+	  if (n <= 0 || cmd == 'K')
+	    kill(keeper, SIGTERM);
+	}
+
+      if (pfds[0].revents)
+	{
+	  if (meta_len == meta_size)
+	    {
+	      meta_size *= 2;
+	      char *bigger = xmalloc(meta_size);
+	      memcpy(bigger, meta, meta_len);
+	      free(meta);
+	      meta = bigger;
+	    }
+	  ssize_t n = read(meta_pipe[0], meta + meta_len, meta_size - meta_len);
+	  if (n < 0 && errno == EINTR)
+	    continue;
+	  if (n < 0)
+	    die("read: %m");
+	  if (!n)
+	    break;
+	  meta_len += n;
+	}
+    }
+  close(meta_pipe[0]);
+
+  int stat;
+  while (waitpid(keeper, &stat, 0) < 0)
+    if (errno != EINTR)
+      die("waitpid: %m");
+
+  if (client_gone)
+    exit(0);
+
+  int32_t reply[2] = {
+    WIFEXITED(stat) ? WEXITSTATUS(stat) : 2,
+    meta_len,
+  };
+  write_full(server_sock, reply, sizeof(reply));
+  write_full(server_sock, meta, meta_len);
+  free(meta);
+}
+
+static void
+serve(void)
+{
+  server_sock = 0;
+  signal(SIGPIPE, SIG_IGN);
+
+  for (;;)
+    {
+      int fds[SERVER_FDS], nfds;
+      int cmd = server_recv_command(fds, &nfds);
+      if (!cmd)
+	break;
+      if (cmd == 'K')
+	continue;  // The program has already finished
+      if (cmd != 'R' || nfds != SERVER_FDS)
+	die("Invalid request");
+
+      uint32_t len;
+      if (!read_full(server_sock, &len, sizeof(len)))
+	break;
+      if (len > SERVER_MAX_REQUEST)
+	die("Request too long");
+      char *payload = xmalloc(len + 1);
+      if (!read_full(server_sock, payload, len))
+	break;
+
+      server_run(payload, len, fds);
+      free(payload);
+    }
+}
+
+int
+main(int argc, char **argv)
+{
+  enum opt_code mode = parse_options(argc, argv);
 
   if (!mode)
     usage("Please specify a minibox command (e.g. --run).\n");
@@ -928,6 +1328,9 @@ main(int argc, char **argv)
 	usage("--run mode requires a command to run\n");
       run(argv+optind);
       break;
+    case OPT_SERVER:
+      serve();
+      break;
     default:
       die("Internal error: mode mismatch");
     }
@@ -0,0 +1,157 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Runs a Python program on a batch of testcases (see `batch` in config documentation).
+Modules the program imports are imported once, then the program runs
+in a forked interpreter for each testcase.
+
+Usage: python_forkserver.py PROGRAM [ARGS...]
+
+Runs inside the sandbox with the interpreter of the program,
+so it must work with any Python 3 and use only the standard library.
+"""
+
+import ast
+import atexit
+import importlib.util
+import json
+import os
+import runpy
+import sys
+import time
+import traceback
+
+
+def preimport(program):
+    """Import modules of the standard library and installed packages the program uses."""
+    program_dir = os.path.dirname(os.path.realpath(program))
+    with open(program, "rb") as f:
+        tree = ast.parse(f.read(), program)
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+
+        for name in names:
+            try:
+                spec = importlib.util.find_spec(name)
+                # Modules of the program might have side effects
+                if spec is None or (spec.origin or "").startswith(program_dir + "/"):
+                    continue
+                __import__(name)
+            except Exception:
+                pass  # The program reports it itself
+
+
+def open_stdio(testcase):
+    flags = [os.O_RDONLY, os.O_WRONLY | os.O_CREAT | os.O_TRUNC]
+    for fd, name in enumerate(["stdin", "stdout", "stderr"]):
+        new_fd = os.open(testcase[name] or os.devnull, flags[min(fd, 1)], 0o666)
+        os.dup2(new_fd, fd)
+        os.close(new_fd)
+
+    sys.stdin = sys.__stdin__ = open(0, "r", closefd=False)  # type: ignore[misc]
+    sys.stdout = sys.__stdout__ = open(1, "w", closefd=False)  # type: ignore[misc]
+    sys.stderr = sys.__stderr__ = open(  # type: ignore[misc]
+        2, "w", buffering=1, errors="backslashreplace", closefd=False
+    )
+
+
+def exit_code(code):
+    """Exit code of the interpreter for sys.exit(code)."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xFF
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run(program, args, testcase):
+    """Runs the program in this (forked) process. Never returns."""
+    code = 1
+    try:
+        open_stdio(testcase)
+        os.environ.update(testcase["env"])
+        sys.argv = [program] + args + testcase["args"]
+        try:
+            runpy.run_path(program, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            code = exit_code(e.code)
+        except BaseException as e:
+            tb = e.__traceback__
+            # Hide frames of this file and runpy
+            while tb is not None and tb.tb_frame.f_code.co_filename != program:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb)
+
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except BaseException:
+        traceback.print_exc()
+        code = 120
+    finally:
+        os._exit(code)
+
+
+def main():
+    program = sys.argv[1]
+    args = sys.argv[2:]
+    sys.path[0] = os.path.dirname(os.path.realpath(program))
+
+    # Testcases are read from stdin and exit codes written to stdout,
+    # the programs get them redirected.
+    testcases = os.fdopen(os.dup(0), "r")
+    exit_codes = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    preimport(program)
+
+    for line in testcases:
+        testcase = json.loads(line)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            testcases.close()
+            exit_codes.close()
+            run(program, args, testcase)
+
+        _, status, rusage = os.wait4(pid, 0)
+        wall_time = time.monotonic() - start
+        if not os.WIFEXITED(status):
+            # Can't be told by exit code, let the testcase run on its own
+            sys.exit(1)
+        cpu_time = rusage.ru_utime + rusage.ru_stime
+        print(
+            "%d %.3f %.3f" % (os.WEXITSTATUS(status), cpu_time, wall_time),
+            file=exit_codes,
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,8 @@ from pisek.utils.paths import INTERNALS_DIR
 from pisek.utils.colors import color_settings
 from pisek.env.env import Env
 from pisek.config.task_config import load_config
-from pisek.jobs.cache import Cache
+from pisek.jobs.cache import Cache, DEFAULT_HASH_ALGORITHM
+from pisek.jobs.shared_cache import SharedCache, shared_cache_key
 
 P = ParamSpec("P")
 R = TypeVar("R")
@@ -47,6 +48,10 @@ def run_pipeline(
     pipeline_class: Callable[[Env], JobPipeline],
     disable_cache: bool = False,
     clean_non_accessed_files: bool = True,
+    shared_cache: str | None = None,
+    shared_cache_size: int = 10 * 1024,
+    file_hash: str = DEFAULT_HASH_ALGORITHM,
+    output_store: str = "auto",
     **env_args,
 ) -> None:
     with ChangedCWD(path):
@@ -55,11 +60,25 @@ def run_pipeline(
 
         cache = None
         if not disable_cache:
-            cache = Cache.load()
+            cache = Cache.load(
+                (
+                    None
+                    if shared_cache is None
+                    else SharedCache(
+                        shared_cache,
+                        shared_cache_size * 1024 * 1024,
+                        shared_cache_key(),
+                    )
+                ),
+                file_hash,
+                store_outputs={"auto": None, "always": True, "never": False}[
+                    output_store
+                ],
+            )
 
         all_accessed_files: set[str] = set()
         for i in range(env.repeat):
-            env.iteration = i  # XXX: Dirty trick
+            iteration_env = env.model_copy(update={"iteration": i})
             if env.repeat > 1:
                 if i != 0:
                     print()
@@ -70,8 +89,8 @@ def run_pipeline(
                 )
                 print()
 
-            pipeline = pipeline_class(env.fork())
-            failed = pipeline.run_jobs(cache, env)
+            pipeline = pipeline_class(iteration_env)
+            failed = pipeline.run_jobs(cache, iteration_env)
             if failed:
                 raise TestingFailed()
             all_accessed_files |= pipeline.all_accessed_files
@@ -0,0 +1,59 @@
+# pisek  - Tool for developing tasks for programming competitions.
+#
+# Copyright (c)   2019 - 2022 Václav Volhejn <vaclav.volhejn@gmail.com>
+# Copyright (c)   2019 - 2022 Jiří Beneš <mail@jiribenes.com>
+# Copyright (c)   2020 - 2022 Michal Töpfer <michal.topfer@gmail.com>
+# Copyright (c)   2022        Jiří Kalvoda <jirikalvoda@kam.mff.cuni.cz>
+# Copyright (c)   2023        Daniel Skýpala <skipy@kam.mff.cuni.cz>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+SCRATCH_DIR_ENV = "PISEK_SCRATCH_DIR"
+# In-memory filesystem, saves writing short-lived files to disk
+DEFAULT_SCRATCH_DIR = "/dev/shm"
+
+# Scratch directory is used only while it has this much free space left
+MIN_FREE_SPACE = 256 * 2**20
+MIN_FREE_FRACTION = 0.1
+
+_warned: set[str] = set()
+
+
+def _usable(directory: str) -> bool:
+    if not os.path.isdir(directory) or not os.access(directory, os.W_OK | os.X_OK):
+        return False
+    usage = shutil.disk_usage(directory)
+    return usage.free >= max(MIN_FREE_SPACE, MIN_FREE_FRACTION * usage.total)
+
+
+def scratch_root() -> str:
+    """
+    Directory for working directories of programs and other temporary files.
+    It is $PISEK_SCRATCH_DIR if set, otherwise /dev/shm if present.
+    Falls back to the default temporary directory if it isn't writable or is almost full.
+    """
+    requested = os.environ.get(SCRATCH_DIR_ENV)
+    directory = requested or DEFAULT_SCRATCH_DIR
+    if _usable(directory):
+        return directory
+
+    if requested and requested not in _warned:
+        _warned.add(requested)
+        logger.warning(
+            f"Scratch directory '{requested}' is not writable or almost full, "
+            f"using '{tempfile.gettempdir()}' instead."
+        )
+    return tempfile.gettempdir()
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import fcntl
 import glob
 import os
 import shutil
@@ -21,6 +22,8 @@ from typing import Iterable
 
 from pisek.utils.paths import BUILD_DIR, TESTS_DIR, INTERNALS_DIR, TaskPath
 
+FICLONE = 0x40049409  # From linux/fs.h
+
 
 class ChangedCWD:
     def __init__(self, path):
@@ -43,6 +46,28 @@ def clean_task_dir(task_dir: str) -> None:
             pass
 
 
+def reflink_file(src: str, dst: str) -> bool:
+    """
+    Copy src to dst by sharing its data blocks (reflink), without copying the data.
+    Unlike a hardlink, later writes to either file don't affect the other one.
+    Returns False (and leaves no dst) if the filesystem doesn't support it.
+    """
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        try:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+
+def clone_file(src: str, dst: str) -> None:
+    """Copy src to dst, sharing data blocks if the filesystem supports it."""
+    if not reflink_file(src, dst):
+        shutil.copyfile(src, dst)
+
+
 def clean_non_relevant_files(accessed_files: set[str]) -> None:
     accessed_dirs = {os.path.dirname(file) for file in accessed_files}
     for root, _, files in os.walk(TESTS_DIR):
@@ -0,0 +1,275 @@
+"""
+Tests the job cache and its on-disk format.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+from pisek.jobs.cache import (
+    CACHE_CONTENT_DIR,
+    MB,
+    SAVED_LAST_SIGNATURES,
+    Cache,
+    CacheEntry,
+    Journal,
+)
+from pisek.jobs.cache_tools import DAY
+from pisek.jobs.shared_cache import SharedCache
+
+
+def make_entry(
+    name: str,
+    signature: str,
+    last_hit: float | None = None,
+    produced: dict[str, str] | None = None,
+    duration: float = 1.0,
+) -> CacheEntry:
+    entry = CacheEntry(
+        name=name,
+        signature=signature,
+        cached_attributes={},
+        envs=[],
+        files=[],
+        globs=[],
+        prerequisites_results=[],
+        output=[],
+        logs=[],
+        produced=produced or {},
+        duration=duration,
+    )
+    if last_hit is not None:
+        entry.last_hit = last_hit
+    return entry
+
+
+class TestInTempDir(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd_orig = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp(prefix="pisek-test_")
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd_orig)
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestJournal(TestInTempDir):
+    def test_read_missing(self) -> None:
+        journal = Journal("journal")
+        self.assertEqual(list(journal.read()), [])
+        self.assertEqual(journal.size, 0)
+
+    def test_append(self) -> None:
+        journal = Journal("journal")
+        growth = journal.append("a") + journal.append("b")
+        self.assertEqual(growth, journal.size)
+        self.assertEqual(list(Journal("journal").read()), ["a", "b"])
+
+    def test_torn_record(self) -> None:
+        journal = Journal("journal")
+        journal.append("a")
+        journal.append("b")
+        size = journal.size
+        with open("journal", "ab") as f:
+            f.write(pickle.dumps("torn")[:-3])
+
+        journal = Journal("journal")
+        self.assertEqual(list(journal.read()), ["a", "b"])
+        self.assertEqual(journal.records, 2)
+        # Reading never truncates (the record can still be being written)
+        torn_size = journal.size
+        self.assertGreater(torn_size, size)
+
+        # The incomplete record is dropped on append
+        growth = journal.append("c")
+        self.assertEqual(torn_size + growth, journal.size)
+        self.assertEqual(size + len(pickle.dumps("c")), journal.size)
+        self.assertEqual(list(Journal("journal").read()), ["a", "b", "c"])
+
+    def test_rewrite(self) -> None:
+        journal = Journal("journal")
+        for record in range(10):
+            journal.append(record)
+
+        old_size = journal.size
+        growth = journal.rewrite([8, 9])
+        self.assertEqual(old_size + growth, journal.size)
+        self.assertEqual(journal.records, 2)
+        self.assertEqual(list(Journal("journal").read()), [8, 9])
+
+    def test_rewrite_empty(self) -> None:
+        journal = Journal("journal")
+        journal.append("a")
+        journal.rewrite([])
+        self.assertFalse(os.path.exists("journal"))
+
+
+class TestCompaction(TestInTempDir):
+    def test_compacted_on_load(self) -> None:
+        cache = Cache.load()
+        for i in range(4 * SAVED_LAST_SIGNATURES):
+            cache.add(make_entry("Run solve on input 01.in", f"sig{i}"))
+        (journal_path,) = os.listdir(CACHE_CONTENT_DIR)
+        journal_path = os.path.join(CACHE_CONTENT_DIR, journal_path)
+        size = os.path.getsize(journal_path)
+
+        cache = Cache.load()
+        entries = cache["Run solve on input 01.in"]
+        self.assertEqual(
+            [e.signature for e in entries],
+            [
+                f"sig{i}"
+                for i in range(3 * SAVED_LAST_SIGNATURES, 4 * SAVED_LAST_SIGNATURES)
+            ],
+        )
+        self.assertLess(os.path.getsize(journal_path), size)
+        self.assertEqual(len(list(Journal(journal_path).read())), SAVED_LAST_SIGNATURES)
+
+
+class TestLazyLoading(TestInTempDir):
+    def setUp(self) -> None:
+        super().setUp()
+        cache = Cache.load()
+        cache.add(make_entry("Run solve on input 01.in", "a"))
+        cache.add(make_entry("Run solve on input 02.in", "b"))
+        cache.add(make_entry("Generate inputs", "c"))
+
+    def test_nothing_loaded(self) -> None:
+        cache = Cache.load()
+        self.assertEqual(cache.entry_names(), [])
+
+    def test_segment_loaded(self) -> None:
+        cache = Cache.load()
+        self.assertIn("Run solve on input 01.in", cache)
+        # Only entries of the same segment are loaded
+        self.assertEqual(
+            sorted(cache.entry_names()),
+            ["Run solve on input 01.in", "Run solve on input 02.in"],
+        )
+        self.assertEqual(cache.last_entry("Run solve on input 02.in").signature, "b")
+
+    def test_missing_name(self) -> None:
+        cache = Cache.load()
+        self.assertNotIn("Run solve on input 03.in", cache)
+        self.assertNotIn("Generate inputs", cache.entry_names())
+
+    def test_load_all(self) -> None:
+        cache = Cache.load()
+        cache.load_all()
+        self.assertEqual(len(cache.entry_names()), 3)
+
+    def test_hash_index(self) -> None:
+        os.mkdir("a")
+        os.mkdir("b")
+        for path in ("a/file", "b/file"):
+            with open(path, "w") as f:
+                f.write(path)
+        old = os.path.getmtime("a/file") - 1
+        for path in ("a/file", "b/file"):
+            os.utime(path, (old, old))  # Not modified racily
+
+        cache = Cache.load()
+        hashes = {path: cache.file_hash(path) for path in ("a/file", "b/file")}
+        cache.export()
+
+        cache = Cache.load()
+        self.assertEqual(cache.hash_index, {})
+        self.assertEqual(cache.file_hash("a/file"), hashes["a/file"])
+        self.assertEqual(list(cache.hash_index), ["a/file"])
+
+
+class TestPrune(TestInTempDir):
+    def entry_names(self) -> list[str]:
+        cache = Cache.load()
+        cache.load_all()
+        return sorted(cache.entry_names())
+
+    def test_max_entries(self) -> None:
+        cache = Cache.load()
+        for i in range(5):
+            cache.add(make_entry(f"Job {i}", "sig", last_hit=1000 + i))
+        cache.move_to_top(cache.last_entry("Job 0"))
+
+        self.assertEqual(cache.prune(MB, 2), (3, 0))
+        self.assertEqual(self.entry_names(), ["Job 0", "Job 4"])
+
+    def test_max_age(self) -> None:
+        now = time.time()
+        cache = Cache.load()
+        cache.add(make_entry("Old", "sig", last_hit=now - 10 * DAY))
+        cache.add(make_entry("New", "sig", last_hit=now - DAY))
+
+        self.assertEqual(cache.prune(MB, 10, max_age=2 * DAY), (1, 0))
+        self.assertEqual(self.entry_names(), ["New"])
+
+    def test_max_size(self) -> None:
+        cache = Cache.load(store_outputs=True)
+        for i in range(3):
+            with open(f"output{i}", "w") as f:
+                f.write(f"{i}" * 1000)
+            produced = cache.store_files([f"output{i}"])
+            cache.add(make_entry(f"Job {i}", "sig", 1000 + i, produced))
+        # Entries older than a removed one are removed too, even if they fit
+        cache.add(make_entry("Job 3", "sig", 900))
+
+        self.assertEqual(cache.prune(1500, 10), (3, 2))
+        self.assertEqual(self.entry_names(), ["Job 2"])
+        self.assertEqual(cache.stats().objects, 1)
+
+        # Removed outputs cannot be restored
+        cache = Cache.load()
+        self.assertTrue(cache.has_object(cache.last_entry("Job 2").produced["output2"]))
+        self.assertFalse(cache.restore_file("output0", cache.file_hash("output0")))
+
+    def test_stats(self) -> None:
+        cache = Cache.load()
+        for i in range(3):
+            cache.add(make_entry(f"Run solve on input 0{i}.in", "sig"))
+        cache.move_to_top(cache.last_entry("Run solve on input 01.in"))
+        cache.prune(MB, 2)
+
+        stats = Cache.load(read_only=True).stats()
+        self.assertEqual(stats.entries, 2)
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.segments, {"Run solve on input": (2, 1)})
+
+
+class TestSharedObjects(TestInTempDir):
+    def setUp(self) -> None:
+        super().setUp()
+        self.shared = SharedCache("shared", 100 * MB, b"secret")
+        os.mkdir("tests")
+        with open("tests/output", "w") as f:
+            f.write("contents")
+        uploader = Cache.load(store_outputs=True)
+        produced = uploader.store_files(["tests/output"])
+        uploader.add(make_entry("Job", "sig", produced=produced))
+        self.shared.add(
+            uploader.last_entry("Job"), {produced["tests/output"]: "tests/output"}
+        )
+        self.file_hash = produced["tests/output"]
+        shutil.rmtree(".pisek")
+        os.remove("tests/output")
+
+    def test_restore(self) -> None:
+        cache = Cache.load(self.shared)
+        self.assertTrue(cache.restore_file("tests/output", self.file_hash))
+        with open("tests/output") as f:
+            self.assertEqual(f.read(), "contents")
+
+    def test_corrupted(self) -> None:
+        with open(self.shared.object_path(self.file_hash), "w") as f:
+            f.write("corrupted")
+
+        cache = Cache.load(self.shared)
+        self.assertFalse(cache.restore_file("tests/output", self.file_hash))
+        self.assertFalse(os.path.exists("tests/output"))
+        self.assertFalse(cache.has_object(self.file_hash))
+
+
+if __name__ == "__main__":
+    unittest.main()
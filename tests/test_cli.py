@@ -2,7 +2,14 @@
 Tests the command-line interface.
 """
 
+import glob
 import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
 
 import unittest
 from io import StringIO
@@ -11,6 +18,15 @@ from unittest import mock
 from tests.util import TestFixture
 
 from pisek.__main__ import main
+from pisek.jobs.cache import Cache
+from pisek.jobs import executors
+from pisek.jobs.executors import WORKER_KEY_ENV
+from pisek.jobs.job_pipeline import JobPipeline
+from pisek.jobs.jobs import Job, State
+from pisek.jobs.shared_cache import SHARED_CACHE_KEY_ENV
+from pisek.task_jobs.program import ProgramsJob
+from pisek.task_jobs.solution.solution import RunSolution
+from pisek.utils.scratch import SCRATCH_DIR_ENV, scratch_root
 
 
 class TestCLI(TestFixture):
@@ -55,6 +71,210 @@ class TestCLITestGenerator(TestCLI):
         return [["test", "generator"]]
 
 
+class TestCLISharedCache(TestCLI):
+    def setUp(self) -> None:
+        super().setUp()
+        self.shared_cache = tempfile.TemporaryDirectory()
+        os.environ[SHARED_CACHE_KEY_ENV] = "secret"
+
+    def tearDown(self) -> None:
+        del os.environ[SHARED_CACHE_KEY_ENV]
+        self.shared_cache.cleanup()
+        super().tearDown()
+
+    def args(self) -> list[list[str]]:
+        return [["test", "--shared-cache", self.shared_cache.name], ["clean"]]
+
+    def runTest(self) -> None:
+        super().runTest()
+
+        run = Job.run
+        restore_file = Cache.restore_file
+        ran_jobs = []
+        restored = []
+
+        def record_run(job, env):
+            ran_jobs.append(job)
+            return run(job, env)
+
+        def record_restore(cache, path, file_hash):
+            if restore_file(cache, path, file_hash):
+                restored.append(path)
+                return True
+            return False
+
+        with mock.patch("sys.stdout", new=StringIO()):
+            with mock.patch("sys.stderr", new=StringIO()):
+                with mock.patch.object(Job, "run", record_run):
+                    with mock.patch.object(Cache, "restore_file", record_restore):
+                        self.assertFalse(
+                            main(["test", "--shared-cache", self.shared_cache.name])
+                        )
+
+        # Solutions were loaded from the shared cache with their outputs
+        # (programs are built again as their builds are not stored)
+        self.assertFalse([job for job in ran_jobs if isinstance(job, RunSolution)])
+        self.assertTrue(restored)
+        for path in restored:
+            self.assertTrue(os.path.isfile(path))
+
+
+class DetachedJobsCheck:
+    """Mixin checking that some jobs ran detached (in other processes)."""
+
+    def runTest(self) -> None:
+        apply_when_done = executors._apply_when_done
+        self.detached_jobs: list[Job] = []
+
+        def record_job(job, worker_future):
+            self.detached_jobs.append(job)
+            return apply_when_done(job, worker_future)
+
+        with mock.patch.object(executors, "_apply_when_done", record_job):
+            super().runTest()
+
+        # Some jobs may have been cancelled, but others must have run
+        self.assertIn(State.succeeded, [job.state for job in self.detached_jobs])
+        for job in self.detached_jobs:
+            if job.state == State.succeeded:
+                self.assertIsNotNone(job.duration)
+
+
+class TestCLIProcessExecutor(DetachedJobsCheck, TestCLI):
+    def args(self) -> list[list[str]]:
+        return [["test", "--executor", "processes"]]
+
+
+class TestCLIRemoteExecutor(DetachedJobsCheck, TestCLI):
+    def setUp(self) -> None:
+        super().setUp()
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.address = f"127.0.0.1:{s.getsockname()[1]}"
+
+        os.environ[WORKER_KEY_ENV] = "secret"
+        self.worker = subprocess.Popen(
+            [sys.executable, "-m", "pisek", "worker", "--listen", self.address],
+            stdout=subprocess.PIPE,
+            text=True,
+            start_new_session=True,  # To kill its pool processes too
+        )
+        assert self.worker.stdout is not None
+        self.worker.stdout.readline()  # Wait until it listens
+
+    def tearDown(self) -> None:
+        os.killpg(self.worker.pid, signal.SIGKILL)
+        self.worker.communicate()
+        del os.environ[WORKER_KEY_ENV]
+        super().tearDown()
+
+    def args(self) -> list[list[str]]:
+        return [["test", "--executor", "remote", "--workers", self.address]]
+
+
+class TestCLIIsolateTiming(TestCLI):
+    def args(self) -> list[list[str]]:
+        return [["test", "--isolate-timing"]]
+
+    def runTest(self) -> None:
+        finalize_job = JobPipeline._finalize_job
+        solution_results = []
+
+        def record_job(pipeline, job, cache):
+            finalize_job(pipeline, job, cache)
+            if isinstance(job, RunSolution) and job.solution_rr is not None:
+                solution_results.append(job.solution_rr)
+
+        with mock.patch.object(JobPipeline, "_finalize_job", record_job):
+            super().runTest()
+
+        # Solutions ran pinned to cores this process can use
+        self.assertTrue(solution_results)
+        for run_result in solution_results:
+            self.assertTrue(run_result.cpus)
+            self.assertLessEqual(set(run_result.cpus), os.sched_getaffinity(0))
+
+
+class TestCLIWarmStart(TestCLI):
+    def args(self) -> list[list[str]]:
+        return [["test", "--warm-start"]]
+
+    def runTest(self) -> None:
+        run_batch = ProgramsJob._run_batch
+        forkserver_results = []
+
+        def record_batch(job, program, batch):
+            results = run_batch(job, program, batch)
+            if any(arg.endswith("python_forkserver.py") for arg in program.args):
+                forkserver_results.append(results)
+            return results
+
+        with mock.patch.object(ProgramsJob, "_run_batch", record_batch):
+            super().runTest()
+
+        # Python generator and validator run in the forkserver
+        self.assertTrue(forkserver_results)
+        self.assertNotIn(None, forkserver_results)
+
+
+@unittest.skipUnless(shutil.which("java"), "Java is not installed")
+class TestCLIJavaWarmStart(TestCLI):
+    @property
+    def fixture_path(self) -> str:
+        return "fixtures/max/"
+
+    def args(self) -> list[list[str]]:
+        return [["test", "solutions", "solve_java_simple", "--warm-start"]]
+
+    def runTest(self) -> None:
+        super().runTest()
+
+        # The program was built with a class data archive and run with it
+        warm_scripts = glob.glob("build/**/solve_java_simple/run-warm", recursive=True)
+        self.assertTrue(warm_scripts)
+        for warm_script in warm_scripts:
+            self.assertTrue(
+                os.path.isfile(
+                    os.path.join(os.path.dirname(warm_script), "classes.jsa")
+                )
+            )
+
+
+class TestCLIScratchDirFallback(TestCLI):
+    def setUp(self) -> None:
+        super().setUp()
+        os.environ[SCRATCH_DIR_ENV] = "/nonexistent/scratch"
+
+    def tearDown(self) -> None:
+        del os.environ[SCRATCH_DIR_ENV]
+        super().tearDown()
+
+    def runTest(self) -> None:
+        self.assertEqual(scratch_root(), tempfile.gettempdir())
+
+        check_cwd_empty = ProgramsJob._check_cwd_empty
+        cwds = []
+
+        def record_cwd(job, pool_item, cwd):
+            cwds.append(cwd)
+            return check_cwd_empty(job, pool_item, cwd)
+
+        with mock.patch.object(ProgramsJob, "_check_cwd_empty", record_cwd):
+            super().runTest()
+
+        # Programs ran in working directories in the fallback directory
+        self.assertTrue(cwds)
+        for cwd in cwds:
+            self.assertEqual(os.path.dirname(cwd), tempfile.gettempdir())
+
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            with mock.patch.dict(os.environ, {SCRATCH_DIR_ENV: scratch_dir}):
+                with mock.patch.multiple(
+                    "pisek.utils.scratch", MIN_FREE_SPACE=0, MIN_FREE_FRACTION=0
+                ):
+                    self.assertEqual(scratch_root(), scratch_dir)
+
+
 class TestCLIClean(TestCLI):
     def args(self) -> list[list[str]]:
         return [["clean"]]
@@ -93,5 +313,27 @@ class TestCLIStats(TestCLI):
         return [["test", "--stats"]]
 
 
+class TestCLICache(TestCLI):
+    def cache_command(self, *args: str) -> str:
+        with mock.patch("sys.stdout", new=StringIO()) as std_out:
+            self.assertFalse(main(["cache", *args]))
+        return std_out.getvalue()
+
+    def runTest(self) -> None:
+        super().runTest()
+        entries = Cache.load(read_only=True).stats().entries
+        self.assertGreater(entries, 10)
+        self.assertIn(f"Entries: {entries} ", self.cache_command("stats"))
+
+        self.assertIn(
+            f"Removed {entries - 10} entries",
+            self.cache_command("prune", "--max-entries", "10"),
+        )
+        self.assertEqual(Cache.load(read_only=True).stats().entries, 10)
+        self.assertIn("Entries: 10 ", self.cache_command("stats"))
+
+        super().runTest()  # Pruned jobs run again
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
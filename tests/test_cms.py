@@ -98,6 +98,30 @@ class TestStrictValidator(TestSumCMS):
         overwrite_file(self.task_dir, "validate.py", "validate_strict.py")
 
 
+class TestBatchValidator(TestSumCMS):
+    """A validator that validates several inputs in one run."""
+
+    def modify_task(self) -> None:
+        overwrite_file(self.task_dir, "validate.py", "validate_batch.py")
+
+        def modification_fn(raw_config):
+            raw_config["run_validator"] = {"batch": "yes"}
+
+        modify_config(self.task_dir, modification_fn)
+
+
+class TestBatchValidatorRejects(TestBatchValidator):
+    """A batched validator rejecting one of the inputs."""
+
+    def expecting_success(self) -> bool:
+        return False
+
+    def modify_task(self) -> None:
+        super().modify_task()
+        with open(os.path.join(self.task_dir, "sample_02.in"), "w") as f:
+            f.write("1 2 3\n")
+
+
 class TestDirtySample(TestSumCMS):
     """Sample without newline at the end."""
 
@@ -0,0 +1,153 @@
+"""
+Tests scheduling of jobs in the pipeline.
+"""
+
+from collections import deque
+import heapq
+import unittest
+from unittest import mock
+
+from tests.test_cache import TestInTempDir, make_entry
+
+from pisek.jobs.cache import Cache
+from pisek.jobs.jobs import Job, PipelineItem, State
+from pisek.jobs.job_pipeline import DEFAULT_JOB_DURATION, JobPipeline
+
+
+class DummyJob(Job):
+    def __init__(self, env, name: str) -> None:
+        super().__init__(env, name)
+
+    def _run(self) -> str:
+        return self.name
+
+
+class DummyPipeline(JobPipeline):
+    def __init__(self, cache: Cache | None) -> None:
+        super().__init__()
+        # Scheduling state normally set up by run_jobs
+        self._cache = cache
+        self._waiting: set[Job] = set()
+        self._ready_jobs: list[tuple[float, int, Job]] = []
+        self._critical_paths: dict[Job, float] = {}
+        self._ready_counter = 0
+        self._ready_managers = deque()
+        self._job_managers_of = {}
+        self._dirty_managers = set()
+
+    def add_jobs(self, *jobs: Job) -> None:
+        for job in jobs:
+            self._waiting.add(job)
+        for job in jobs:
+            job.set_on_ready(self._item_ready)
+
+    def ready_jobs(self) -> list[str]:
+        """Names of ready jobs in the order they would be started."""
+        return [job.name for _, _, job in sorted(self._ready_jobs)]
+
+
+def make_env() -> mock.Mock:
+    return mock.Mock(**{"get_accessed.return_value": set()})
+
+
+class TestReadiness(unittest.TestCase):
+    def setUp(self) -> None:
+        self.ready: list[PipelineItem] = []
+        self.env = make_env()
+
+    def test_no_prerequisites(self) -> None:
+        job = DummyJob(self.env, "A")
+        job.set_on_ready(self.ready.append)
+        self.assertEqual(self.ready, [job])
+
+    def test_prerequisites_finished(self) -> None:
+        first, second = DummyJob(self.env, "A"), DummyJob(self.env, "B")
+        job = DummyJob(self.env, "C")
+        job.add_prerequisite(first, "first")
+        job.add_prerequisite(second)
+        job.set_on_ready(self.ready.append)
+        self.assertEqual(self.ready, [])
+
+        for prerequisite in (first, second):
+            prerequisite.result = prerequisite.name
+            prerequisite.state = State.succeeded
+            prerequisite.finish()
+        self.assertEqual(self.ready, [job])
+        self.assertEqual(job.prerequisite_result("first", str), "A")
+
+    def test_prerequisite_failed(self) -> None:
+        prerequisite, job = DummyJob(self.env, "A"), DummyJob(self.env, "B")
+        job.add_prerequisite(prerequisite)
+        dependant = DummyJob(self.env, "C")
+        dependant.add_prerequisite(job)
+        for item in (job, dependant):
+            item.set_on_ready(self.ready.append)
+
+        prerequisite.state = State.failed
+        prerequisite.finish()
+        # Cancelled jobs are ready to be cleaned up
+        self.assertEqual(self.ready, [job, dependant])
+        self.assertEqual(job.state, State.cancelled)
+        self.assertEqual(dependant.state, State.cancelled)
+
+    def test_prerequisite_finished_before(self) -> None:
+        prerequisite = DummyJob(self.env, "A")
+        prerequisite.result = "A"
+        prerequisite.state = State.succeeded
+        prerequisite.finish()
+
+        job = DummyJob(self.env, "B")
+        job.add_prerequisite(prerequisite, "first")
+        job.set_on_ready(self.ready.append)
+        self.assertEqual(self.ready, [job])
+        self.assertEqual(job.prerequisite_result("first", str), "A")
+
+
+class TestCriticalPath(TestInTempDir):
+    def setUp(self) -> None:
+        super().setUp()
+        self.env = make_env()
+        self.cache = Cache.load()
+        for name, duration in [("Short", 1), ("Long", 10), ("Then", 5)]:
+            self.cache.add(make_entry(name, "sig", duration=duration))
+
+    def test_durations(self) -> None:
+        pipeline = DummyPipeline(self.cache)
+        long, then = DummyJob(self.env, "Long"), DummyJob(self.env, "Then")
+        then.add_prerequisite(long)
+        self.assertEqual(pipeline._critical_path(long), 15)
+        self.assertEqual(pipeline._critical_path(then), 5)
+
+    def test_unknown_durations(self) -> None:
+        pipeline = DummyPipeline(None)
+        job, dependant = DummyJob(self.env, "Short"), DummyJob(self.env, "Then")
+        dependant.add_prerequisite(job)
+        self.assertEqual(pipeline._critical_path(job), 2 * DEFAULT_JOB_DURATION)
+
+    def test_similar_jobs(self) -> None:
+        self.cache.add(make_entry("Run solve on input 01.in", "sig", duration=2))
+        self.cache.add(make_entry("Run solve on input 02.in", "sig", duration=4))
+        pipeline = DummyPipeline(self.cache)
+        job = DummyJob(self.env, "Run solve on input 03.in")
+        self.assertEqual(pipeline._critical_path(job), 3)
+
+    def test_ready_order(self) -> None:
+        pipeline = DummyPipeline(self.cache)
+        short, long = DummyJob(self.env, "Short"), DummyJob(self.env, "Long")
+        # Short job followed by a long one should start first
+        before_long = DummyJob(self.env, "Short")
+        long_after = DummyJob(self.env, "Long")
+        long_after.add_prerequisite(before_long)
+        pipeline.add_jobs(short, long, before_long, long_after)
+        self.assertEqual(pipeline.ready_jobs(), ["Short", "Long", "Short"])
+        self.assertIs(heapq.heappop(pipeline._ready_jobs)[2], before_long)
+
+    def test_ties_keep_order(self) -> None:
+        pipeline = DummyPipeline(self.cache)
+        jobs = [DummyJob(self.env, "Short") for _ in range(3)]
+        pipeline.add_jobs(*jobs)
+        self.assertEqual([job for _, _, job in sorted(pipeline._ready_jobs)], jobs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests resource reservations of jobs.
+"""
+
+from contextlib import AbstractContextManager
+from typing import Any
+import unittest
+from unittest import mock
+
+from pisek.jobs import resources
+from pisek.jobs.resources import CoreAssignment, Resources, ResourceBudget
+
+
+class TestResourceBudget(unittest.TestCase):
+    def test_packing(self) -> None:
+        budget = ResourceBudget(4, 1000)
+        for _ in range(4):
+            self.assertTrue(budget.fits(Resources()))
+            budget.reserve(Resources())
+        self.assertFalse(budget.fits(Resources()))
+
+        budget.release(Resources())
+        self.assertTrue(budget.fits(Resources()))
+        self.assertFalse(budget.fits(Resources(cpus=2)))
+
+    def test_memory(self) -> None:
+        budget = ResourceBudget(4, 1000)
+        budget.reserve(Resources(memory=600))
+        self.assertFalse(budget.fits(Resources(memory=600)))
+        self.assertTrue(budget.fits(Resources(memory=400)))
+        # Jobs with unknown memory usage are limited only by CPUs
+        self.assertTrue(budget.fits(Resources()))
+
+    def test_big_job_runs_alone(self) -> None:
+        budget = ResourceBudget(2, 1000)
+        big = Resources(cpus=4, memory=2000)
+        self.assertTrue(budget.fits(big))
+        budget.reserve(big)
+        self.assertFalse(budget.fits(Resources()))
+
+        budget.release(big)
+        self.assertTrue(budget.fits(Resources()))
+
+    def test_peak(self) -> None:
+        budget = ResourceBudget(4, 1000)
+        budget.reserve(Resources(cpus=2, memory=100))
+        budget.reserve(Resources(cpus=1, memory=500))
+        budget.release(Resources(cpus=2, memory=100))
+        budget.reserve(Resources(cpus=1, memory=100))
+        self.assertEqual(budget.peak, Resources(3, 600))
+
+
+class TestCoreAssignment(unittest.TestCase):
+    def test_split(self) -> None:
+        cores = CoreAssignment([0, 1, 2, 3])
+        self.assertEqual(cores.assign(Resources()), [2, 3])
+        self.assertEqual(cores.assign(Resources(timed=True)), [0])
+        self.assertEqual(cores.assign(Resources(cpus=2, timed=True)), [1])
+        self.assertFalse(cores.fits(Resources(timed=True)))
+        # Untimed jobs always fit on the shared cores
+        self.assertTrue(cores.fits(Resources()))
+
+    def test_release(self) -> None:
+        cores = CoreAssignment([0, 1, 2, 3])
+        timed = Resources(timed=True)
+        first, second = cores.assign(timed), cores.assign(timed)
+        cores.release(timed, first)
+        self.assertTrue(cores.fits(timed))
+        self.assertEqual(cores.assign(timed), first)
+        self.assertNotEqual(first, second)
+
+    def test_multiple_cores(self) -> None:
+        cores = CoreAssignment(list(range(8)))
+        timed = Resources(cpus=3, timed=True)
+        self.assertEqual(cores.assign(timed), [0, 1, 2])
+        self.assertFalse(cores.fits(timed))
+        self.assertTrue(cores.fits(Resources(timed=True)))
+
+    def test_single_core(self) -> None:
+        cores = CoreAssignment([5])
+        self.assertEqual(cores.assign(Resources(timed=True)), [5])
+        self.assertEqual(cores.assign(Resources()), [5])
+
+
+class TestCgroupLimits(unittest.TestCase):
+    def cgroup_files(self, files: dict[str, str]) -> AbstractContextManager[Any]:
+        return mock.patch.multiple(
+            resources,
+            _cgroup_paths=lambda _: ["/sys/fs/cgroup/task", "/sys/fs/cgroup"],
+            _read_cgroup_file=files.get,
+        )
+
+    def test_cpu_v2(self) -> None:
+        with self.cgroup_files(
+            {
+                "/sys/fs/cgroup/task/cpu.max": "150000 100000",
+                "/sys/fs/cgroup/cpu.max": "max 100000",
+            }
+        ):
+            self.assertEqual(resources._cgroup_cpus(), 2)
+
+    def test_cpu_v1(self) -> None:
+        with self.cgroup_files(
+            {
+                "/sys/fs/cgroup/task/cpu.cfs_quota_us": "-1",
+                "/sys/fs/cgroup/cpu.cfs_quota_us": "300000",
+                "/sys/fs/cgroup/cpu.cfs_period_us": "100000",
+            }
+        ):
+            self.assertEqual(resources._cgroup_cpus(), 3)
+
+    def test_memory(self) -> None:
+        with self.cgroup_files(
+            {
+                "/sys/fs/cgroup/task/memory.max": "max",
+                "/sys/fs/cgroup/memory.limit_in_bytes": str(2**20),
+            }
+        ):
+            self.assertEqual(resources._cgroup_memory(), 2**20)
+
+    def test_unlimited(self) -> None:
+        with self.cgroup_files(
+            {"/sys/fs/cgroup/memory.limit_in_bytes": str(resources.UNLIMITED_V1)}
+        ):
+            self.assertIsNone(resources._cgroup_memory())
+            self.assertIsNone(resources._cgroup_cpus())
+
+
+if __name__ == "__main__":
+    unittest.main()